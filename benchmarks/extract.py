@@ -0,0 +1,109 @@
+"""Micro-benchmark of the html extraction of the providers
+
+    Times the regexes the providers used before src/extract.py against it on
+    pages that are one huge line, like minified pages. Recorded pages can be
+    given as arguments, otherwise pages of --size megabytes are generated.
+
+    The old regexes backtrack so much on a page without the link they look for
+    that they are only timed on pages up to --old-limit megabytes. They also
+    only find one image a line, see the number found.
+
+    Run from the root of the repository:
+        python benchmarks/extract.py [PAGE ...]
+"""
+
+import os
+import re
+import sys
+import time
+import click
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from src import extract
+
+
+# What the providers used before, see the git history of src/providers
+OLD = {
+    "first chapter link": lambda page: re.search(r'<a.+href=["\']([^"\']+)["\'][^>]*>(?=.*first chapter).*?</a>', page, re.IGNORECASE),
+    "next link": lambda page: re.findall(r'<a(?!.*disabled).*?href=["\']([^"\']+)["\'][^>]*>(?=.*next).*?</a>', page, re.IGNORECASE),
+    "images": lambda page: re.findall(r'<img.*src=["\']([^"\']*)["\']', page),
+    "json blobs": lambda page: re.findall(r'{\\"order\\":[0-9]*,\\"url\\":\\["\']([^"\']*)\\["\']', page),
+}
+NEW = {
+    "first chapter link": lambda page: extract.find_links(page, "first chapter"),
+    "next link": lambda page: extract.find_links(page, "next", exclude="disabled"),
+    "images": lambda page: extract.images(page),
+    "json blobs": lambda page: extract.json_blobs(page, "order"),
+}
+
+
+def generate(size: int, last: bool = False) -> str:
+    """Generates a minified chapter page of about size bytes on one line
+
+        last: whether it's the last chapter, without next and first chapter links
+            which is the worst case of the old regexes
+    """
+
+    parts = ['<html><head><title>Chapter</title></head><body><nav>']
+    parts += [f'<a class="item" href="/series/chapter-{i}"><span>Chapter {i}</span></a>' for i in range(200)]
+    parts.append('</nav><div class="reader">')
+    i = 0
+    while sum(len(part) for part in parts[-100:]) * len(parts) // 100 < size:
+        parts.append(f'<div class="page"><img alt="page {i}" loading="lazy" src="https://cdn.example.com/series/{i}.webp"></div>')
+        parts.append(f'<script>self.__next_f.push([1,"{{\\"order\\":{i},\\"url\\":\\"https://cdn.example.com/series/{i}.webp\\"}}"])</script>')
+        i += 1
+    if not last:
+        parts.append('<a class="prev disabled" href="/series/chapter-1">Prev</a><a class="next" href="/series/chapter-3">Next</a>')
+        parts.append('<a href="/series/chapter-1">First Chapter</a>')
+    parts.append('</div></body></html>')
+    return "".join(parts)
+
+def measure(fn, page: str, timeout: float) -> tuple[float, int]:
+    """Seconds fn takes on page, the fastest of a few runs, and how many results it found"""
+
+    best = None
+    runs = 0
+    start = time.perf_counter()
+    while runs < 5 and time.perf_counter() - start < timeout:
+        run_start = time.perf_counter()
+        result = fn(page)
+        elapsed = time.perf_counter() - run_start
+        best = elapsed if best is None else min(best, elapsed)
+        runs += 1
+    found = int(result is not None) if result is None or isinstance(result, re.Match) else len(result)
+    return best, found
+
+def describe(measurement: tuple[float, int] | None) -> str:
+    """Formats a measurement"""
+
+    if measurement is None:
+        return f"{"skipped":>10}            "
+    return f"{measurement[0] * 1000:10.1f} ms {f"({measurement[1]})":>8}"
+
+
+@click.command()
+@click.help_option("-h", "--help")
+@click.argument("pages", nargs=-1, type=click.Path(exists=True, dir_okay=False))
+@click.option("-s", "--size", "sizes", default=[0.05, 1, 4], multiple=True, type=float, show_default=True, help="Megabytes of the generated pages, can be repeated.")
+@click.option("--old-limit", "old_limit", default=0.1, type=float, show_default=True, help="Megabytes of the biggest page the old regexes are timed on.")
+@click.option("-t", "--timeout", "timeout", default=10.0, type=float, show_default=True, help="Seconds to keep repeating a measurement for.")
+def main(pages: tuple[str], sizes: list[float], old_limit: float, timeout: float) -> None:
+    """Times the old provider regexes against src/extract.py"""
+
+    inputs = [(path, open(path, "r", encoding="utf-8", errors="replace").read()) for path in pages]
+    if not inputs:
+        for size in sizes:
+            inputs.append((f"generated {size:g} MB", generate(int(size * 1024 * 1024))))
+            inputs.append((f"generated {size:g} MB last chapter", generate(int(size * 1024 * 1024), last=True)))
+
+    for name, page in inputs:
+        click.echo(f"{name} ({len(page) / 1024 / 1024:.1f} MB)")
+        for case in NEW:
+            new = measure(NEW[case], page, timeout)
+            old = measure(OLD[case], page, timeout) if len(page) <= old_limit * 1024 * 1024 else None
+            click.echo(f"    {case:20} old {describe(old)}    new {describe(new)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,324 @@
+"""End to end benchmark of man2cbz against the synthetic site
+
+    Downloads the series of benchmarks/synthetic_site.py in the page shape of every
+    provider, downloads the first again with the pages it cached to measure
+    revalidating them, then compiles the first download to cbz and html, converts both
+    ways and opens the cbz file like the ui does, decoding every page. Every
+    stage runs man2cbz in a new process with its own workspace as the root
+    directory, so the time and peak memory (max RSS, which leaves out the
+    processes compile packs volumes in) are those of that stage alone.
+
+    Results are written as json, and --compare prints how they changed from
+    the results of an earlier run, like the last release:
+        {
+            "created": str, "commit": str | None, "python": str, "platform": str, "cpus": int,
+            "config": {option: value},
+            "site": {"requests": int, "errors": int, "image_bytes": int},
+            "stages": [{
+                "stage": str, "seconds": float, "items": int, "bytes": int, "items_per_second": float,
+                "megabytes_per_second": float, "peak_rss_megabytes": float | None, "ok": bool, "error": str | None,
+            }],
+        }
+
+    Run from the root of the repository:
+        python benchmarks/pipeline.py [OPTIONS]
+"""
+
+import os
+import sys
+import json
+import time
+import shutil
+import platform
+import tempfile
+import datetime
+import subprocess
+import click
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from benchmarks.synthetic_site import IMAGE_FORMATS, PROVIDERS, Site
+from src.manifest import MANIFEST_NAME
+
+
+# Runs man2cbz with the directory in the first argument as its root directory
+CLI = """
+import os, sys
+sys.path.insert(0, {root!r})
+sys.argv = [os.path.join(sys.argv[1], "man2cbz"), *sys.argv[2:]]
+from src.man2cbz import cli
+cli(prog_name="man2cbz")
+"""
+# Opens a cbz file like the ui does, lays out every page and decodes them
+UI = """
+import sys, json, time
+sys.path.insert(0, {root!r})
+from src import ui
+start = time.perf_counter()
+reader = ui.get_reader(sys.argv[1])
+if reader is None:
+    raise SystemExit(f"{{sys.argv[1]}} is not a valid cbz file.")
+chapters = reader.chapters()
+for chapter in chapters:
+    for page in chapter:
+        reader.size(page)
+opened = time.perf_counter() - start
+for chapter in chapters:
+    for page in chapter:
+        ui.decode(reader, page).close()
+print(json.dumps({{"open_seconds": opened}}))
+"""
+NAME = "Bench"
+
+
+def run(arguments: list[str], cwd: str) -> dict:
+    """Runs python with arguments in a new process
+
+        Returns {"seconds": float, "peak_rss_megabytes": float | None, "returncode": int, "stdout": str, "stderr": str},
+        the peak memory is only known where os.wait4 is.
+    """
+
+    with tempfile.TemporaryFile("w+") as stdout, tempfile.TemporaryFile("w+") as stderr:
+        start = time.perf_counter()
+        process = subprocess.Popen([sys.executable, *arguments], cwd=cwd, stdin=subprocess.DEVNULL, stdout=stdout, stderr=stderr)
+        peak = None
+        if hasattr(os, "wait4"):
+            _, status, usage = os.wait4(process.pid, 0)
+            process.returncode = os.waitstatus_to_exitcode(status)
+            # Kilobytes on Linux, bytes on macOS
+            peak = usage.ru_maxrss / 1024 / (1024 if sys.platform == "darwin" else 1)
+        else:
+            process.wait()
+        seconds = time.perf_counter() - start
+
+        stdout.seek(0)
+        stderr.seek(0)
+        return {"seconds": seconds, "peak_rss_megabytes": peak, "returncode": process.returncode, "stdout": stdout.read(), "stderr": stderr.read()}
+
+def run_cli(workspace: str, arguments: list[str]) -> dict:
+    """Runs man2cbz with workspace as its root directory"""
+
+    return run(["-c", CLI.format(root=ROOT), workspace, *arguments], workspace)
+
+def size(path: str) -> tuple[int, int]:
+    """Gets the number of files under path and their bytes, the manifest isn't counted"""
+
+    if os.path.isfile(path):
+        return 1, os.path.getsize(path)
+
+    count = 0
+    total = 0
+    for directory, _, names in os.walk(path):
+        for name in names:
+            if name == MANIFEST_NAME or name.endswith(".json") or name.endswith(".html") or name.endswith(".part"):
+                continue
+            count += 1
+            total += os.path.getsize(os.path.join(directory, name))
+    return count, total
+
+def record(stage: str, result: dict, output: str, items: int | None = None) -> dict:
+    """Makes the record of a stage from the result of its process and what it made at output"""
+
+    count, total = size(output) if os.path.exists(output) else (0, 0)
+    items = count if items is None else items
+
+    error = None
+    if result["returncode"] != 0 or "Error occurred" in result["stderr"] or "incomplete" in result["stderr"]:
+        error = result["stderr"].strip().splitlines()[-1] if result["stderr"].strip() else f"exited with {result["returncode"]}"
+    elif not os.path.exists(output):
+        error = f"{output} wasn't made."
+
+    return {
+        "stage": stage,
+        "seconds": result["seconds"],
+        "items": items,
+        "bytes": total,
+        "items_per_second": items / result["seconds"],
+        "megabytes_per_second": total / 1024 / 1024 / result["seconds"],
+        "peak_rss_megabytes": result["peak_rss_megabytes"],
+        "ok": error is None,
+        "error": error,
+    }
+
+def pipeline(site: Site, workspace: str, providers: list[str], workers: int | None, engine: str, jobs: int | None) -> list[dict]:
+    """Runs every stage once in workspace"""
+
+    stages = []
+    for provider in providers:
+        directory = os.path.join(workspace, provider)
+        os.makedirs(directory)
+        arguments = ["download", site.url(provider), "--provider", provider, "--engine", engine]
+        if workers is not None:
+            arguments += ["--workers", str(workers)]
+        stages.append(record(f"download {provider}", run_cli(directory, arguments), os.path.join(directory, "temp_images")))
+
+    # The same download with the pages cached by the first, so its pages are revalidated
+    directory = os.path.join(workspace, "again")
+    os.makedirs(directory)
+    shutil.copytree(os.path.join(workspace, providers[0], "page_cache"), os.path.join(directory, "page_cache"))
+    arguments = ["download", site.url(providers[0]), "--provider", providers[0], "--engine", engine]
+    if workers is not None:
+        arguments += ["--workers", str(workers)]
+    stages.append(record(f"download {providers[0]} again", run_cli(directory, arguments), os.path.join(directory, "temp_images")))
+
+    directory = os.path.join(workspace, providers[0])
+    jobs_arguments = [] if jobs is None else ["--jobs", str(jobs)]
+    cbz = os.path.join(directory, f"{NAME}.cbz")
+    html = os.path.join(directory, f"{NAME}Html")
+    pages = size(os.path.join(directory, "temp_images"))[0]
+
+    stages.append(record("compile cbz", run_cli(directory, ["compile", NAME, "--format", "cbz", *jobs_arguments]), cbz, pages))
+    stages.append(record("compile html", run_cli(directory, ["compile", f"{NAME}Html", "--format", "html"]), html))
+    stages.append(record("convert cbz to html", run_cli(directory, ["convert", f"{NAME}.cbz", *jobs_arguments]), os.path.join(directory, NAME)))
+    stages.append(record("convert html to cbz", run_cli(directory, ["convert", f"{NAME}Html", *jobs_arguments]), f"{html}.cbz", pages))
+
+    result = run(["-c", UI.format(root=ROOT), cbz], directory)
+    stage = record("ui", result, cbz, pages)
+    if stage["ok"]:
+        stage["open_seconds"] = json.loads(result["stdout"].strip().splitlines()[-1])["open_seconds"]
+    stages.append(stage)
+    return stages
+
+def fastest(runs: list[list[dict]]) -> list[dict]:
+    """Keeps the fastest run of each stage, failed runs only if every run of the stage failed"""
+
+    return [
+        min(stage_runs, key=lambda stage: (not stage["ok"], stage["seconds"]))
+        for stage_runs in zip(*runs)
+    ]
+
+def describe(stage: dict) -> str:
+    """Formats the record of a stage"""
+
+    peak = "-" if stage["peak_rss_megabytes"] is None else f"{stage["peak_rss_megabytes"]:.0f} MB"
+    line = f"{stage["stage"]:22} {stage["seconds"]:8.2f} s {stage["items_per_second"]:9.1f}/s {stage["megabytes_per_second"]:8.1f} MB/s {peak:>8}"
+    if not stage["ok"]:
+        line += f"    failed: {stage["error"]}"
+    return line
+
+def compare(old: dict, new: dict) -> list[tuple[str, float]]:
+    """Prints how every stage changed from old results, returns the change in seconds of each in percent"""
+
+    old_stages = {stage["stage"]: stage for stage in old["stages"]}
+    changes = []
+    click.echo(f"\nCompared to {old.get("commit") or "the old results"} from {old.get("created")}:")
+    for stage in new["stages"]:
+        if stage["stage"] not in old_stages:
+            continue
+        before = old_stages[stage["stage"]]
+        change = (stage["seconds"] / before["seconds"] - 1) * 100
+        changes.append((stage["stage"], change))
+        line = f"{stage["stage"]:22} {before["seconds"]:8.2f} s -> {stage["seconds"]:8.2f} s {change:+7.1f}%"
+        if before["peak_rss_megabytes"] is not None and stage["peak_rss_megabytes"] is not None:
+            line += f"    {before["peak_rss_megabytes"]:6.0f} MB -> {stage["peak_rss_megabytes"]:6.0f} MB"
+        click.echo(line)
+    return changes
+
+def commit() -> str | None:
+    """Gets the commit being benchmarked, None outside of a git repository"""
+
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+@click.command()
+@click.help_option("-h", "--help")
+@click.option("-c", "--chapters", "chapters", default=20, type=click.IntRange(min=1), show_default=True, help="Number of chapters of the series.")
+@click.option("-i", "--images", "images", default=10, type=click.IntRange(min=1), show_default=True, help="Number of images of each chapter.")
+@click.option("-s", "--image-size", "image_size", default=(800, 1200), type=(int, int), show_default=True, help="Width and height of the images.", metavar="WIDTH HEIGHT")
+@click.option("-f", "--image-format", "image_format", default="jpeg", type=click.Choice(list(IMAGE_FORMATS)), show_default=True, help="Format of the images.")
+@click.option("-l", "--latency", "latency", default=0.0, type=click.FloatRange(min=0), show_default=True, help="Seconds every response of the site is delayed by.")
+@click.option("-e", "--error-rate", "error_rate", default=0.0, type=click.FloatRange(0, 1), show_default=True, help="Fraction of chapter and image requests that fail.")
+@click.option("--error-status", "error_status", default=503, type=click.IntRange(400, 599), show_default=True, help="Status code of the failed requests.")
+@click.option("-t", "--truncate-rate", "truncate_rate", default=0.0, type=click.FloatRange(0, 1), show_default=True, help="Fraction of images cut off halfway.")
+@click.option("--seed", "seed", default=0, type=int, show_default=True, help="Seed of the failed requests.")
+@click.option("-p", "--provider", "providers", default=list(PROVIDERS), multiple=True, type=click.Choice(list(PROVIDERS)), show_default=True, help="Page shapes to download, can be repeated, the first one is compiled.")
+@click.option("-w", "--workers", "workers", default=None, type=click.IntRange(min=1), show_default="download's default", help="Workers of download.")
+@click.option("--engine", "engine", default="thread", type=click.Choice(["thread", "async"]), show_default=True, help="Engine of download.")
+@click.option("-j", "--jobs", "jobs", default=None, type=click.IntRange(min=1), show_default="number of cpus", help="Jobs of compile and convert.")
+@click.option("-r", "--runs", "runs", default=1, type=click.IntRange(min=1), show_default=True, help="Runs of the whole pipeline, the fastest run of each stage is kept.")
+@click.option("-o", "--output", "output", default=None, type=click.Path(dir_okay=False), show_default="benchmarks/results/DATE-COMMIT.json", help="Where the results are written.")
+@click.option("--compare", "compare_path", default=None, type=click.Path(exists=True, dir_okay=False), help="Results of an earlier run to compare with.")
+@click.option("--max-regression", "max_regression", default=None, type=click.FloatRange(min=0), help="Fail if a stage is this many percent slower than in --compare.", metavar="PERCENT")
+@click.option("--keep", "keep", default=False, is_flag=True, help="Keep the workspaces to look at what each stage made.")
+def main(
+        chapters: int,
+        images: int,
+        image_size: tuple[int, int],
+        image_format: str,
+        latency: float,
+        error_rate: float,
+        error_status: int,
+        truncate_rate: float,
+        seed: int,
+        providers: tuple[str],
+        workers: int | None,
+        engine: str,
+        jobs: int | None,
+        runs: int,
+        output: str | None,
+        compare_path: str | None,
+        max_regression: float | None,
+        keep: bool,
+) -> None:
+    """Measures the throughput and peak memory of every stage of man2cbz"""
+
+    config = {
+        "chapters": chapters, "images": images, "image_size": list(image_size), "image_format": image_format,
+        "latency": latency, "error_rate": error_rate, "error_status": error_status, "truncate_rate": truncate_rate,
+        "seed": seed, "providers": list(dict.fromkeys(providers)), "workers": workers, "engine": engine, "jobs": jobs, "runs": runs,
+    }
+    site = Site(chapters, images, image_size, image_format, latency, error_rate, error_status, truncate_rate, seed=seed)
+    site.start()
+    click.echo(f"Serving {chapters} chapters of {images} images of {len(site.image) / 1024:.0f} KB at {site.host()}")
+
+    workspace = tempfile.mkdtemp(prefix="man2cbz-benchmark-")
+    all_runs = []
+    try:
+        for run_number in range(runs):
+            run_workspace = os.path.join(workspace, str(run_number + 1))
+            all_runs.append(pipeline(site, run_workspace, config["providers"], workers, engine, jobs))
+            click.echo(f"Run {run_number + 1}/{runs} took {sum(stage["seconds"] for stage in all_runs[-1]):.1f} seconds.")
+    finally:
+        site.stop()
+        if keep:
+            click.echo(f"Kept the workspaces in {workspace}")
+        else:
+            shutil.rmtree(workspace, ignore_errors=True)
+
+    results = {
+        "created": datetime.datetime.now().astimezone().isoformat(timespec="seconds"),
+        "commit": commit(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+        "config": config,
+        "site": {"requests": site.requests, "errors": site.errors, "image_bytes": len(site.image)},
+        "stages": fastest(all_runs),
+    }
+
+    click.echo(f"\n{"stage":22} {"time":>10} {"items":>11} {"throughput":>13} {"peak":>8}")
+    for stage in results["stages"]:
+        click.echo(describe(stage))
+
+    if output is None:
+        output = os.path.join(ROOT, "benchmarks", "results", f"{datetime.datetime.now():%Y%m%d-%H%M%S}-{results["commit"] or "unknown"}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w") as file:
+        json.dump(results, file, indent=4)
+    click.echo(f"\nWrote the results to {output}")
+
+    if compare_path is not None:
+        with open(compare_path) as file:
+            changes = compare(json.load(file), results)
+        if max_regression is not None:
+            regressed = [f"{stage} is {change:.1f}% slower." for stage, change in changes if change > max_regression]
+            if regressed:
+                raise click.ClickException("\n\t".join(["performance regressed:", *regressed]))
+
+
+if __name__ == "__main__":
+    main()
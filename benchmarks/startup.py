@@ -0,0 +1,97 @@
+"""Benchmark of the startup time of the cli
+
+    Times man2cbz with arguments that don't need any subcommand, like --help,
+    and the --help of every subcommand, against importing every subcommand up
+    front like man2cbz.py used to. Each case runs in a new interpreter with
+    -X importtime to see which heavy dependencies it imported.
+
+    It fails when a case that doesn't need a subcommand imports one of the heavy
+    dependencies, when it takes longer than --limit or when the short help in
+    COMMANDS of man2cbz.py no longer matches a command's docstring, so it can
+    guard the lazy loading of subcommands.
+
+    Run from the root of the repository:
+        python benchmarks/startup.py
+"""
+
+import os
+import sys
+import time
+import subprocess
+import click
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from src import man2cbz
+
+
+# Dependencies only some subcommands need
+HEAVY = {"flask", "werkzeug", "tkinter", "PIL", "cbz", "requests", "httpx"}
+# Arguments that must not import any subcommand
+LIGHT = [["--help"], ["--version"], ["clear", "--help"]]
+EAGER = "import " + ", ".join(module for module, _, _ in man2cbz.COMMANDS.values())
+
+
+def run(arguments: list[str]) -> tuple[float, set[str]]:
+    """Runs a new interpreter with arguments, the seconds it took and the heavy dependencies it imported"""
+
+    start = time.perf_counter()
+    result = subprocess.run([sys.executable, "-X", "importtime", *arguments], cwd=ROOT, capture_output=True, text=True)
+    elapsed = time.perf_counter() - start
+    if result.returncode != 0:
+        raise click.ClickException(f"{" ".join(arguments)} exited with {result.returncode}:\n{result.stderr[-2000:]}")
+
+    imported = set()
+    for line in result.stderr.splitlines():
+        if line.startswith("import time:") and line.count("|") == 2:
+            imported.add(line.rsplit("|", 1)[1].strip().split(".")[0])
+    return elapsed, imported & HEAVY
+
+def measure(arguments: list[str], runs: int) -> tuple[float, set[str]]:
+    """The fastest of runs runs of arguments and the heavy dependencies it imported"""
+
+    results = [run(arguments) for _ in range(runs)]
+    return min(elapsed for elapsed, _ in results), set().union(*(imported for _, imported in results))
+
+def describe(name: str, measurement: tuple[float, set[str]]) -> str:
+    """Formats a measurement"""
+
+    elapsed, imported = measurement
+    return f"    {name:24} {elapsed * 1000:8.1f} ms    {", ".join(sorted(imported)) or "-"}"
+
+
+@click.command()
+@click.help_option("-h", "--help")
+@click.option("-r", "--runs", "runs", default=5, type=click.IntRange(min=1), show_default=True, help="Runs of each case, the fastest is shown.")
+@click.option("-l", "--limit", "limit", default=None, type=float, help="Seconds a case that doesn't need a subcommand may take at most.")
+def main(runs: int, limit: float | None) -> None:
+    """Times the startup of man2cbz and checks it only imports what it needs"""
+
+    failures = []
+    click.echo(f"{"case":28} {"time":>8}       heavy imports")
+
+    eager = measure(["-c", EAGER], runs)
+    click.echo(describe("import every command", eager))
+
+    for arguments in LIGHT:
+        name = " ".join(arguments)
+        elapsed, imported = measure(["-m", "src.man2cbz", *arguments], runs)
+        click.echo(describe(name, (elapsed, imported)))
+        if imported:
+            failures.append(f"{name} imported {", ".join(sorted(imported))}.")
+        if limit is not None and elapsed > limit:
+            failures.append(f"{name} took {elapsed:.3f} seconds, more than {limit} seconds.")
+
+    for name, (module, attribute, short_help) in man2cbz.COMMANDS.items():
+        click.echo(describe(f"{name} --help", measure(["-m", "src.man2cbz", name, "--help"], runs)))
+        command = getattr(__import__(module, fromlist=[attribute]), attribute)
+        if command.get_short_help_str(limit=1000) != short_help:
+            failures.append(f"the short help of {name} in COMMANDS is not {command.get_short_help_str(limit=1000)!r}.")
+
+    if failures:
+        raise click.ClickException("\n\t".join(["startup regressed:", *failures]))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,378 @@
+"""Synthetic stand-in for the sites the providers download from
+
+    Serves a generated series in the page shapes AsuraDownloader, MangaGekkoDownloader
+    and GeneralDownloader parse, so downloads can be measured offline and repeatably:
+        asura:   /asura/series/bench, chapters with their images in Next.js pushes
+        mgeko:   /mgeko/manga/bench/, chapters with img tags and a disabled next link
+            on the last one
+        general: /general/, every chapter listed on the homepage
+
+    Every image has different bytes, so they aren't stored once like duplicates,
+    but they are made from one generated image so serving them costs nothing.
+    Pages have an ETag and are answered with 304 Not Modified when it matches.
+    Responses can be delayed and requests made to fail or be cut off at random.
+
+    Used by benchmarks/pipeline.py, or run it on its own from the root of the
+    repository and download from the urls it shows:
+        python benchmarks/synthetic_site.py [OPTIONS]
+"""
+
+import io
+import time
+import zlib
+import hashlib
+import random
+import struct
+import threading
+import http.server
+import click
+import PIL.Image
+
+
+PROVIDERS = {
+    "asura": "/asura/series/bench",
+    "mgeko": "/mgeko/manga/bench/",
+    "general": "/general/",
+}
+IMAGE_FORMATS = {"jpeg": ("jpg", "image/jpeg"), "png": ("png", "image/png")}
+
+
+class Site:
+    """Synthetic Site
+
+        Serves on a ThreadingHTTPServer in a daemon thread once started.
+    """
+
+    def __init__(
+            self,
+            chapters: int = 20,
+            images: int = 10,
+            image_size: tuple[int, int] = (800, 1200),
+            image_format: str = "jpeg",
+            latency: float = 0.0,
+            error_rate: float = 0.0,
+            error_status: int = 503,
+            truncate_rate: float = 0.0,
+            padding: int = 0,
+            seed: int = 0,
+    ) -> None:
+        """Constructor
+
+            chapters: number of chapters of the series
+            images: number of images of each chapter
+            image_size: width and height of the images
+            image_format: a key of IMAGE_FORMATS
+            latency: seconds every response is delayed by
+            error_rate: fraction of chapter and image requests answered with error_status
+            truncate_rate: fraction of images whose body is cut off halfway
+            padding: bytes of markup added to every page, like the scripts and styles of real pages
+            seed: seed of the errors, the same seed fails the same requests in order
+        """
+
+        if image_format not in IMAGE_FORMATS:
+            raise Exception(f"{image_format} is not a valid image format.")
+
+        self.chapters = chapters
+        self.images = images
+        self.image_format = image_format
+        self.latency = latency
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self.truncate_rate = truncate_rate
+        self.padding = "<!--" + "x" * max(0, padding - 7) + "-->" if padding else ""
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.errors = 0
+        self.image = generate_image(image_size, image_format)
+        self.server: http.server.ThreadingHTTPServer | None = None
+
+    def start(self, address: str = "127.0.0.1", port: int = 0) -> None:
+        """Starts serving in a daemon thread, port 0 picks a free port"""
+
+        handler = type("Handler", (SiteHandler,), {"site": self})
+        self.server = http.server.ThreadingHTTPServer((address, port), handler)
+        self.server.daemon_threads = True
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def stop(self) -> None:
+        """Stops serving"""
+
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+            self.server = None
+
+    def url(self, provider: str) -> str:
+        """Gets the url of the homepage of the series in the page shape of provider"""
+
+        if self.server is None:
+            raise Exception("The site isn't started.")
+        address, port = self.server.server_address[:2]
+        return f"http://{address}:{port}{PROVIDERS[provider]}"
+
+    def host(self) -> str:
+        """Gets the scheme and address of the site"""
+
+        return self.url("general").removesuffix(PROVIDERS["general"])
+
+    def count(self) -> None:
+        """Counts a request"""
+
+        with self.lock:
+            self.requests += 1
+
+    def fail(self, rate: float) -> bool:
+        """Whether the next request is made to fail, counted as an error if it is"""
+
+        with self.lock:
+            failed = rate > 0 and self.random.random() < rate
+            self.errors += failed
+            return failed
+
+    def image_bytes(self, provider: str, chapter: int, image: int) -> bytes:
+        """Gets the bytes of an image, different for every image"""
+
+        return tag_image(self.image, self.image_format, f"{provider} {chapter} {image}".encode())
+
+    def image_url(self, provider: str, chapter: int, image: int) -> str:
+        """Gets the url of an image"""
+
+        return f"{self.host()}/images/{provider}/{chapter}/{image}.{IMAGE_FORMATS[self.image_format][0]}"
+
+    def page(self, path: str) -> str | None:
+        """Gets the markup of a page of the series, None if path isn't one"""
+
+        chapters = range(1, self.chapters + 1)
+        match path.rstrip("/").split("/")[1:]:
+            case ["asura", "series", "bench"]:
+                return self.asura_home()
+            case ["asura", "series", "bench", "chapter", chapter] if chapter.isdigit() and int(chapter) in chapters:
+                return self.asura_chapter(int(chapter))
+            case ["mgeko", "manga", "bench"]:
+                return self.mgeko_home()
+            case ["mgeko", "reader", "en", chapter] if chapter.startswith("bench-chapter-") and chapter[14:].isdigit() and int(chapter[14:]) in chapters:
+                return self.mgeko_chapter(int(chapter[14:]))
+            case ["general"]:
+                return self.general_home()
+            case ["general", chapter] if chapter.startswith("chapter-") and chapter[8:].isdigit() and int(chapter[8:]) in chapters:
+                return self.general_chapter(int(chapter[8:]))
+        return None
+
+    def asura_home(self) -> str:
+        """Homepage with First Chapter and New Chapter buttons"""
+
+        return page(
+            "Bench | Asura Scans",
+            '<a href="/asura/series/bench/chapter/1"><button>First Chapter</button></a>'
+            f'<a href="/asura/series/bench/chapter/{self.chapters}"><button>New Chapter</button></a>'
+            + "".join(f'<a href="/asura/series/bench/chapter/{chapter}"><h3>Chapter {chapter}</h3></a>' for chapter in range(self.chapters, 0, -1)),
+            self.padding,
+        )
+
+    def asura_chapter(self, chapter: int) -> str:
+        """Chapter whose images are only in the data pushed by Next.js, with Prev and Next links"""
+
+        pushes = "".join(
+            f'<script>self.__next_f.push([1,"{{\\"order\\":{image},\\"url\\":\\"{self.image_url("asura", chapter, image)}\\"}}"])</script>'
+            for image in range(self.images)
+        )
+        links = ""
+        if chapter > 1:
+            links += f'<a href="/asura/series/bench/chapter/{chapter - 1}">Prev</a>'
+        if chapter < self.chapters:
+            links += f'<a href="/asura/series/bench/chapter/{chapter + 1}">Next</a>'
+        return page(f"Bench Chapter {chapter}", f"<nav>{links}</nav><div></div>{pushes}", self.padding)
+
+    def mgeko_home(self) -> str:
+        """Homepage listing the chapters newest first"""
+
+        return page(
+            "Bench - Manga Gekko",
+            '<ul class="chapter-list">'
+            + "".join(f'<li><a href="/mgeko/reader/en/bench-chapter-{chapter}/"><strong class="chapter-title">Chapter {chapter}</strong></a></li>' for chapter in range(self.chapters, 0, -1))
+            + "</ul>",
+            self.padding,
+        )
+
+    def mgeko_chapter(self, chapter: int) -> str:
+        """Chapter with absolute img tags among relative ones, its next link is disabled on the last chapter"""
+
+        images = "".join(f'<img src="{self.image_url("mgeko", chapter, image)}" alt="page {image}">' for image in range(self.images))
+        if chapter < self.chapters:
+            next_link = f'<a class="nextchap" href="/mgeko/reader/en/bench-chapter-{chapter + 1}/">Next</a>'
+        else:
+            next_link = '<a class="nextchap disabled" href="#">Next</a>'
+        return page(f"Bench Chapter {chapter}", f'<img src="/logo.png"><div id="chapter-reader">{images}</div>{next_link}', self.padding)
+
+    def general_home(self) -> str:
+        """Homepage of a single series site listing every chapter newest first"""
+
+        base = self.url("general")
+        return page(
+            "Bench",
+            "<ul>" + "".join(f'<li><a href="{base}chapter-{chapter}/">Bench Chapter {chapter}</a></li>' for chapter in range(self.chapters, 0, -1)) + "</ul>",
+            self.padding,
+        )
+
+    def general_chapter(self, chapter: int) -> str:
+        """Chapter with absolute img tags"""
+
+        return page(
+            f"Bench Chapter {chapter}",
+            "".join(f'<p><img src="{self.image_url("general", chapter, image)}"></p>' for image in range(self.images)),
+            self.padding,
+        )
+
+
+class SiteHandler(http.server.BaseHTTPRequestHandler):
+    """Serves the pages and images of a Site"""
+
+    protocol_version = "HTTP/1.1"
+    site: Site
+
+    def log_message(self, format: str, *args) -> None:
+        pass
+
+    def do_GET(self) -> None:
+        site = self.site
+        site.count()
+        if site.latency > 0:
+            time.sleep(site.latency)
+
+        path = self.path.split("?")[0]
+        if path.startswith("/images/"):
+            self.send_image(path)
+            return
+
+        markup = site.page(path)
+        if markup is None:
+            self.send(404, b"", "text/plain")
+        elif path.rstrip("/") not in {home.rstrip("/") for home in PROVIDERS.values()} and site.fail(site.error_rate):
+            self.send(site.error_status, b"", "text/plain")
+        else:
+            body = markup.encode()
+            etag = f'"{hashlib.sha256(body).hexdigest()[:16]}"'
+            if self.headers.get("If-None-Match") == etag:
+                self.send(304, b"", "text/html; charset=utf-8", etag)
+            else:
+                self.send(200, body, "text/html; charset=utf-8", etag)
+
+    def send_image(self, path: str) -> None:
+        """Sends an image, an error or half an image"""
+
+        site = self.site
+        try:
+            provider, chapter, name = path.split("/")[2:]
+            image = int(name.split(".")[0])
+            chapter = int(chapter)
+        except ValueError:
+            self.send(404, b"", "text/plain")
+            return
+        if provider not in PROVIDERS or not (1 <= chapter <= site.chapters and 0 <= image < site.images):
+            self.send(404, b"", "text/plain")
+            return
+
+        if site.fail(site.error_rate):
+            self.send(site.error_status, b"", "text/plain")
+            return
+
+        body = site.image_bytes(provider, chapter, image)
+        if site.fail(site.truncate_rate):
+            self.send_response(200)
+            self.send_header("Content-Type", IMAGE_FORMATS[site.image_format][1])
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body[:len(body) // 2])
+            self.close_connection = True
+            return
+        self.send(200, body, IMAGE_FORMATS[site.image_format][1])
+
+    def send(self, status: int, body: bytes, content_type: str, etag: str | None = None) -> None:
+        """Sends a whole response"""
+
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        if etag is not None:
+            self.send_header("ETag", etag)
+        if status == 429 or status == 503:
+            self.send_header("Retry-After", "1")
+        self.end_headers()
+        self.wfile.write(body)
+
+
+def page(title: str, body: str, padding: str) -> str:
+    """Wraps the body of a page, minified on one line like real pages"""
+
+    return f'<!DOCTYPE html><html><head><meta charset="utf-8"><title>{title}</title>{padding}</head><body>{body}</body></html>'
+
+def generate_image(size: tuple[int, int], image_format: str) -> bytes:
+    """Generates an image of noise over a gradient, which compresses about as well as a scanned page"""
+
+    gradient = PIL.Image.linear_gradient("L").resize(size)
+    noise = PIL.Image.effect_noise(size, 24)
+    image = PIL.Image.merge("RGB", (gradient, noise, PIL.Image.blend(gradient, noise, 0.5)))
+    buffer = io.BytesIO()
+    image.save(buffer, format=image_format.upper(), quality=85)
+    return buffer.getvalue()
+
+def tag_image(image: bytes, image_format: str, tag: bytes) -> bytes:
+    """Adds a comment to an image without changing its pixels so its bytes differ"""
+
+    if image_format == "jpeg":
+        # A COM segment right after the start of image marker
+        return image[:2] + b"\xff\xfe" + struct.pack(">H", len(tag) + 2) + tag + image[2:]
+    # A tEXt chunk right after the IHDR chunk, which is after the 8 byte signature and is 25 bytes
+    data = b"Comment\x00" + tag
+    chunk = struct.pack(">I", len(data)) + b"tEXt" + data + struct.pack(">I", zlib.crc32(b"tEXt" + data))
+    return image[:33] + chunk + image[33:]
+
+
+@click.command()
+@click.help_option("-h", "--help")
+@click.option("-H", "--host", "address", default="127.0.0.1", type=click.STRING, show_default=True, help="Address to serve on.")
+@click.option("-p", "--port", "port", default=8765, type=click.IntRange(0, 65535), show_default=True, help="Port to serve on.")
+@click.option("-c", "--chapters", "chapters", default=20, type=click.IntRange(min=1), show_default=True, help="Number of chapters.")
+@click.option("-i", "--images", "images", default=10, type=click.IntRange(min=1), show_default=True, help="Number of images of each chapter.")
+@click.option("-s", "--image-size", "image_size", default=(800, 1200), type=(int, int), show_default=True, help="Width and height of the images.", metavar="WIDTH HEIGHT")
+@click.option("-f", "--image-format", "image_format", default="jpeg", type=click.Choice(list(IMAGE_FORMATS)), show_default=True, help="Format of the images.")
+@click.option("-l", "--latency", "latency", default=0.0, type=click.FloatRange(min=0), show_default=True, help="Seconds every response is delayed by.")
+@click.option("-e", "--error-rate", "error_rate", default=0.0, type=click.FloatRange(0, 1), show_default=True, help="Fraction of chapter and image requests that fail.")
+@click.option("--error-status", "error_status", default=503, type=click.IntRange(400, 599), show_default=True, help="Status code of the failed requests.")
+@click.option("-t", "--truncate-rate", "truncate_rate", default=0.0, type=click.FloatRange(0, 1), show_default=True, help="Fraction of images cut off halfway.")
+@click.option("--padding", "padding", default=0, type=click.IntRange(min=0), show_default=True, help="Kilobytes of markup added to every page.")
+@click.option("--seed", "seed", default=0, type=int, show_default=True, help="Seed of the failed requests.")
+def main(
+        address: str,
+        port: int,
+        chapters: int,
+        images: int,
+        image_size: tuple[int, int],
+        image_format: str,
+        latency: float,
+        error_rate: float,
+        error_status: int,
+        truncate_rate: float,
+        padding: int,
+        seed: int,
+) -> None:
+    """Serves a synthetic series until interrupted"""
+
+    site = Site(chapters, images, image_size, image_format, latency, error_rate, error_status, truncate_rate, padding * 1024, seed)
+    site.start(address, port)
+    for provider in PROVIDERS:
+        click.echo(f"{provider:8} {site.url(provider)}")
+    click.echo(f"Images are {len(site.image) / 1024:.0f} KB, press Ctrl+C to stop.")
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        site.stop()
+        click.echo(f"Served {site.requests} requests, {site.errors} of them failed.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,288 @@
+import os
+import shutil
+import pathlib
+import zipfile
+import xml.etree.ElementTree as ET
+from datetime import datetime, timezone
+from typing import IO
+import click
+import PIL.Image
+from cbz.constants import XML_NAME, PageType
+
+from src import files
+
+
+DEFAULT_LEVEL = 6
+# Deflating these barely makes them smaller and costs a lot of time
+COMPRESSED_SUFFIXES = {".jpg", ".jpeg", ".png", ".webp", ".gif"}
+
+
+def chapter_number(key: str) -> int:
+    """Gets the chapter number of a page's key like Chapter001Image001.jpg"""
+
+    return int(key.removeprefix("Chapter").split("Image")[0])
+
+def read_pages(zf: zipfile.ZipFile) -> list[dict[str, str]]:
+    """Gets the name and key of each page of a cbz file in order
+
+        Only the zip's central directory and ComicInfo.xml are read, not the pages.
+        Pages without a Key in ComicInfo.xml use their name as key.
+
+        The width and height of a page are added as "width" and "height" when
+        ComicInfo.xml has them.
+    """
+
+    elements = []
+    if XML_NAME in zf.NameToInfo:
+        elements = list(ET.fromstring(zf.read(XML_NAME)).iter("Page"))
+
+    # Directories and files without a suffix aren't pages and have no Page element
+    infos = [info for info in zf.infolist() if info.filename != XML_NAME and pathlib.PurePosixPath(info.filename).suffix]
+    pages = []
+    for i, info in enumerate(infos):
+        element = elements[i] if i < len(elements) else ET.Element("Page")
+        page = {"name": info.filename, "key": element.get("Key") or pathlib.PurePosixPath(info.filename).name}
+        if element.get("ImageWidth", "").isdigit() and element.get("ImageHeight", "").isdigit():
+            page.update({"width": int(element.get("ImageWidth")), "height": int(element.get("ImageHeight"))})
+        pages.append(page)
+    return pages
+
+def page_element(image: int, key: str, path: str | os.PathLike, page_type: PageType) -> ET.Element:
+    """Creates the Page element of ComicInfo.xml for an image file
+
+        Only the image's header is read to get its size.
+    """
+
+    with PIL.Image.open(path) as f:
+        width, height = f.size
+    return ET.Element("Page", {
+        "Image": str(image),
+        "ImageHeight": str(height),
+        "ImageSize": str(os.path.getsize(path)),
+        "ImageWidth": str(width),
+        "Key": key,
+        "Type": page_type.value,
+    })
+
+def append_pages(cbz_path: str | os.PathLike, paths: list[pathlib.Path], verbose: bool) -> None:
+    """Appends images to the end of a cbz file in place
+
+        The existing pages are not read or rewritten. The old ComicInfo.xml is the
+        last entry of the zip, the new pages are written over it and a new one
+        listing every page is written after them, so no stale copy of it is left
+        in the file. A cbz file whose ComicInfo.xml isn't its last entry, like one
+        made by another tool, is copied once with it moved to the end.
+    """
+
+    with zipfile.ZipFile(cbz_path, "r") as zf:
+        info = zf.NameToInfo.get(XML_NAME)
+        if info is not None and info.header_offset != max(entry.header_offset for entry in zf.infolist()):
+            move_info_last(cbz_path)
+
+    with zipfile.ZipFile(cbz_path, "a") as zf:
+        pages = read_pages(zf)
+
+        if XML_NAME in zf.NameToInfo:
+            root = ET.fromstring(zf.read(XML_NAME))
+            info = zf.NameToInfo.pop(XML_NAME)
+            zf.filelist.remove(info)
+            # Entries are appended from start_dir, and the file is truncated after the central directory on close
+            zf.start_dir = info.header_offset
+        else:
+            root = ET.Element("ComicInfo")
+
+        pages_element = root.find("Pages")
+        if pages_element is None:
+            pages_element = ET.SubElement(root, "Pages")
+        for page in pages_element.iter("Page"):
+            if page.get("Type") == PageType.BACK_COVER.value:
+                page.set("Type", PageType.STORY.value)
+
+        # Keep to the archive's naming so readers that sort by name keep the order
+        keyed = not any(page["name"].startswith("page-") for page in pages)
+        for i, path in enumerate(paths, start=len(pages)):
+            name = path.name if keyed else f"page-{i + 1:03d}{path.suffix}"
+            zf.write(path, name, compress_type=zipfile.ZIP_STORED)
+            pages_element.append(page_element(
+                i,
+                path.name,
+                path,
+                PageType.FRONT_COVER if i == 0 else PageType.BACK_COVER if path == paths[-1] else PageType.STORY,
+            ))
+            if verbose:
+                click.echo(f"Appended {path.name} to {cbz_path} as {name}.")
+
+        update_info(root)
+        zf.writestr(XML_NAME, xml_bytes(root))
+
+def move_info_last(cbz_path: str | os.PathLike) -> None:
+    """Rewrites a cbz file with ComicInfo.xml as its last entry
+
+        Every entry is copied in chunks with its compression kept. The copy is
+        written with PARTIAL_SUFFIX added and replaces the cbz file once complete.
+    """
+
+    partial_path = os.fspath(cbz_path) + files.PARTIAL_SUFFIX
+    try:
+        with zipfile.ZipFile(cbz_path, "r") as source, zipfile.ZipFile(partial_path, "w") as target:
+            for info in sorted(source.infolist(), key=lambda info: info.filename == XML_NAME):
+                copy = zipfile.ZipInfo(info.filename, info.date_time)
+                copy.compress_type = info.compress_type
+                copy.external_attr = info.external_attr
+                with source.open(info) as src, target.open(copy, "w") as dst:
+                    shutil.copyfileobj(src, dst, files.CHUNK_SIZE)
+    except BaseException:
+        os.remove(partial_path)
+        raise
+    os.replace(partial_path, cbz_path)
+
+def update_info(root: ET.Element) -> None:
+    """Updates the totals and modified time of ComicInfo.xml after its pages changed"""
+
+    page_elements = list(root.iter("Page"))
+    modified = datetime.now(timezone.utc).strftime("%Y-%m-%dT%H:%M:%S.%f")[:-3] + "Z"
+    for tag, value in (
+            ("FileSize", str(sum(int(page.get("ImageSize", 0)) for page in page_elements))),
+            ("FileModifiedTime", modified),
+            ("PageCount", str(len(page_elements))),
+    ):
+        element = root.find(tag)
+        if element is None:
+            element = ET.Element(tag)
+            pages = root.find("Pages")
+            root.insert(len(root) if pages is None else list(root).index(pages), element)
+        element.text = value
+
+def xml_bytes(root: ET.Element) -> bytes:
+    """Serializes ComicInfo.xml"""
+
+    root.set("xmlns:xsd", "http://www.w3.org/2001/XMLSchema")
+    root.set("xmlns:xsi", "http://www.w3.org/2001/XMLSchema-instance")
+    ET.indent(root, space="\t")
+    return ET.tostring(root, encoding="utf-8", xml_declaration=True)
+
+
+class CbzWriter:
+    """Streaming Cbz Writer
+
+        Each page is copied from its file straight into the zip on disk, so memory
+        use stays flat no matter how big the series is. Only the Page element of
+        each page is kept, and ComicInfo.xml is written from them after the last
+        page. The zip is written with PARTIAL_SUFFIX added and renamed to its path
+        once complete.
+    """
+
+    def __init__(self, path: str | os.PathLike, info: dict[str, str], level: int = DEFAULT_LEVEL, deflate_all: bool = False) -> None:
+        """Constructor
+
+            path: where the cbz file should end up
+            info: the elements of ComicInfo.xml before the pages, like {"Title": "..."}
+            level: deflate level of pages that aren't already compressed and of ComicInfo.xml, 0 stores them
+            deflate_all: whether to also deflate already compressed pages (JPEG, PNG, WebP and GIF)
+        """
+
+        self.path = os.fspath(path)
+        self.partial_path = self.path + files.PARTIAL_SUFFIX
+        self.root = ET.Element("ComicInfo")
+        for tag, value in info.items():
+            ET.SubElement(self.root, tag).text = value
+        ET.SubElement(self.root, "FileCreationTime").text = datetime.now(timezone.utc).strftime("%Y-%m-%dT%H:%M:%S.%f")[:-3] + "Z"
+        self.pages = ET.SubElement(self.root, "Pages")
+        self.level = level
+        self.deflate_all = deflate_all
+        self.zf: zipfile.ZipFile | None = None
+
+    def __enter__(self) -> "CbzWriter":
+        self.zf = zipfile.ZipFile(self.partial_path, "w")
+        return self
+
+    def __exit__(self, exc_type, *args) -> None:
+        if exc_type is not None:
+            self.zf.close()
+            os.remove(self.partial_path)
+            return
+
+        page_elements = list(self.pages)
+        for i, page in enumerate(page_elements):
+            page.set("Type", (PageType.FRONT_COVER if i == 0 else PageType.BACK_COVER if i == len(page_elements) - 1 else PageType.STORY).value)
+        update_info(self.root)
+        self.zf.writestr(XML_NAME, xml_bytes(self.root), **self.compression(".xml"))
+        self.zf.close()
+        os.replace(self.partial_path, self.path)
+
+    def compression(self, suffix: str) -> dict[str, int]:
+        """Gets the compression arguments of an entry from its suffix"""
+
+        if self.level == 0 or (suffix.lower() in COMPRESSED_SUFFIXES and not self.deflate_all):
+            return {"compress_type": zipfile.ZIP_STORED}
+        return {"compress_type": zipfile.ZIP_DEFLATED, "compresslevel": self.level}
+
+    def add(self, path: pathlib.Path, key: str | None = None) -> None:
+        """Adds an image file as the next page
+
+            key: the page's key and name in the zip, defaults to the file's name
+        """
+
+        key = key or path.name
+        self.pages.append(page_element(len(self.pages), key, path, PageType.STORY))
+        self.zf.write(path, key, **self.compression(pathlib.PurePath(key).suffix))
+
+
+class CbzReader:
+    """Lazy Cbz Reader
+
+        Opening a cbz file only reads the zip's central directory and
+        ComicInfo.xml, so it takes the same time no matter how big the file is.
+        The bytes of a page are read when asked for by seeking to it in the file.
+        Pages can be read from several threads at once.
+    """
+
+    def __init__(self, path: str | os.PathLike) -> None:
+        """Constructor
+
+            path: the cbz file to read
+        """
+
+        self.path = os.fspath(path)
+        self.zf = zipfile.ZipFile(self.path, "r")
+        self.pages = read_pages(self.zf)
+
+    def __enter__(self) -> "CbzReader":
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.close()
+
+    def chapters(self) -> list[list[dict[str, str]]]:
+        """Gets the pages of each chapter in order by the chapter numbers in their keys"""
+
+        chapters: dict[int, list[dict[str, str]]] = {}
+        for page in self.pages:
+            chapters.setdefault(chapter_number(page["key"]), []).append(page)
+        return [chapters[chapter] for chapter in sorted(chapters)]
+
+    def size(self, page: dict[str, str]) -> tuple[int, int]:
+        """Gets the width and height of a page
+
+            Taken from ComicInfo.xml, or from the page's header when it isn't there.
+        """
+
+        if "width" not in page:
+            with self.zf.open(page["name"]) as f, PIL.Image.open(f) as image:
+                page["width"], page["height"] = image.size
+        return page["width"], page["height"]
+
+    def read(self, page: dict[str, str]) -> bytes:
+        """Reads the bytes of a page"""
+
+        return self.zf.read(page["name"])
+
+    def open(self, page: dict[str, str]) -> IO[bytes]:
+        """Opens a page to read its bytes in chunks"""
+
+        return self.zf.open(page["name"])
+
+    def close(self) -> None:
+        """Closes the cbz file"""
+
+        self.zf.close()
@@ -0,0 +1,304 @@
+import asyncio
+import contextlib
+import os
+import time
+import urllib.parse
+from collections import deque
+from collections.abc import Awaitable
+import httpx
+import requests
+import requests.structures
+
+from src import files, retry, session, stats, throttle
+from src.page_cache import PageCache
+from src.scheduler import DEFAULT_LOOKAHEAD
+
+
+def download(downloader, retries: retry.RetryQueue, lookahead: int = DEFAULT_LOOKAHEAD) -> None:
+    """Downloads all images of all chapters as coroutines on one event loop
+
+        downloader: the Downloader whose chapters to download
+        retries: where what fails is put to be fetched again, like in Downloader.download_threaded
+        lookahead: number of chapter pages fetched ahead of the chapter being queued
+
+        The number of workers is used as the most requests in flight to each host,
+        which adapt to the host like in session.get. HTTP/2 is used where the host
+        supports it so those requests share a few connections instead of one each.
+    """
+
+    asyncio.run(AsyncEngine(downloader, retries, session.get_workers(), lookahead).run())
+
+
+def to_response(response: httpx.Response) -> requests.Response:
+    """Converts a httpx response to a requests response for the provider hooks"""
+
+    converted = requests.Response()
+    converted.status_code = response.status_code
+    converted.reason = response.reason_phrase
+    converted.url = str(response.url)
+    converted.headers = requests.structures.CaseInsensitiveDict(response.headers)
+    converted.encoding = response.encoding
+    converted._content = response.content
+    return converted
+
+
+@contextlib.asynccontextmanager
+async def partial_file(path: str, size: int | None):
+    """Opens a files.PartialFile and renames it once written on a worker thread
+
+        Its chunks should be written with asyncio.to_thread too so the event loop
+        never waits on the disk while other requests are in flight.
+    """
+
+    f = files.PartialFile(path, size)
+    await asyncio.to_thread(f.__enter__)
+    try:
+        yield f
+    except BaseException as e:
+        await asyncio.to_thread(f.__exit__, type(e), e, e.__traceback__)
+        raise
+    await asyncio.to_thread(f.__exit__, None, None, None)
+
+
+class AsyncEngine:
+    """Async Download Engine
+
+        Mirrors Downloader.download_threaded with coroutines, including resuming
+        from the downloader's manifest and retrying. Pages are parsed with the
+        provider's get_image_urls and get_next_url hooks on a worker thread so a slow
+        regex never blocks the event loop.
+    """
+
+    def __init__(self, downloader, retries: retry.RetryQueue, host_limit: int, lookahead: int) -> None:
+        """Constructor
+
+            downloader: the Downloader whose chapters to download
+            retries: where what fails is put to be fetched again
+            host_limit: most requests in flight to each host, see throttle.HostLimit
+            lookahead: number of chapter pages fetched ahead of the chapter being queued
+        """
+
+        self.downloader = downloader
+        self.retries = retries
+        self.host_limit = host_limit
+        self.lookahead = lookahead
+        # Notified when a request to the host is released, see acquire
+        self.hosts: dict[str, asyncio.Condition] = {}
+        self.tasks: set[asyncio.Task] = set()
+        self.client: httpx.AsyncClient | None = None
+        self.slots: asyncio.Semaphore | None = None
+
+    async def run(self) -> None:
+        """Downloads all images of all chapters, then what failed until nothing is left in retries"""
+
+        manifest = self.downloader.manifest
+        self.slots = asyncio.Semaphore(self.host_limit * 4)
+        async with httpx.AsyncClient(
+                http2=True,
+                follow_redirects=True,
+                timeout=session.get_timeout(),
+                limits=httpx.Limits(max_connections=None, max_keepalive_connections=self.host_limit),
+        ) as self.client:
+            try:
+                for chapter, images in self.downloader.resume_images():
+                    stats.echo(f"Resuming {len(images)} images from {manifest.chapters[chapter]['url']} (chapter {chapter})")
+                    stats.count("queued", len(images))
+                    for image in images:
+                        await self.submit(image)
+
+                if self.downloader.urls is not None:
+                    await self.download_urls()
+                else:
+                    await self.download_chain(self.downloader.walk_start())
+                await self.download_retries()
+            finally:
+                await asyncio.gather(*self.tasks, return_exceptions=True)
+
+    async def download_urls(self) -> None:
+        """Downloads the chapters of downloader.urls that aren't in the manifest"""
+
+        chapters = self.downloader.pending_chapters()
+        pages = deque()
+        for index, (chapter, url) in enumerate(chapters):
+            while len(pages) <= self.lookahead and index + len(pages) < len(chapters):
+                pages.append(asyncio.create_task(self.fetch_chapter(chapters[index + len(pages)][1])))
+            await self.add_chapter({"type": "chapter", "chapter": chapter, "url": url}, pages.popleft())
+
+    async def add_chapter(self, entry: dict, page: Awaitable[tuple[requests.Response, list[str]]]) -> None:
+        """Queues the images of a chapter of downloader.urls once its page is fetched, or puts it in retries"""
+
+        try:
+            response, image_urls = await page
+            self.downloader.check_chapter(entry["url"], response, image_urls)
+        except Exception as e:
+            self.retries.add(entry, e)
+            return
+        for image in self.downloader.add_chapter(entry["chapter"], entry["url"], None, image_urls):
+            await self.submit(image)
+
+    async def download_chain(self, url: str | None, entry: dict | None = None) -> None:
+        """Downloads the chapters by following get_next_url from url, like Downloader.walk_threaded"""
+
+        manifest = self.downloader.manifest
+        while url is not None:
+            chapter = len(manifest.chapters) + 1
+            try:
+                response, image_urls = await self.fetch_chapter(url)
+                self.downloader.check_chapter(url, response, image_urls)
+                next_url = await asyncio.to_thread(stats.timed("get_next_url", self.downloader.get_next_url), response)
+            except Exception as e:
+                self.retries.add(entry or {"type": "chapter", "chapter": chapter, "url": url}, e)
+                return
+
+            for image in self.downloader.add_chapter(chapter, url, next_url, image_urls):
+                await self.submit(image)
+            url = next_url
+            entry = None
+
+    async def download_retries(self) -> None:
+        """Fetches what's in retries again once it's due until nothing is left in it"""
+
+        while True:
+            wait = self.retries.due()
+            if wait is None:
+                # Downloads still running may fail and be queued again
+                await asyncio.gather(*self.tasks, return_exceptions=True)
+                if self.retries.due() is None:
+                    return
+                continue
+
+            await asyncio.sleep(wait)
+            for entry in self.retries.pop_due():
+                if entry["type"] == "image":
+                    await self.submit(entry)
+                elif self.downloader.urls is not None:
+                    await self.add_chapter(entry, self.fetch_chapter(entry["url"]))
+                else:
+                    await self.download_chain(entry["url"], entry)
+
+    async def acquire(self, url: str) -> tuple[throttle.HostLimit, float]:
+        """Waits for a slot of the limit of url's host and takes it
+
+            Returns the limit and when the slot was taken to release it with.
+        """
+
+        limit = session.host_limit(url)
+        released = self.hosts.setdefault(urllib.parse.urlsplit(url).netloc, asyncio.Condition())
+        async with released:
+            while (wait := limit.try_acquire()) != 0:
+                try:
+                    await asyncio.wait_for(released.wait(), wait)
+                except TimeoutError:
+                    pass
+        return limit, time.monotonic()
+
+    async def release(self, url: str, limit: throttle.HostLimit, started: float, latency: float | None, status: int | None, retry_after: str | None) -> None:
+        """Gives back a slot taken with acquire, see throttle.HostLimit.release"""
+
+        paused = limit.release(started, latency, status, retry_after)
+        if paused > 0:
+            stats.echo(f"{urllib.parse.urlsplit(url).netloc} answered with status code {status}, waiting {paused:.1f} seconds and sending fewer requests at once.", err=True)
+        released = self.hosts[urllib.parse.urlsplit(url).netloc]
+        async with released:
+            released.notify_all()
+
+    async def fetch_chapter(self, url: str) -> tuple[requests.Response, list[str]]:
+        """Gets a chapter's page and the urls of its images
+
+            The image urls are empty if the page failed to load. Throttled responses
+            are retried and the page cache is used like in session.get.
+        """
+
+        cache = session.get_cache()
+        entry = cache.load(url) if cache is not None else None
+        for attempt in range(throttle.RETRIES + 1):
+            limit, started = await self.acquire(url)
+            try:
+                response = to_response(await self.client.get(url, headers=PageCache.validators(entry)))
+            except httpx.HTTPError as e:
+                stats.request(url, time.monotonic() - started, type(e).__name__)
+                await self.release(url, limit, started, None, None, None)
+                raise
+            latency = time.monotonic() - started
+            stats.request(url, latency, response.status_code)
+            await self.release(url, limit, started, latency, response.status_code, response.headers.get("Retry-After"))
+
+            if response.status_code not in throttle.THROTTLED or attempt == throttle.RETRIES:
+                break
+            stats.count("throttled")
+
+        if cache is not None:
+            response = cache.update(url, entry, response)
+        if response.status_code != 200:
+            return response, []
+        return response, await asyncio.to_thread(stats.timed("get_image_urls", self.downloader.get_image_urls), response)
+
+    async def submit(self, image: dict[str, str]) -> None:
+        """Queues an image download, waits while the queue is full"""
+
+        await self.slots.acquire()
+        task = asyncio.create_task(self.try_image(image))
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+        task.add_done_callback(lambda _: self.slots.release())
+
+    async def try_image(self, image: dict[str, str]) -> None:
+        """Downloads an image, if it fails it's put in retries"""
+
+        try:
+            await self.download_image(image)
+        except Exception as e:
+            self.retries.add({"type": "image", **image}, e)
+
+    async def download_image(self, image: dict[str, str]) -> None:
+        """Downloads an image
+
+            image: {
+                url: str,
+                filename: str,
+            }
+
+            Recorded in stats like Downloader.save_image. Throttled responses are
+            retried like in session.get and other responses that aren't 200 raise.
+            The file is written, renamed and linked on worker threads.
+        """
+
+        file_path = os.path.join(self.downloader.directory, image["filename"])
+        start = time.perf_counter()
+        writing = 0.0
+        for attempt in range(throttle.RETRIES + 1):
+            limit, started = await self.acquire(image["url"])
+            latency = status = retry_after = None
+            try:
+                async with self.client.stream("GET", image["url"]) as response:
+                    latency = time.monotonic() - started
+                    status = response.status_code
+                    retry_after = response.headers.get("Retry-After")
+                    stats.request(image["url"], latency, status)
+                    if status in throttle.THROTTLED and attempt < throttle.RETRIES:
+                        stats.count("throttled")
+                        continue
+                    if status != 200:
+                        raise Exception(f"{image['url']} failed with status code {status}.")
+
+                    async with partial_file(file_path, files.expected_size(response.headers)) as f:
+                        async for chunk in response.aiter_bytes(files.CHUNK_SIZE):
+                            write_start = time.perf_counter()
+                            await asyncio.to_thread(f.write, chunk)
+                            writing += time.perf_counter() - write_start
+                        write_start = time.perf_counter()
+                    writing += time.perf_counter() - write_start
+            except httpx.HTTPError as e:
+                if status is None:
+                    stats.request(image["url"], time.monotonic() - started, type(e).__name__)
+                raise
+            finally:
+                await self.release(image["url"], limit, started, latency, status, retry_after)
+            break
+
+        # Hardlinks a duplicate to the image with the same bytes and appends to the manifest
+        await asyncio.to_thread(self.downloader.manifest.add_image, image["filename"], f.written, f.hash.hexdigest())
+        stats.record("disk write", writing)
+        stats.record("image", time.perf_counter() - start)
+        stats.count("images")
+        stats.count("bytes", f.written)
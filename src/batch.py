@@ -0,0 +1,124 @@
+import os
+import shutil
+import urllib.parse
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import click
+
+from src import constants, session, stats
+from src.download import get_downloader, get_provider
+from src.scheduler import Scheduler
+
+
+def read_queue(path: str) -> list[tuple[str, str | None]]:
+    """Reads a queue file of series to download
+
+        Each line is the url of a series' homepage, optionally followed by a space
+        and the name to compile it as. Blank lines and lines starting with # are
+        skipped.
+
+        Returns the url and name, None if it has none, of each series.
+    """
+
+    series = []
+    with open(path, "r") as file:
+        for line in file:
+            line = line.strip()
+            if not line or line.startswith("#"):
+                continue
+            url, _, name = line.partition(" ")
+            series.append((url, name.strip() or None))
+    return series
+
+def series_name(url: str) -> str:
+    """Gets the name to compile a series as from the url of its homepage, the last part of its path"""
+
+    parts = [part for part in urllib.parse.urlsplit(url).path.split("/") if part]
+    if not parts:
+        raise Exception(f"Couldn't get a name for {url} from its path, give it one in a queue file.")
+    return urllib.parse.unquote(parts[-1])
+
+def download_batch(series: list[tuple[str, str | None]], provider: str | None, retry_failed: bool, jobs: int) -> None:
+    """Downloads several series at once and compiles each to a cbz file once it's downloaded
+
+        series: the url and name, None to get it from the url, of each series
+        provider: name of the provider of every series, None to detect each from its url
+            or "" to pick from a list
+        retry_failed: only fetch what the last run of each series gave up on
+        jobs: number of series downloaded at once
+
+        Each series is downloaded into a workspace of its own, workspaces/NAME, so
+        they can't overwrite each other. The images of every series are queued on
+        one Scheduler and share the session, so the workers and the limit of each
+        host are a budget for the whole batch instead of for each series.
+
+        Series already compiled are skipped. An incomplete download keeps its
+        workspace, running the batch again resumes it.
+    """
+
+    names = [name or series_name(url) for url, name in series]
+    duplicates = sorted({name for name in names if names.count(name) > 1})
+    if duplicates:
+        raise Exception(f"More than one series would be named {", ".join(duplicates)}, give them names in a queue file.")
+
+    pending = []
+    for (url, _), name in zip(series, names):
+        if os.path.exists(os.path.join(constants.get_root_dir(), name + ".cbz")):
+            click.echo(f"Skipping {name} as it was already compiled.")
+        elif retry_failed and not os.path.exists(os.path.join(constants.get_workspaces_dir(), name)):
+            click.echo(f"Skipping {name} as it has no unfinished download.")
+        else:
+            pending.append((url, name))
+
+    if provider == "":
+        provider = get_provider()
+
+    compiled = []
+    incomplete = []
+    failed = {}
+    stats.start_progress("images", "queued")
+    try:
+        with Scheduler(session.get_workers()) as scheduler, ThreadPoolExecutor(max_workers=jobs) as executor:
+            futures = {
+                executor.submit(download_series, url, name, provider, retry_failed, scheduler): name
+                for url, name in pending
+            }
+            for future in as_completed(futures):
+                name = futures[future]
+                try:
+                    if future.result():
+                        compiled.append(name)
+                        stats.count("series")
+                        stats.echo(f"Compiled {name} ({len(compiled)}/{len(pending)})")
+                    else:
+                        incomplete.append(name)
+                except Exception as e:
+                    failed[name] = e
+    finally:
+        stats.stop_progress()
+
+    click.echo(f"{len(compiled)} of {len(pending)} series were downloaded and compiled.")
+    if incomplete:
+        click.echo(f"The downloads of {", ".join(incomplete)} are incomplete, run the batch again to resume them.", err=True)
+    for name, e in failed.items():
+        click.echo(f"Error occurred while downloading {name}:\n\t{e}", err=True)
+
+def download_series(url: str, name: str, provider: str | None, retry_failed: bool, scheduler: Scheduler) -> bool:
+    """Downloads a series of a batch into its workspace and compiles it once it's downloaded
+
+        The workspace is deleted once the series is compiled. Compiling runs while
+        the other series are downloading, its process pools are spawned so they
+        don't copy the locks held by their threads, see constants.get_process_context.
+
+        Returns whether the series was downloaded and compiled.
+    """
+
+    directory = os.path.join(constants.get_workspaces_dir(), name)
+    os.makedirs(directory, exist_ok=True)
+    if not get_downloader(url, provider).download(retry_failed=retry_failed, directory=directory, scheduler=scheduler):
+        return False
+
+    # Imported here so download only imports PIL and cbz once a series is compiled
+    from src import compile
+    compile.compile_cbz(name, False, paths=compile.get_images(directory), progress=False)
+    shutil.rmtree(directory)
+    return True
@@ -1,12 +1,12 @@
 import json
 import os
 import pathlib
-import shutil
+from concurrent.futures import ProcessPoolExecutor
 import click
-import cbz
-from cbz.constants import PageType, Format, YesNo, Manga, AgeRating
+from cbz.constants import Format, YesNo, Manga, AgeRating
 
-from src import constants
+from src import archive, constants, files, stats, transcode
+from src.manifest import MANIFEST_NAME
 
 
 @click.command("compile")
@@ -14,74 +14,163 @@ from src import constants
 @click.argument("name")
 @click.option("-f", "--format", "compile_format", default="cbz", type=click.STRING, show_default=True, help="What to compile to.", metavar="FORMAT")
 @click.option("-v", "--verbose", "verbose", default=False, is_flag=True, help="Show more information.")
-def compile_images(name: str, compile_format: str, verbose: bool) -> None:
+@click.option("-l", "--level", "level", default=archive.DEFAULT_LEVEL, type=click.IntRange(0, 9), show_default=True, help="Deflate level of cbz pages that aren't already compressed, 0 stores them.", metavar="LEVEL")
+@click.option("--deflate-all", "deflate_all", default=False, is_flag=True, help="Also deflate JPEG, PNG, WebP and GIF pages in cbz files.")
+@click.option("-c", "--chapters", "chapters_per_volume", default=None, type=click.IntRange(min=1), help="Split the cbz file into volumes of this many chapters, 1 for a cbz file per chapter.", metavar="CHAPTERS")
+@click.option("-s", "--max-size", "max_volume_size", default=None, type=click.FloatRange(min=0, min_open=True), help="Split the cbz file into volumes of at most this many megabytes, chapters are never split.", metavar="MEGABYTES")
+@click.option("-j", "--jobs", "jobs", default=None, type=click.IntRange(min=1), show_default="number of cpus", help="Number of volumes packed or pages transcoded at once in separate processes.", metavar="JOBS")
+@click.option("-t", "--transcode", "target", default=transcode.DEFAULT_TARGET, type=click.Choice(list(transcode.TARGET_FORMATS)), show_default=True, help="Format cbz pages the packer doesn't allow (like AVIF) are transcoded to.")
+@click.option("-q", "--quality", "quality", default=transcode.DEFAULT_QUALITY, type=click.IntRange(1, 100), show_default=True, help="Quality of transcoded JPEG and WebP pages.", metavar="QUALITY")
+@click.option("--convert-webp", "convert_webp", default=False, is_flag=True, help="Also transcode WebP pages, for readers that can't show them.")
+@click.option("-u", "--skip-duplicates", "skip_duplicates", default=False, is_flag=True, help="Leave out pages with the same bytes as an earlier page, like banners repeated in every chapter.")
+@click.option("-m", "--mode", "mode", default=files.DEFAULT_PLACE_MODE, type=click.Choice(files.PLACE_MODES), show_default=True, help="How images are placed into html chapter folders, copies are made when the others aren't possible.")
+@stats.option
+def compile_images(
+        name: str,
+        compile_format: str,
+        verbose: bool,
+        level: int,
+        deflate_all: bool,
+        chapters_per_volume: int | None,
+        max_volume_size: float | None,
+        jobs: int | None,
+        target: str,
+        quality: int,
+        convert_webp: bool,
+        skip_duplicates: bool,
+        mode: str,
+        stats_path: str | None,
+) -> None:
     """Compile to cbz or html
 
         Valid formats: "cbz", "html"
+
+        A cbz file can be split into volumes with --chapters and/or --max-size, they
+        are named NAME Volume N and packed in parallel.
+
+        A progress line with the pages per second and time left is shown while
+        compiling when the output is a terminal.
     """
 
-    if len(os.listdir(constants.get_temp_images_dir())) == 0:
+    if len([file for file in os.listdir(constants.get_temp_images_dir()) if file != MANIFEST_NAME]) == 0:
         click.echo(f"No images found in {constants.get_temp_images_dir()} to compile.", err=True)
         return
 
+    stats.reset()
     try:
+        paths = get_images()
+        if skip_duplicates:
+            unique = files.unique(paths)
+            click.echo(f"Leaving out {len(paths) - len(unique)} duplicate pages.")
+            paths = unique
+
         match compile_format:
             case "cbz":
-                compile_cbz(name, verbose)
+                compile_cbz(
+                    name,
+                    verbose,
+                    level,
+                    deflate_all,
+                    chapters_per_volume,
+                    None if max_volume_size is None else int(max_volume_size * 1024 * 1024),
+                    jobs,
+                    target,
+                    quality,
+                    convert_webp,
+                    paths,
+                )
             case "html":
-                compile_html(name, verbose)
+                compile_html(name, verbose, mode, paths)
             case _:
                 raise click.BadParameter(f"Unknown compile format: {compile_format}.")
     except Exception as e:
         click.echo(f"Error occurred while compiling:\n\t{e}", err=True)
+    finally:
+        stats.report(stats_path)
+
+def get_images(directory: str | None = None) -> list[pathlib.Path]:
+    """Gets the images in directory, temp_images by default, in page order, unfinished downloads are skipped with a warning"""
 
-def compile_html(name: str, verbose: bool) -> None:
-    """Compile to a folder with html files to view the manwha in"""
+    images = []
+    for path in sorted(pathlib.Path(directory or constants.get_temp_images_dir()).iterdir()):
+        if path.name == MANIFEST_NAME:
+            continue
+        if files.is_partial(path):
+            click.echo(f"Skipping {path.name} as it wasn't fully downloaded.", err=True)
+            continue
+        images.append(path)
+    return images
+
+def compile_html(name: str, verbose: bool, mode: str = files.DEFAULT_PLACE_MODE, paths: list[pathlib.Path] | None = None) -> None:
+    """Compile to a folder with html files to view the manwha in
+
+        mode: how images are placed into the chapter folders, see files.place
+        paths: the images to compile in order, defaults to the images in temp_images
+    """
 
     directory = os.path.join(constants.get_root_dir(), name)
     if os.path.exists(directory):
         raise Exception(f"{name} folder already exists at {directory}.")
     os.mkdir(directory)
 
-    images_json = {}
-    for file in pathlib.Path(constants.get_temp_images_dir()).iterdir():
-        chapter = file.name.split("Image")[0]
+    paths = get_images() if paths is None else paths
+    chapters: dict[str, list[pathlib.Path]] = {}
+    for file in paths:
+        chapters.setdefault(file.name.split("Image")[0], []).append(file)
 
-        if not os.path.exists(os.path.join(directory, chapter)):
-            os.mkdir(os.path.join(directory, chapter))
-
-        shutil.copy(file, os.path.join(directory, chapter, file.name))
+    stats.start_progress("pages", len(paths))
+    try:
+        for chapter in chapters:
+            chapter_dir = os.path.join(directory, chapter)
+            os.mkdir(chapter_dir)
 
-        if verbose:
-            click.echo(f"Copied {file.name} to {os.path.join(directory, chapter, file.name)}.")
+            for file in chapters[chapter]:
+                with stats.timer("place"):
+                    placed = files.place(file, os.path.join(chapter_dir, file.name), mode)
+                stats.count("pages")
+                stats.count("bytes", os.path.getsize(os.path.join(chapter_dir, file.name)))
+                if verbose:
+                    stats.echo(f"{placed.capitalize()} {file.name} to {os.path.join(chapter_dir, file.name)}.")
+    finally:
+        stats.stop_progress()
 
-        images_json.setdefault(chapter, {})
-        images_json[chapter].setdefault("images", [])
-        images_json[chapter]["images"].append(os.path.join(chapter, file.name))
+    write_html(directory, name, {chapter: [file.name for file in chapter_files] for chapter, chapter_files in chapters.items()}, verbose)
 
-    all_dirs = list(pathlib.Path(directory).iterdir())
-    all_dirs = [d for d in all_dirs if d.is_dir()]
+def write_html(directory: str, name: str, chapters: dict[str, list[str]], verbose: bool) -> None:
+    """Writes the images.json of each chapter folder, index.html and chapter.html of a series' folder
 
-    for index, chapter_dir in enumerate(all_dirs):
-        if index == 0:
-            images_json[chapter_dir.name].setdefault("previous", None)
-        else:
-            images_json[chapter_dir.name].setdefault("previous", all_dirs[index - 1].name)
+        chapters: the file names of the images in each chapter folder like {"Chapter001": ["Chapter001Image001.jpg"]}
+    """
 
-        if index == len(all_dirs) - 1:
-            images_json[chapter_dir.name].setdefault("next", None)
-        else:
-            images_json[chapter_dir.name].setdefault("next", all_dirs[index + 1].name)
+    chapter_names = list(chapters)
+    for index, chapter in enumerate(chapter_names):
+        images_json = {
+            "images": [os.path.join(chapter, file) for file in chapters[chapter]],
+            "previous": chapter_names[index - 1] if index > 0 else None,
+            "next": chapter_names[index + 1] if index < len(chapter_names) - 1 else None,
+        }
 
-        with open(os.path.join(chapter_dir.absolute(), "images.json"), "w") as file:
-            file.write(json.dumps(images_json[chapter_dir.name], indent=4))
+        with open(os.path.join(directory, chapter, "images.json"), "w") as file:
+            file.write(json.dumps(images_json, indent=4))
             file.close()
 
         if verbose:
-            click.echo(f"Created {os.path.join(chapter_dir.absolute(), "images.json")}.")
+            click.echo(f"Created {os.path.join(directory, chapter, "images.json")}.")
 
     with open(os.path.join(directory, "index.html"), "w") as file:
-        file.write("""<!DOCTYPE html>
+        file.write(index_html(name, chapter_names))
+    if verbose:
+        click.echo(f"Created {os.path.join(directory, "index.html")}.")
+
+    with open(os.path.join(directory, "chapter.html"), "w") as file:
+        file.write(chapter_html())
+    if verbose:
+        click.echo(f"Created {os.path.join(directory, "chapter.html")}.")
+
+def index_html(name: str, chapters: list[str]) -> str:
+    """Gets the index.html of a series listing its chapters like Chapter001"""
+
+    return """<!DOCTYPE html>
 <html lang="en">
 <head>
     <meta charset="UTF-8">
@@ -94,14 +183,13 @@ def compile_html(name: str, verbose: bool) -> None:
     </ul>
 </body>
 </html>""".format(title=name, chapters="\n\t\t".join(
-            ["<li><a href=\"chapter.html?chapter={chapter}\">Chapter {i}</a></li>".format(chapter=chapter, i=i+1) for i, chapter in enumerate(images_json.keys())]
-        )))
-        file.close()
-    if verbose:
-        click.echo(f"Created {os.path.join(directory, "index.html")}.")
+        ["<li><a href=\"chapter.html?chapter={chapter}\">Chapter {i}</a></li>".format(chapter=chapter, i=i+1) for i, chapter in enumerate(chapters)]
+    ))
 
-    with open(os.path.join(directory, "chapter.html"), "w") as file:
-        file.write("""<!DOCTYPE html>
+def chapter_html() -> str:
+    """Gets the chapter.html of a series, it shows the chapter in its url with the chapter's images.json"""
+
+    return """<!DOCTYPE html>
 <html lang="en">
 <head>
     <meta charset="UTF-8">
@@ -187,49 +275,135 @@ def compile_html(name: str, verbose: bool) -> None:
     <div id="images_container"></div>
     <div id="bottom"></div>
 </body>
-</html>""")
-        file.close()
-    if verbose:
-        click.echo(f"Created {os.path.join(directory, "chapter.html")}.")
+</html>"""
 
-def compile_cbz(name: str, verbose: bool) -> None:
-    """Compile as cbz"""
+def compile_cbz(
+        name: str,
+        verbose: bool,
+        level: int = archive.DEFAULT_LEVEL,
+        deflate_all: bool = False,
+        chapters_per_volume: int | None = None,
+        max_volume_size: int | None = None,
+        jobs: int | None = None,
+        target: str = transcode.DEFAULT_TARGET,
+        quality: int = transcode.DEFAULT_QUALITY,
+        convert_webp: bool = False,
+        paths: list[pathlib.Path] | None = None,
+        progress: bool = True,
+) -> None:
+    """Compile as cbz
 
-    paths = list(pathlib.Path(constants.get_temp_images_dir()).iterdir())
+        Pages are streamed into the cbz file one at a time instead of being loaded
+        into memory, see archive.CbzWriter for level and deflate_all.
 
-    pages = []
-    ignore = False
-    for i, path in enumerate(paths):
-        if path.suffix == ".webp":
-            if ignore:
-                continue
-            if click.confirm(f"PIL does not support webp files. Skip webp files in compilation?", abort=True):
-                ignore = True
-                continue
+        chapters_per_volume: split into volumes of this many chapters, 1 for a cbz file per chapter
+        max_volume_size: split into volumes of at most this many bytes, a chapter is never split
+        jobs: number of processes packing volumes or transcoding at once, defaults to the number of cpus
 
-        if verbose:
-            click.echo(f"Compiling {path}.")
-        pages.append(cbz.PageInfo.load(
-            path=path,
-            type=PageType.FRONT_COVER if i == 0 else PageType.BACK_COVER if i == len(paths) - 1 else PageType.STORY,
-            key=path.name,
-        ))
-
-    comic = cbz.ComicInfo.from_pages(
-        pages,
-        title=name,
-        series=name,
-        number=1,
-        language_iso="en",
-        format=Format.WEB_COMIC,
-        black_white=YesNo.NO,
-        manga=Manga.NO,
-        age_rating=AgeRating.PENDING
-    )
-    cbz_content = comic.pack()
-    cbz_path = pathlib.Path(os.path.join(constants.get_root_dir(), name + ".cbz"))
-    if os.path.exists(cbz_path):
-        raise Exception(f"{name} already exists at: {cbz_path}.")
-    cbz_path.write_bytes(cbz_content)
+        Pages in formats the cbz packer doesn't allow are transcoded first, see
+        transcode.transcode_pages for target, quality and convert_webp.
+
+        paths: the images to compile in order, defaults to the images in temp_images
+        progress: whether to show the progress line, not when the caller shows its own
+    """
+
+    with stats.timer("transcode"):
+        pages = transcode.transcode_pages(get_images() if paths is None else paths, target, quality, convert_webp, jobs, verbose)
+
+    volumes = split_volumes(pages, chapters_per_volume, max_volume_size)
+    volume_max_zeros = len(str(len(volumes)))
+
+    jobs_args = []
+    for i, volume in enumerate(volumes):
+        info = {
+            "Title": name,
+            "Series": name,
+            "Number": "1",
+            "Format": Format.WEB_COMIC.value,
+            "BlackAndWhite": YesNo.NO.value,
+            "Manga": Manga.NO.value,
+            "AgeRating": AgeRating.PENDING.value,
+            "LanguageISO": "en",
+        }
+        volume_name = name
+        if len(volumes) > 1:
+            volume_name = f"{name} Volume {str(i + 1).zfill(volume_max_zeros)}"
+            info.update({"Title": volume_name, "Number": str(i + 1), "Count": str(len(volumes))})
+
+        cbz_path = pathlib.Path(os.path.join(constants.get_root_dir(), volume_name + ".cbz"))
+        if os.path.exists(cbz_path):
+            raise Exception(f"{volume_name} already exists at: {cbz_path}.")
+        jobs_args.append((cbz_path, info, volume, level, deflate_all, verbose))
+
+    if progress:
+        stats.start_progress("pages", len(pages))
+    try:
+        if len(jobs_args) == 1:
+            pack_cbz(*jobs_args[0])
+            return
+
+        with ProcessPoolExecutor(max_workers=jobs, mp_context=constants.get_process_context()) as executor:
+            for future in [executor.submit(pack_volume, *args) for args in jobs_args]:
+                stats.get().merge(future.result())
+    finally:
+        if progress:
+            stats.stop_progress()
+
+def split_volumes(pages: list[tuple[pathlib.Path, str]], chapters_per_volume: int | None, max_volume_size: int | None) -> list[list[tuple[pathlib.Path, str]]]:
+    """Splits pages into volumes of whole chapters
+
+        pages: the path and key of each page in order
+
+        A new volume is started when the current one has chapters_per_volume chapters
+        or when the next chapter would make it bigger than max_volume_size. A chapter
+        bigger than max_volume_size gets a volume of its own.
+    """
+
+    chapters: dict[str, list[tuple[pathlib.Path, str]]] = {}
+    for page in pages:
+        chapters.setdefault(page[1].split("Image")[0], []).append(page)
+
+    volumes = [[]]
+    volume_chapters = 0
+    volume_size = 0
+    for chapter in chapters.values():
+        chapter_size = sum(os.path.getsize(path) for path, _ in chapter) if max_volume_size is not None else 0
+        if volume_chapters > 0 and (
+                (chapters_per_volume is not None and volume_chapters >= chapters_per_volume)
+                or (max_volume_size is not None and volume_size + chapter_size > max_volume_size)
+        ):
+            volumes.append([])
+            volume_chapters = 0
+            volume_size = 0
+        volumes[-1].extend(chapter)
+        volume_chapters += 1
+        volume_size += chapter_size
+    return volumes
+
+def pack_cbz(cbz_path: pathlib.Path, info: dict[str, str], pages: list[tuple[pathlib.Path, str]], level: int, deflate_all: bool, verbose: bool) -> None:
+    """Packs pages into a cbz file
+
+        pages: the path and key of each page in order
+    """
+
+    with stats.timer("pack"), archive.CbzWriter(cbz_path, info, level, deflate_all) as writer:
+        for path, key in pages:
+            if verbose:
+                stats.echo(f"Compiling {path}.")
+            with stats.timer("pack page"):
+                writer.add(path, key)
+            stats.count("pages")
+            stats.count("bytes", os.path.getsize(path))
     if verbose:
-        click.echo(f"Created {cbz_path}.")
+        stats.echo(f"Created {cbz_path}.")
+
+def pack_volume(cbz_path: pathlib.Path, info: dict[str, str], pages: list[tuple[pathlib.Path, str]], level: int, deflate_all: bool, verbose: bool) -> stats.Stats:
+    """Packs a volume in its own process, see pack_cbz
+
+        Returns the stats recorded while packing it to be merged into the stats
+        of the main process.
+    """
+
+    recorded = stats.start_recording()
+    pack_cbz(cbz_path, info, pages, level, deflate_all, verbose)
+    return recorded
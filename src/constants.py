@@ -1,5 +1,7 @@
 import os
 import sys
+import multiprocessing
+import multiprocessing.context
 
 
 def get_root_dir() -> str:
@@ -15,6 +17,39 @@ def get_temp_images_dir(create: bool = True) -> str:
         os.makedirs(temp_images_dir)
     return temp_images_dir
 
+def get_workspaces_dir(create: bool = True) -> str:
+    """Get the directory of workspaces, which has a temp_images of each series of a batch download"""
+
+    workspaces_dir = os.path.join(get_root_dir(), "workspaces")
+    if not os.path.exists(workspaces_dir) and create:
+        os.makedirs(workspaces_dir)
+    return workspaces_dir
+
+def get_page_cache_dir(create: bool = True) -> str:
+    """Get the directory of page_cache"""
+
+    page_cache_dir = os.path.join(get_root_dir(), "page_cache")
+    if not os.path.exists(page_cache_dir) and create:
+        os.makedirs(page_cache_dir)
+    return page_cache_dir
+
+def get_transcode_cache_dir(create: bool = True) -> str:
+    """Get the directory of transcode_cache"""
+
+    transcode_cache_dir = os.path.join(get_root_dir(), "transcode_cache")
+    if not os.path.exists(transcode_cache_dir) and create:
+        os.makedirs(transcode_cache_dir)
+    return transcode_cache_dir
+
+def get_process_context() -> multiprocessing.context.BaseContext:
+    """Get the context to start the processes of a pool with
+
+        Processes are spawned instead of forked, a fork would copy the locks held
+        by the threads of the parent, like the progress line's, and wait on them forever.
+    """
+
+    return multiprocessing.get_context("spawn")
+
 class ProgError(Exception):
     """Programmer Error
 
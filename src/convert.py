@@ -1,23 +1,25 @@
 import os
 import pathlib
-import shutil
+from concurrent.futures import ThreadPoolExecutor
 import click
-from cbz import ComicInfo
 
-from src import constants
-from src.compile import compile_cbz, compile_html
+from src import archive, constants, files, stats
+from src.compile import compile_cbz, write_html
 
 
 @click.command()
 @click.help_option("-h", "--help")
 @click.argument("name")
 @click.option("-v", "--verbose", "verbose", default=False, is_flag=True, help="Show more information.")
-def convert(name: str, verbose: bool) -> None:
+@click.option("-j", "--jobs", "jobs", default=None, type=click.IntRange(min=1), show_default="number of cpus", help="Number of pages extracted or volumes packed at once.", metavar="JOBS")
+@stats.option
+def convert(name: str, verbose: bool, jobs: int | None, stats_path: str | None) -> None:
     """Converts series to and from each format
 
         If it's a cbz file it will be converted to html and vice versa
 
-        It will not delete the original file(s) or anything in temp_images
+        It will not delete the original file(s) or touch anything in temp_images,
+        pages are copied straight from one format to the other.
     """
 
     path = os.path.join(constants.get_root_dir(), name)
@@ -25,43 +27,84 @@ def convert(name: str, verbose: bool) -> None:
         click.echo(f"{name} does not exist at {path}.", err=True)
         return
 
-    if name.endswith(".cbz"):
-        if os.path.exists(constants.get_temp_images_dir(create=False)):
-            os.rename(constants.get_temp_images_dir(), constants.get_temp_images_dir() + "_backup")
+    stats.reset()
+    try:
+        if name.endswith(".cbz"):
+            cbz_to_html(path, name.removesuffix(".cbz"), verbose, jobs)
+        elif os.path.isdir(path):
+            compile_cbz(name, verbose, jobs=jobs, paths=html_images(path))
+        else:
+            click.echo(f"{path} is not a cbz file or directory.", err=True)
+    except Exception as e:
+        click.echo(f"Error occurred while converting:\n\t{e}", err=True)
+    finally:
+        stats.report(stats_path)
 
-        extract_cbz(path, verbose)
-        compile_html(name.rstrip(".cbz"), verbose)
-    elif os.path.isdir(name):
-        if os.path.exists(constants.get_temp_images_dir(create=False)):
-            os.rename(constants.get_temp_images_dir(), constants.get_temp_images_dir() + "_backup")
 
-        extract_html(path, verbose)
-        compile_cbz(name, verbose)
-    else:
-        click.echo(f"{path} is not a cbz file or directory.", err=True)
-        return
+def cbz_to_html(path: str, name: str, verbose: bool, jobs: int | None = None) -> None:
+    """Extracts the pages of a cbz file straight into the chapter folders of a series' folder
+
+        jobs: number of pages extracted at once, defaults to the number of cpus
+    """
 
-    shutil.rmtree(constants.get_temp_images_dir(create=False))
-    os.rename(constants.get_temp_images_dir(create=False) + "_backup", constants.get_temp_images_dir(create=False))
+    directory = os.path.join(constants.get_root_dir(), name)
+    if os.path.exists(directory):
+        raise Exception(f"{name} folder already exists at {directory}.")
+
+    with archive.CbzReader(path) as reader:
+        # In order by chapter number, not in the order of the zip's entries, for the previous and next of each chapter
+        chapters: dict[str, list[dict[str, str]]] = {
+            chapter_pages[0]["key"].split("Image")[0]: chapter_pages for chapter_pages in reader.chapters()
+        }
+        if not chapters:
+            raise Exception(f"{path} has no pages.")
+        # Keys are taken from the cbz file, checked before anything is written
+        for chapter, pages in chapters.items():
+            files.join_inside(directory, chapter)
+            for page in pages:
+                files.join_inside(directory, chapter, page["key"])
+
+        os.mkdir(directory)
+        for chapter in chapters:
+            os.mkdir(os.path.join(directory, chapter))
+
+        stats.start_progress("pages", len(reader.pages))
+        try:
+            with ThreadPoolExecutor(max_workers=jobs) as executor:
+                futures = [
+                    (page, executor.submit(extract_page, reader, page, os.path.join(directory, chapter, page["key"])))
+                    for chapter, pages in chapters.items() for page in pages
+                ]
+                for page, future in futures:
+                    extracted = future.result()
+                    if verbose:
+                        stats.echo(f"Extracted {page["name"]} from {path} to {extracted}.")
+        finally:
+            stats.stop_progress()
 
+    write_html(directory, name, {chapter: [page["key"] for page in pages] for chapter, pages in chapters.items()}, verbose)
 
-def extract_cbz(path: str, verbose: bool) -> None:
-    """Extracts image files and places them into temp_images"""
 
-    comic = ComicInfo.from_cbz(path)
-    for page in comic.pages:
-        if verbose:
-            click.echo(f"Extracting {page.key} to temp_images from {path}.")
-        page.save(os.path.join(constants.get_temp_images_dir(), page.key))
+def extract_page(reader: archive.CbzReader, page: dict[str, str], path: str) -> str:
+    """Copies a page out of a cbz file in chunks, runs in the extracting threads"""
 
+    with stats.timer("extract page"), reader.open(page) as source, files.PartialFile(path) as file:
+        for chunk in iter(lambda: source.read(files.CHUNK_SIZE), b""):
+            file.write(chunk)
+    stats.count("pages")
+    stats.count("bytes", file.written)
+    return path
 
-def extract_html(path: str, verbose: bool) -> None:
-    """Extracts image files and places them into temp_images"""
 
-    for folder in pathlib.Path(path).iterdir():
-        if os.path.isdir(folder):
-            for file in folder.iterdir():
-                if not file.suffix == ".json":
-                    if verbose:
-                        click.echo(f"Extracting {file.name} to temp_images from {path}.")
-                    shutil.copy(file.absolute(), os.path.join(constants.get_temp_images_dir(), file.name))
\ No newline at end of file
+def html_images(path: str) -> list[pathlib.Path]:
+    """Gets the images of a series' folder in order of its chapter folders"""
+
+    images = []
+    for folder in sorted(pathlib.Path(path).iterdir()):
+        if not folder.is_dir():
+            continue
+        for file in sorted(folder.iterdir()):
+            if file.suffix == ".json" or files.is_partial(file):
+                continue
+            images.append(file)
+    return images
@@ -1,70 +1,124 @@
-import importlib
 import click
 
-from src import constants
-from src.providers.asura import AsuraDownloader
-from src.providers.mgeko import MangaGekkoDownloader
-from src.providers.general import GeneralDownloader
+from src import constants, page_cache, providers, session, stats
+from src.downloader import Downloader
+
+
+# Number of series of a batch downloaded at once
+DEFAULT_JOBS = 4
+
+def download_options(command):
+    """Adds the options of the commands that download a series"""
+
+    options = [
+        click.option("-p", "--provider", "provider", is_flag=False, flag_value="", type=click.STRING, default=None, help="Name of the provider (website) of the manwha/manga.", metavar="PROVIDER"),
+        click.option("-w", "--workers", "workers", default=session.DEFAULT_WORKERS, type=click.IntRange(min=1), show_default=True, help="Number of images to download at once, also the connection pool size of each host and the most requests in flight to each host.", metavar="WORKERS"),
+        click.option("-r", "--rate", "rate", default=None, type=click.FloatRange(min=0), help="Most requests started each second to each host, 0 for no limit. Defaults to the provider's limit on its site, if it has one.", metavar="RPS"),
+        click.option("-t", "--timeout", "timeout", default=session.DEFAULT_TIMEOUT, type=click.FloatRange(min=0, min_open=True), show_default=True, help="Seconds to wait for a connection and between bytes of a response.", metavar="SECONDS"),
+        click.option("-e", "--engine", "engine", default="thread", type=click.Choice(["thread", "async"]), show_default=True, help="Download on a pool of threads or as coroutines on one event loop over HTTP/2."),
+        click.option("--cache-size", "cache_size", default=page_cache.DEFAULT_MAX_SIZE // 1024 // 1024, type=click.IntRange(min=0), show_default=True, help="Megabytes of series and chapter pages kept in page_cache to be revalidated instead of downloaded again next time, 0 to not cache them.", metavar="MEGABYTES"),
+        click.option("--retry-failed", "retry_failed", default=False, is_flag=True, help="Only fetch the pages and images that the last run of the unfinished download in temp_images gave up on."),
+        stats.option,
+    ]
+    for option in reversed(options):
+        command = option(command)
+    return command
 
 
 @click.command()
 @click.help_option("-h", "--help")
-@click.argument("url")
-@click.option("-p", "--provider", "provider", is_flag=False, flag_value="", type=click.STRING, default=None, help="Name of the provider (website) of the manwha/manga.", metavar="PROVIDER")
-def download(url: str, provider: str | None) -> None:
+@click.argument("urls", nargs=-1)
+@click.option("-i", "--input", "queue_path", default=None, type=click.Path(exists=True, dir_okay=False), help="Also download the series in this queue file, a url and optionally a space and a name on each line.", metavar="FILE")
+@click.option("-j", "--jobs", "jobs", default=DEFAULT_JOBS, type=click.IntRange(min=1), show_default=True, help="Number of series of a batch downloaded at once.", metavar="JOBS")
+@download_options
+def download(urls: tuple[str, ...], queue_path: str | None, jobs: int, provider: str | None, workers: int, timeout: float, rate: float | None, engine: str, cache_size: int, retry_failed: bool, stats_path: str | None) -> None:
     """Downloads a manwha/manga from a url
 
-        URL: the url to the homepage of the series to download.
+        URLS: the url to the homepage of the series to download.
+
+        More than one url, or a queue file given with --input, downloads them as a
+        batch: --jobs series at once, each into workspaces/NAME where NAME is the
+        last part of its url's path unless the queue file names it. Each series is
+        compiled to NAME.cbz once it's downloaded. --workers and the limit of each
+        host are shared by the whole batch. Series already compiled are skipped and
+        running a batch again resumes its incomplete downloads.
 
-        If the --provider flag is not given, the provider will be automatically detected,
-        ie if url starts with https://asuracomic the AsuraDownloader will be used.
+        If the --provider flag is not given, the provider will be automatically detected
+        from the url patterns of each provider, ie if url starts with https://asuracomic.
+        the AsuraDownloader will be used.
 
         Use --provider as a flag to pick from a list of available providers.
+
+        A progress line with the images per second and time left is shown
+        while downloading when the output is a terminal.
+
+        Pages and images that fail are fetched again with backoff once the rest
+        is done. Those that fail 4 times are listed at the end and can be fetched
+        again on their own with --retry-failed.
+
+        The requests in flight to each host start at a few and adapt to how the
+        host answers, up to --workers. When a host throttles (status code 429 or
+        503), its requests wait for its Retry-After and are sent again.
     """
 
+    # Imported here as batch imports get_downloader from this module
+    from src import batch
+
+    series = [(url, None) for url in urls]
+    if queue_path is not None:
+        series += batch.read_queue(queue_path)
+    if not series:
+        raise click.UsageError("Give the url of a series or a queue file with --input.")
+
+    stats.reset()
     try:
-        if provider is None:
-            if url.startswith("https://asuracomic"):
-                AsuraDownloader(url).download()
-            elif url.startswith("https://www.mgeko.cc"):
-                MangaGekkoDownloader(url).download()
-            else:
-                GeneralDownloader(url).download()
-            return
-        if provider == "":
-            provider = get_provider()
-
-        provider_dict = importlib.import_module("src.providers." + provider).__dict__
-        downloader = list(provider_dict.values())[-1]
-
-        downloader(url).download()
+        session.configure(workers, timeout, rate, cache_size * 1024 * 1024)
+        if len(series) == 1 and queue_path is None:
+            get_downloader(series[0][0], provider).download(engine, retry_failed=retry_failed)
+        elif engine != "thread":
+            raise Exception("A batch is downloaded on the thread engine only, leave out --engine.")
+        else:
+            batch.download_batch(series, provider, retry_failed, jobs)
     except constants.ProgError as e:
         raise Exception(e)
-    except ModuleNotFoundError:
-        click.echo(f"{provider} is not a valid provider.", err=True)
     except Exception as e:
         click.echo(f"Error occurred while downloading:\n\t{e}", err=True)
+    finally:
+        session.close()
+        stats.report(stats_path)
+
+def get_downloader(url: str, provider: str | None) -> Downloader:
+    """Gets the Downloader of a series
+
+        url: the url to the homepage of the series
+        provider: name of the provider, None to detect it from url or "" to pick from a list
+
+        Only the module of the provider is imported. The provider's rate, if it has
+        one, caps the requests to the host of url unless --rate was given.
+    """
+
+    if provider is None:
+        provider = providers.detect(url)
+    elif provider == "":
+        provider = get_provider()
+
+    if providers.PROVIDERS.get(provider, {}).get("rate") is not None:
+        session.limit_host(url, providers.PROVIDERS[provider]["rate"])
+    return providers.load(provider)(url)
 
 def get_provider() -> str:
     """Gets user selected provider from list of available providers"""
 
     click.clear()
-    file_num = 1
-    providers = []
-    for file_name in [key for key in importlib.import_module("src.providers").__dict__.keys() if not key.startswith("__")]:
-        provider_dict = importlib.import_module("src.providers." + file_name).__dict__
-        downloader_class = list(provider_dict.values())[-1]
-        click.echo(f"{file_num}. {downloader_class.__doc__ or downloader_class.__name__} ({file_name})")
-        providers.append(file_name)
-
-        file_num += 1
+    for file_num, (name, provider) in enumerate(providers.PROVIDERS.items(), start=1):
+        click.echo(f"{file_num}. {provider["description"]} ({name})")
 
     click.echo("Enter the name of the provider (the name in the last set of parentheses):")
+    stdin = click.get_text_stream("stdin")
     while True:
-        provider = click.get_text_stream("stdin").readline().strip()
-        for prov in providers:
-            if provider == prov:
-                click.clear()
-                return provider
+        provider = stdin.readline().strip()
+        if provider in providers.PROVIDERS:
+            click.clear()
+            return provider
 
         click.echo("\nEnter a valid provider:")
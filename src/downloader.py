@@ -1,10 +1,12 @@
 import os
+import time
 import pathlib
 import click
 import requests
-from concurrent.futures import ThreadPoolExecutor
 
-from src import constants
+from src import constants, files, retry, session, stats
+from src.manifest import Manifest
+from src.scheduler import Group, Scheduler
 
 
 class Downloader:
@@ -32,108 +34,340 @@ class Downloader:
             raise constants.ProgError("Either first_url or urls must be defined.")
         self.first_url = first_url or None
         self.urls = urls or None
+        self.manifest: Manifest | None = None
+        # The pages and images given up on by the last run when retrying only them, see retry_failed
+        self.failed: list[dict] | None = None
+        self.directory: str | None = None
+        self.scheduler: Scheduler | None = None
+
+    def download(self, engine: str = "thread", skip: int = 0, retry_failed: bool = False, directory: str | None = None, scheduler: Scheduler | None = None) -> bool:
+        """Downloads all images of all chapters
+
+            engine: "thread" to download on a pool of threads or "async" to download
+                as coroutines on one event loop over HTTP/2
+            skip: number of chapters at the start to not download, like the chapters
+                already in a cbz file being updated
+            retry_failed: only fetch the pages and images the last run of the unfinished
+                download in temp_images gave up on
+            directory: where to download the images to, defaults to temp_images
+            scheduler: a thread engine Scheduler shared with the downloads of other
+                series, like in a batch download. The progress line is then left to the
+                caller and if directory has files of another download it raises instead
+                of asking to delete them.
+
+            If temp_images has an unfinished download of the same series it is resumed,
+            only the images and chapters that weren't downloaded yet are.
+
+            Pages and images that fail are fetched again after the rest with backoff,
+            see retry.RetryQueue. Those that still fail are listed and recorded in the
+            manifest for retry_failed.
+
+            Returns whether everything was downloaded.
+        """
 
-    def download(self) -> None:
-        """Downloads all images of all chapters"""
-
-        num_files = 0
-        for _ in pathlib.Path(constants.get_temp_images_dir()).iterdir():
-            num_files += 1
-        if num_files > 0:
-            if click.confirm(f"temp_images has {num_files} files. Do you want to delete them to continue?"):
-                for file in pathlib.Path(constants.get_temp_images_dir()).iterdir():
-                    click.echo(f"Deleting {file.absolute()}.")
-                    os.remove(file.absolute())
-            else:
-                click.echo("Exiting.")
-                return
+        directory = directory or constants.get_temp_images_dir()
+        self.directory = directory
+        self.scheduler = scheduler
+        self.manifest = Manifest.load(directory)
+        resumable = self.manifest is not None and not self.manifest.complete and self.manifest.matches(self.first_url, self.urls, skip)
+        if retry_failed:
+            if not resumable or self.manifest.failures is None:
+                if self.manifest is not None:
+                    self.manifest.close()
+                raise Exception(f"{directory} has no unfinished download of this series with failures to retry.")
+            self.failed = self.manifest.failures
+            stats.echo(f"Retrying {len(self.failed)} pages and images that failed in the last run in {directory}.")
+        elif resumable:
+            stats.echo(f"Resuming the download in {directory}, {len(self.manifest.sizes)} images were already downloaded.")
+        else:
+            if self.manifest is not None:
+                self.manifest.close()
+
+            num_files = 0
+            for _ in pathlib.Path(directory).iterdir():
+                num_files += 1
+            # The series of a batch are downloaded on threads of their own, several could ask at once
+            if num_files > 0 and scheduler is not None:
+                raise Exception(f"{directory} has {num_files} files of another download.")
+            if num_files > 0:
+                if click.confirm(f"{os.path.basename(directory)} has {num_files} files. Do you want to delete them to continue?"):
+                    for file in pathlib.Path(directory).iterdir():
+                        click.echo(f"Deleting {file.absolute()}.")
+                        os.remove(file.absolute())
+                else:
+                    click.echo("Exiting.")
+                    return False
+
+            self.manifest = Manifest.create(directory, self.first_url, self.urls, skip)
+
+        try:
+            self.skip_chapters(skip)
+            if scheduler is None:
+                stats.start_progress("images", "queued")
+
+            retries = retry.RetryQueue()
+            match engine:
+                case "thread":
+                    self.download_threaded(retries)
+                case "async":
+                    # Imported here so httpx is only loaded when the async engine is used
+                    from src import async_engine
+                    async_engine.download(self, retries)
+                case _:
+                    raise constants.ProgError(f"Unknown engine: {engine}.")
+
+            if scheduler is None:
+                stats.stop_progress()
+            if retries.failures or self.manifest.missing() > 0:
+                self.manifest.add_failures(retries.failures)
+                if retries.failures:
+                    stats.echo(f"{len(retries.failures)} pages and images failed after {retries.attempts} attempts:", err=True)
+                    for failure in retries.failures:
+                        stats.echo(f"    {failure['error']}", err=True)
+                stats.echo("The download is incomplete, run download again with the same url to resume it or also with --retry-failed to only fetch what failed.", err=True)
+                return False
+
+            if self.urls is None:
+                self.pad_chapters(directory, [
+                    [pathlib.Path(image["filename"]).suffix for image in self.manifest.chapters[chapter]["images"]]
+                    for chapter in sorted(self.manifest.chapters)
+                ])
+            if self.manifest.duplicates > 0:
+                stats.echo(f"{self.manifest.duplicates} images were the same as an earlier one and are stored once, saving {self.manifest.duplicate_bytes / 1024 / 1024:.1f} MB.")
+            self.manifest.finish()
+            return True
+        finally:
+            if scheduler is None:
+                stats.stop_progress()
+            self.manifest.close()
+
+    def skip_chapters(self, skip: int) -> None:
+        """Records the first skip chapters in the manifest without any images
+
+            Chapters followed with get_next_url still have their pages fetched to find
+            the first chapter to download, but their images aren't parsed.
+        """
 
         if self.urls is not None:
-            chapter_max_zeros = len(str(len(self.urls)))
+            for chapter in range(1, min(skip, len(self.urls)) + 1):
+                if chapter not in self.manifest.chapters:
+                    self.manifest.add_chapter(chapter, self.urls[chapter - 1], None, [])
+            return
 
-            for chapter, url in enumerate(self.urls):
-                response = requests.get(url)
+        url = self.first_url
+        if self.manifest.chapters:
+            url = self.manifest.chapters[max(self.manifest.chapters)]["next_url"]
 
-                if response.status_code != 200:
-                    click.echo(f"{url} failed with status code {response.status_code}.", err=True)
-                    continue
+        while url is not None and len(self.manifest.chapters) < skip:
+            response = session.get(url)
+            if response.status_code != 200:
+                raise Exception(f"{url} failed with status code {response.status_code}.")
 
-                image_urls = self.get_image_urls(response)
+            click.echo(f"Skipping {url} ({len(self.manifest.chapters) + 1}/{skip})")
 
-                if len(image_urls) == 0:
-                    click.echo(f"Couldn't find any images at {url}.", err=True)
-                    continue
+            with stats.timer("get_next_url"):
+                next_url = self.get_next_url(response)
+            self.manifest.add_chapter(len(self.manifest.chapters) + 1, url, next_url, [])
+            url = next_url
+
+    def download_threaded(self, retries: retry.RetryQueue) -> None:
+        """Downloads all images of all chapters on a pool of threads, or on the shared scheduler
 
-                image_max_zeros = len(str(len(image_urls)))
+            Chapters already in the manifest aren't fetched again, only their images
+            that aren't downloaded yet are. What fails is put in retries and fetched
+            again once it's due, until nothing is left in it.
+        """
 
-                images = []
-                for i, image_url in enumerate(image_urls):
-                    path = pathlib.Path(image_url)
-                    if path.suffix == ".svg":
+        with (Scheduler(session.get_workers()) if self.scheduler is None else self.scheduler.group()) as scheduler:
+            for chapter, images in self.resume_images():
+                stats.echo(f"Resuming {len(images)} images from {self.manifest.chapters[chapter]['url']} (chapter {chapter})")
+                stats.count("queued", len(images))
+                for image in images:
+                    scheduler.submit(self.try_image, image, retries)
+
+            if self.urls is not None:
+                chapters = self.pending_chapters()
+                for (chapter, url), future in zip(chapters, scheduler.prefetch(self.fetch_chapter, [url for _, url in chapters])):
+                    try:
+                        response, image_urls = future.result()
+                        self.check_chapter(url, response, image_urls)
+                    except Exception as e:
+                        retries.add({"type": "chapter", "chapter": chapter, "url": url}, e)
                         continue
-                    images.append({
-                        "url": image_url,
-                        "filename": f"Chapter{str(chapter + 1).zfill(chapter_max_zeros)}Image{str(i + 1).zfill(image_max_zeros)}{path.suffix}",
-                    })
+                    for image in self.add_chapter(chapter, url, None, image_urls):
+                        scheduler.submit(self.try_image, image, retries)
+            else:
+                self.walk_threaded(self.walk_start(), scheduler, retries)
+
+            while True:
+                wait = retries.due()
+                if wait is None:
+                    # Downloads still running may fail and be queued again
+                    scheduler.join()
+                    if retries.due() is None:
+                        return
+                    continue
+
+                time.sleep(wait)
+                for entry in retries.pop_due():
+                    if entry["type"] == "image":
+                        scheduler.submit(self.try_image, entry, retries)
+                    elif self.urls is not None:
+                        try:
+                            response, image_urls = self.fetch_chapter(entry["url"])
+                            self.check_chapter(entry["url"], response, image_urls)
+                        except Exception as e:
+                            retries.add(entry, e)
+                            continue
+                        for image in self.add_chapter(entry["chapter"], entry["url"], None, image_urls):
+                            scheduler.submit(self.try_image, image, retries)
+                    else:
+                        self.walk_threaded(entry["url"], scheduler, retries, entry)
+
+    def walk_threaded(self, url: str | None, scheduler: Scheduler | Group, retries: retry.RetryQueue, entry: dict | None = None) -> None:
+        """Downloads the chapters by following get_next_url from url
+
+            A page that fails stops the walk and is put in retries, the walk goes on
+            from it when it's retried.
+
+            entry: the entry of url in retries if it's being retried
+        """
+
+        # Each chapter's url is only known after its previous page is parsed, so pages
+        # are fetched one at a time while the images queued before keep downloading.
+        while url is not None:
+            chapter = len(self.manifest.chapters) + 1
+            try:
+                response, image_urls = self.fetch_chapter(url)
+                self.check_chapter(url, response, image_urls)
+                with stats.timer("get_next_url"):
+                    next_url = self.get_next_url(response)
+            except Exception as e:
+                retries.add(entry or {"type": "chapter", "chapter": chapter, "url": url}, e)
+                return
+
+            for image in self.add_chapter(chapter, url, next_url, image_urls):
+                scheduler.submit(self.try_image, image, retries)
+            url = next_url
+            entry = None
+
+    def resume_images(self) -> list[tuple[int, list[dict[str, str]]]]:
+        """Gets the images of the chapters in the manifest that still need to be downloaded by chapter
+
+            Only those the last run gave up on when retrying only them.
+        """
+
+        failed = None
+        if self.failed is not None:
+            failed = {entry["filename"] for entry in self.failed if entry["type"] == "image"}
+
+        chapters = []
+        for chapter in sorted(self.manifest.chapters):
+            images = [image for image in self.manifest.pending(chapter) if failed is None or image["filename"] in failed]
+            if images:
+                chapters.append((chapter, images))
+        return chapters
+
+    def pending_chapters(self) -> list[tuple[int, str]]:
+        """Gets the numbers and urls of the chapters of urls that aren't in the manifest
+
+            Only those the last run gave up on when retrying only them.
+        """
 
-                click.echo(f"Downloading {len(image_urls)} images from {url} ({chapter + 1}/{len(self.urls)})")
+        if self.failed is not None:
+            return [(entry["chapter"], entry["url"]) for entry in self.failed if entry["type"] == "chapter" and entry["chapter"] not in self.manifest.chapters]
+        return [(chapter, url) for chapter, url in enumerate(self.urls, start=1) if chapter not in self.manifest.chapters]
 
-                with ThreadPoolExecutor() as executor:
-                    executor.map(self.download_image, images)
+    def walk_start(self) -> str | None:
+        """Gets the url to follow get_next_url from, after the last chapter in the manifest
+
+            None if the last chapter was reached, or when retrying only what the last
+            run gave up on if the walk didn't stop there.
+        """
+
+        if self.failed is not None:
+            return next((entry["url"] for entry in self.failed if entry["type"] == "chapter"), None)
+        if self.manifest.chapters:
+            return self.manifest.chapters[max(self.manifest.chapters)]["next_url"]
+        return self.first_url
+
+    @staticmethod
+    def check_chapter(url: str, response: requests.Response, image_urls: list[str]) -> None:
+        """Raises if a chapter's page failed to load or has no images"""
+
+        if response.status_code != 200:
+            raise Exception(f"{url} failed with status code {response.status_code}.")
+        if len(image_urls) == 0:
+            raise Exception(f"Couldn't find any images at {url}.")
+
+    def add_chapter(self, chapter: int, url: str, next_url: str | None, image_urls: list[str]) -> list[dict[str, str]]:
+        """Records a chapter that was found in the manifest and stats
+
+            Returns its images to download.
+        """
+
+        if self.urls is not None:
+            images = self.chapter_images(str(chapter).zfill(len(str(len(self.urls)))), image_urls)
         else:
-            url = self.first_url
-            image_amounts = []
-            chapter = 1
+            images = self.chapter_images(str(chapter), image_urls)
+        self.manifest.add_chapter(chapter, url, next_url, images)
+
+        stats.count("chapters")
+        stats.count("queued", len(images))
 
-            while url is not None:
-                response = requests.get(url)
+        stats.echo(f"Downloading {len(images)} images from {url} ({chapter}/{len(self.urls) if self.urls is not None else "???"})")
+        return images
 
-                if response.status_code != 200:
-                    click.echo(f"{url} failed with status code {response.status_code}.", err=True)
-                    return
+    @staticmethod
+    def chapter_images(chapter: str, image_urls: list[str]) -> list[dict[str, str]]:
+        """Gets the images to download of a chapter, svg images are skipped
 
-                image_urls = self.get_image_urls(response)
+            chapter: the chapter's number as it appears in the filenames
+            image_urls: urls of the chapter's images
+        """
 
-                if len(image_urls) == 0:
-                    click.echo(f"Couldn't find any images at {url}.", err=True)
-                    return
+        image_urls = [image_url for image_url in image_urls if pathlib.Path(image_url).suffix != ".svg"]
+        image_max_zeros = len(str(len(image_urls)))
 
-                for index in range(len(image_urls)-1, -1, -1):
-                    path = pathlib.Path(image_urls[index])
-                    if path.suffix == ".svg":
-                        image_urls.pop(index)
+        images = []
+        for i, image_url in enumerate(image_urls):
+            images.append({
+                "url": image_url,
+                "filename": f"Chapter{chapter}Image{str(i + 1).zfill(image_max_zeros)}{pathlib.Path(image_url).suffix}",
+            })
+        return images
 
-                image_amounts.append([])
-                image_max_zeros = len(str(len(image_urls)))
+    @staticmethod
+    def pad_chapters(directory: str, image_amounts: list[list[str]]) -> None:
+        """Zero pads the chapter numbers of images downloaded by following get_next_url
 
-                images = []
-                for i, image_url in enumerate(image_urls):
-                    path = pathlib.Path(image_url)
-                    image_amounts[chapter-1].append(path.suffix)
-                    images.append({
-                        "url": image_url,
-                        "filename": f"Chapter{chapter}Image{str(len(images)+1).zfill(image_max_zeros)}{path.suffix}",
-                    })
+            directory: where the images were downloaded to
+            image_amounts: the extensions of each chapter's images
+        """
 
-                click.echo(f"Downloading {len(images)} images from {url} ({chapter}/???)")
+        if len(image_amounts) < 10:
+            return
 
-                with ThreadPoolExecutor() as executor:
-                    executor.map(self.download_image, images)
+        chapter_max_zeros = len(str(len(image_amounts)))
+        for chapter, images in enumerate(image_amounts):
+            image_max_zeros = len(str(len(images)))
+            for image, ext in enumerate(images):
+                os.rename(
+                    os.path.join(directory, f"Chapter{chapter+1}Image{str(image+1).zfill(image_max_zeros)}{ext}"),
+                    os.path.join(directory, f"Chapter{str(chapter+1).zfill(chapter_max_zeros)}Image{str(image+1).zfill(image_max_zeros)}{ext}")
+                )
 
-                chapter += 1
-                url = self.get_next_url(response)
+    def fetch_chapter(self, url: str) -> tuple[requests.Response, list[str]]:
+        """Gets a chapter's page and the urls of its images
 
-            if chapter <= 10:
-                return
+            The image urls are empty if the page failed to load.
+        """
 
-            chapter_max_zeros = len(str(len(image_amounts)))
-            for chapter, images in enumerate(image_amounts):
-                image_max_zeros = len(str(len(images)))
-                for image, ext in enumerate(images):
-                    os.rename(
-                        os.path.join(constants.get_temp_images_dir(), f"Chapter{chapter+1}Image{str(image+1).zfill(image_max_zeros)}{ext}"),
-                        os.path.join(constants.get_temp_images_dir(), f"Chapter{str(chapter+1).zfill(chapter_max_zeros)}Image{str(image+1).zfill(image_max_zeros)}{ext}")
-                    )
+        response = session.get(url)
+        if response.status_code != 200:
+            return response, []
+        with stats.timer("get_image_urls"):
+            return response, self.get_image_urls(response)
 
     def get_image_urls(self, response: requests.Response) -> list[str]:
         """Gets images urls"""
@@ -145,32 +379,59 @@ class Downloader:
 
         raise constants.ProgError("To be implemented.")
 
+    def try_image(self, image: dict[str, str], retries: retry.RetryQueue) -> None:
+        """Saves an image, if it fails it's put in retries"""
+
+        try:
+            self.save_image(image)
+        except Exception as e:
+            retries.add({"type": "image", **image}, e)
+
+    def save_image(self, image: dict[str, str]) -> None:
+        """Downloads an image and records it in the manifest and stats"""
+
+        start = time.perf_counter()
+        written, digest = self.download_image(image, self.directory)
+        self.manifest.add_image(image["filename"], written, digest)
+        stats.record("image", time.perf_counter() - start)
+        stats.count("images")
+        stats.count("bytes", written)
+
     @staticmethod
-    def download_image(image: {str, str}) -> None:
+    def download_image(image: {str, str}, directory: str) -> tuple[int, str]:
         """Downloads an image
 
             image: {
                 url: str,
                 filename: str,
             }
+            directory: where to download it to
+
+            The image is streamed to disk in chunks and only gets its filename once
+            all of it was written. A response that isn't 200 raises instead of being saved.
+
+            Returns the number of bytes written and their sha256. The time spent
+            writing to disk is recorded in stats.
         """
 
-        file = requests.get(image["url"])
-        file_path = os.path.join(constants.get_temp_images_dir(), image["filename"])
-        with open(file_path, "wb") as f:
-            f.write(file.content)
+        file_path = os.path.join(directory, image["filename"])
+        writing = 0.0
+        with session.get(image["url"], stream=True) as response:
+            if response.status_code != 200:
+                raise Exception(f"{image['url']} failed with status code {response.status_code}.")
+            with files.PartialFile(file_path, files.expected_size(response.headers)) as f:
+                for chunk in response.iter_content(chunk_size=files.CHUNK_SIZE):
+                    start = time.perf_counter()
+                    f.write(chunk)
+                    writing += time.perf_counter() - start
+                start = time.perf_counter()
+            writing += time.perf_counter() - start
+        stats.record("disk write", writing)
+        return f.written, f.hash.hexdigest()
 
     @staticmethod
     def remove_duplicates(array: list[str]) -> None:
         """Removes duplicate from list"""
 
-        # Find all indices of urls that are repeated before
-        indices = []
-        for i, url in enumerate(array):
-            if array[:i].count(url) != 0:
-                indices.append(i)
-        # Remove the indices from urls but update the other indices
-        for index in indices:
-            array.pop(index)
-            for i in range(len(indices)):
-                indices[i] -= 1
+        # Dicts keep the order keys were first added in
+        array[:] = dict.fromkeys(array)
@@ -0,0 +1,173 @@
+import re
+import html
+import json
+import functools
+import urllib.parse
+from collections.abc import Iterator
+from typing import Any
+
+
+# A comment or a tag, quoted attribute values may contain ">"
+TAG = r"""<!--.*?-->|<(/?)({name})([^>"']*(?:(?:"[^"]*"|'[^']*')[^>"']*)*)>"""
+TAG_NAME = r"[a-zA-Z][\w:.-]*"
+ATTRIBUTE = re.compile(r"""([^\s"'<>/=]+)(?:\s*=\s*(?:"([^"]*)"|'([^']*)'|([^\s"'>]+)))?""")
+# Elements whose content is text and never tags
+RAW_TEXT = {"script", "style", "textarea", "title"}
+RAW_TEXT_END = {name: re.compile(rf"</{name}\s*>", re.IGNORECASE) for name in RAW_TEXT}
+# A javascript or json string literal
+STRING = re.compile(r'"((?:[^"\\]|\\.)*)"', re.DOTALL)
+WHITESPACE = re.compile(r"\s+")
+DECODER = json.JSONDecoder()
+
+
+def tags(page: str, names: frozenset[str] | None = None) -> Iterator[tuple[str, str, int, int]]:
+    """Tokenizes a page into its tags in one pass, in linear time
+
+        Yields the lowercase name of each tag, "/a" for an end tag, the text of
+        its attributes and where it starts and ends in page. Comments are skipped
+        and the content of raw text elements like script isn't tokenized.
+
+        names: only yields these tags, the regex engine skips the others
+    """
+
+    pattern = tag_pattern(names)
+    position = 0
+    while (match := pattern.search(page, position)) is not None:
+        position = match.end()
+        if match.group(2) is None:
+            continue
+
+        name = match.group(2).lower()
+        if match.group(1):
+            yield "/" + name, "", match.start(), match.end()
+            continue
+
+        yield name, match.group(3), match.start(), match.end()
+        if name in RAW_TEXT:
+            end = RAW_TEXT_END[name].search(page, position)
+            if end is None:
+                return
+            yield "/" + name, "", end.start(), end.end()
+            position = end.end()
+
+@functools.cache
+def tag_pattern(names: frozenset[str] | None) -> re.Pattern:
+    """Compiles the pattern matching comments and the tags named names, every tag if None
+
+        Raw text elements are always matched so their content is skipped.
+    """
+
+    if names is None:
+        return re.compile(TAG.format(name=TAG_NAME), re.DOTALL)
+    alternatives = "|".join(re.escape(name) for name in sorted(names | RAW_TEXT))
+    return re.compile(TAG.format(name=rf"(?:{alternatives})(?![\w:.-])"), re.DOTALL | re.IGNORECASE)
+
+def attributes(text: str) -> dict[str, str]:
+    """Parses the attributes of a tag, names are lowercase and values unescaped"""
+
+    parsed = {}
+    for match in ATTRIBUTE.finditer(text):
+        value = next((group for group in match.groups()[1:] if group is not None), "")
+        parsed.setdefault(match.group(1).lower(), html.unescape(value) if "&" in value else value)
+    return parsed
+
+def text(fragment: str) -> str:
+    """Gets the text of a fragment of a page without its tags and with whitespace collapsed"""
+
+    return WHITESPACE.sub(" ", html.unescape(tag_pattern(None).sub(" ", fragment))).strip()
+
+def links(page: str, base_url: str | None = None) -> list[dict[str, Any]]:
+    """Gets every link of a page in order
+
+        Each link is {"href": str, "text": str, "attributes": dict[str, str]},
+        href is made absolute when base_url is given.
+    """
+
+    found = []
+    start = None
+    for name, attributes_text, tag_start, tag_end in tags(page, frozenset({"a"})):
+        if name == "a" and "href" in (attrs := attributes(attributes_text)):
+            start = (attrs, tag_end)
+        elif name == "/a" and start is not None:
+            attrs, text_start = start
+            href = attrs["href"] if base_url is None else urllib.parse.urljoin(base_url, attrs["href"])
+            found.append({"href": href, "text": text(page[text_start:tag_start]), "attributes": attrs})
+            start = None
+    return found
+
+def find_links(page: str, pattern: str | re.Pattern, base_url: str | None = None, exclude: str | None = None) -> list[str]:
+    """Gets the hrefs of the links whose text matches pattern in order
+
+        pattern: text the link's text contains ignoring case, or a pattern searched in it
+        exclude: skips links with an attribute or attribute value containing this, like "disabled"
+    """
+
+    if isinstance(pattern, str):
+        pattern = re.compile(re.escape(pattern), re.IGNORECASE)
+
+    hrefs = []
+    for link in links(page, base_url):
+        if exclude is not None and any(exclude in key or exclude in value for key, value in link["attributes"].items()):
+            continue
+        if pattern.search(link["text"]):
+            hrefs.append(link["href"])
+    return hrefs
+
+def images(page: str, attribute: str = "src", base_url: str | None = None) -> list[str]:
+    """Gets an attribute of every img tag of a page in order, like "src" or "data-src"
+
+        The urls are made absolute when base_url is given.
+    """
+
+    urls = []
+    for name, attributes_text, _, _ in tags(page, frozenset({"img"})):
+        if name == "img" and (attrs := attributes(attributes_text)).get(attribute):
+            urls.append(attrs[attribute] if base_url is None else urllib.parse.urljoin(base_url, attrs[attribute]))
+    return urls
+
+def scripts(page: str) -> list[str]:
+    """Gets the content of every script tag of a page in order"""
+
+    found = []
+    start = None
+    for name, _, tag_start, tag_end in tags(page, frozenset({"script"})):
+        if name == "script":
+            start = tag_end
+        elif name == "/script" and start is not None:
+            found.append(page[start:tag_start])
+            start = None
+    return found
+
+def json_blobs(page: str, key: str) -> list[Any]:
+    """Gets the json objects embedded in the scripts of a page that start with key
+
+        Objects inside javascript strings, like the data pushed by Next.js pages
+        (self.__next_f.push([1, "{\\"key\\": ...}"])), are found too. Each object is
+        decoded once, the search carries on after its end.
+    """
+
+    start = re.compile(r'\{\s*"' + re.escape(key) + r'"\s*:')
+    escaped = f'\\"{key}\\"'
+
+    blobs = []
+    for script in scripts(page):
+        sources = [script]
+        if escaped in script:
+            for match in STRING.finditer(script):
+                if escaped in match.group(1):
+                    try:
+                        sources.append(json.loads(match.group(0)))
+                    except json.JSONDecodeError:
+                        continue
+
+        for source in sources:
+            position = 0
+            while (match := start.search(source, position)) is not None:
+                try:
+                    blob, position = DECODER.raw_decode(source, match.start())
+                except json.JSONDecodeError:
+                    # Cut off, like an object split over several pushes
+                    position = match.end()
+                    continue
+                blobs.append(blob)
+    return blobs
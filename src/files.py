@@ -0,0 +1,193 @@
+import os
+import shutil
+import hashlib
+from collections.abc import Mapping
+
+
+PARTIAL_SUFFIX = ".part"
+CHUNK_SIZE = 64 * 1024
+PLACE_MODES = ["hardlink", "reflink", "move", "copy"]
+DEFAULT_PLACE_MODE = "hardlink"
+# ioctl to clone a file's extents on Linux filesystems like btrfs and xfs
+FICLONE = 0x40049409
+
+
+def expected_size(headers: Mapping[str, str]) -> int | None:
+    """Gets the number of bytes a response's body should have from its headers
+
+        None if there is no Content-Length or the body is encoded, as the decoded
+        body won't have the same length.
+    """
+
+    if headers.get("Content-Encoding", "identity") != "identity":
+        return None
+    try:
+        return int(headers["Content-Length"])
+    except (KeyError, ValueError):
+        return None
+
+def place(source: str | os.PathLike, destination: str | os.PathLike, mode: str) -> str:
+    """Places a file at destination without copying its bytes where possible
+
+        mode:
+            "hardlink": destination is another name for the same file
+            "reflink": destination is a copy on write clone sharing the same blocks
+            "move": source is moved to destination
+            "copy": source is copied to destination
+
+        A copy is made when the mode isn't possible, like across filesystems.
+        Returns what was done: "hardlinked", "reflinked", "moved" or "copied".
+    """
+
+    match mode:
+        case "hardlink":
+            try:
+                os.link(source, destination)
+                return "hardlinked"
+            except OSError:
+                pass
+        case "reflink":
+            try:
+                reflink(source, destination)
+                return "reflinked"
+            except OSError:
+                pass
+        case "move":
+            # Copies and deletes source when it can't be renamed across filesystems
+            shutil.move(source, destination)
+            return "moved"
+        case "copy":
+            pass
+        case _:
+            raise Exception(f"Unknown place mode: {mode}.")
+
+    shutil.copy(source, destination)
+    return "copied"
+
+def reflink(source: str | os.PathLike, destination: str | os.PathLike) -> None:
+    """Clones source to destination sharing the same blocks, raises OSError if not supported"""
+
+    try:
+        # Imported here as fcntl doesn't exist on Windows
+        import fcntl
+    except ImportError:
+        raise OSError("Reflinks are not supported on this platform.")
+
+    with open(source, "rb") as src, open(destination, "wb") as dst:
+        try:
+            fcntl.ioctl(dst.fileno(), FICLONE, src.fileno())
+        except OSError:
+            dst.close()
+            os.remove(destination)
+            raise
+
+def file_hash(path: str | os.PathLike) -> str:
+    """Gets the sha256 of a file's bytes"""
+
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(CHUNK_SIZE), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def share(original: str | os.PathLike, duplicate: str | os.PathLike) -> bool:
+    """Replaces duplicate by a hardlink to original, they must have the same bytes
+
+        The duplicate is replaced in one rename so it is never missing. Returns
+        whether it was replaced, it isn't when hardlinks aren't possible.
+    """
+
+    link = os.fspath(duplicate) + PARTIAL_SUFFIX
+    try:
+        os.link(original, link)
+    except OSError:
+        return False
+    os.replace(link, duplicate)
+    return True
+
+def unique(paths: list[str | os.PathLike]) -> list[str | os.PathLike]:
+    """Gets paths without the files whose bytes are the same as an earlier file's
+
+        Hardlinks of the same file are found without reading them, and only the
+        files that have the same size as another are hashed.
+    """
+
+    stats = [os.stat(path) for path in paths]
+    sizes: dict[int, int] = {}
+    for stat in stats:
+        sizes[stat.st_size] = sizes.get(stat.st_size, 0) + 1
+
+    seen = set()
+    kept = []
+    for path, stat in zip(paths, stats):
+        keys = [("inode", stat.st_dev, stat.st_ino)]
+        if sizes[stat.st_size] > 1:
+            keys.append(("hash", file_hash(path)))
+        if any(key in seen for key in keys):
+            continue
+        seen.update(keys)
+        kept.append(path)
+    return kept
+
+def join_inside(directory: str | os.PathLike, *names: str) -> str:
+    """Joins names read from a file, like the keys of a cbz file's pages, onto directory
+
+        Raises if the path would end up outside of directory, like a name crafted
+        with ../ or an absolute path would.
+    """
+
+    root = os.path.realpath(directory)
+    path = os.path.realpath(os.path.join(root, *names))
+    if path == root or os.path.commonpath([root, path]) != root:
+        raise Exception(f"{"/".join(names)} would be outside of {directory}.")
+    return path
+
+def is_partial(path: str | os.PathLike) -> bool:
+    """Checks if path is an unfinished PartialFile"""
+
+    return os.fspath(path).endswith(PARTIAL_SUFFIX)
+
+
+class PartialFile:
+    """Atomic File Writer
+
+        Chunks are written to the path with PARTIAL_SUFFIX added and it is renamed
+        to the real path only once everything was written, so an interrupted
+        download never leaves a truncated file behind under the real name. The
+        sha256 of the chunks is kept as they are written.
+    """
+
+    def __init__(self, path: str | os.PathLike, size: int | None = None) -> None:
+        """Constructor
+
+            path: where the file should end up
+            size: number of bytes the file should have, not checked if None
+        """
+
+        self.path = os.fspath(path)
+        self.partial_path = self.path + PARTIAL_SUFFIX
+        self.size = size
+        self.written = 0
+        self.hash = hashlib.sha256()
+        self.file = None
+
+    def __enter__(self) -> "PartialFile":
+        self.file = open(self.partial_path, "wb")
+        return self
+
+    def __exit__(self, exc_type, *args) -> None:
+        self.file.close()
+        if exc_type is not None:
+            os.remove(self.partial_path)
+            return
+        if self.size is not None and self.written != self.size:
+            os.remove(self.partial_path)
+            raise Exception(f"Expected {self.size} bytes for {self.path} but got {self.written}.")
+        os.replace(self.partial_path, self.path)
+
+    def write(self, chunk: bytes) -> None:
+        """Writes a chunk"""
+
+        self.file.write(chunk)
+        self.written += len(chunk)
+        self.hash.update(chunk)
@@ -1,22 +1,46 @@
 import os
 import json
+import time
 import logging
+import mimetypes
+import threading
+from collections import OrderedDict
 import click
-from flask import Flask, render_template
+from flask import Flask, Response, abort, g, request, send_from_directory
+from werkzeug.security import safe_join
 
-from src import constants
+from src import archive, constants, stats
+from src.compile import chapter_html, index_html
+
+
+DEFAULT_ADDRESS = "localhost"
+DEFAULT_PORT = 8080
+# Seconds browsers keep images without asking again, html and json are always revalidated
+IMAGE_MAX_AGE = 30 * 24 * 60 * 60
+DEFAULT_CACHE_SIZE = 64
 
 
 @click.command()
 @click.help_option("-h", "--help")
 @click.argument("name")
 @click.option("-v", "--verbose", "verbose", default=False, is_flag=True, help="Show more information.")
-def host(name: str, verbose: bool) -> None:
-    """Host a series' folder locally
+@click.option("-H", "--host", "address", default=DEFAULT_ADDRESS, show_default=True, help="Address to listen on, 0.0.0.0 for every network interface.", metavar="ADDRESS")
+@click.option("-p", "--port", "port", default=DEFAULT_PORT, type=click.IntRange(0, 65535), show_default=True, help="Port to listen on.", metavar="PORT")
+@click.option("-c", "--cache-size", "cache_size", default=DEFAULT_CACHE_SIZE, type=click.IntRange(min=0), show_default=True, help="Megabytes of cbz pages kept in memory, 0 to always read them from the file.", metavar="MEGABYTES")
+@stats.option
+def host(name: str, verbose: bool, address: str, port: int, cache_size: int, stats_path: str | None) -> None:
+    """Host a series' folder or cbz file locally
+
+        NAME: the name of the folder compiled as html or of the cbz file to host
+
+        A cbz file is served as it is, its pages are read from it when asked
+        for and the most recent are kept in memory up to --cache-size.
 
-        NAME: the name of the folder to host
+        Each request is handled in its own thread. Files are sent with headers
+        to cache them in the browser and images support Range requests.
 
-        This works ONLY for compiled as html
+        With --stats, how long each kind of response took is written when the
+        server is stopped.
     """
 
     man_path = os.path.join(constants.get_root_dir(), name)
@@ -24,7 +48,58 @@ def host(name: str, verbose: bool) -> None:
         click.echo(f"{name} does not exist at {man_path}.", err=True)
         return
 
-    app = Flask(__name__, template_folder=man_path, static_folder=man_path)
+    if os.path.isfile(man_path):
+        try:
+            app = create_cbz_app(man_path, name.removesuffix(".cbz"), cache_size * 1024 * 1024)
+        except Exception as e:
+            click.echo(f"Error occurred while opening {man_path}:\n\t{e}", err=True)
+            return
+    else:
+        app = create_app(man_path, name)
+    instrument(app)
+
+    if not verbose:
+        click.echo(f"Serving http://{address}:{port} CTRL+C to quit")
+        log = logging.getLogger("werkzeug")
+        log.disabled = True
+
+    stats.reset()
+    try:
+        app.run(host=address, port=port, threaded=True)
+    finally:
+        stats.report(stats_path)
+
+
+def instrument(app: Flask) -> None:
+    """Records the requests of an app in stats
+
+        The time to make each response is recorded by its mimetype, like
+        "response image/jpeg", with the number of requests and bytes sent.
+    """
+
+    @app.before_request
+    def start():
+        g.start = time.perf_counter()
+
+    @app.after_request
+    def record(response: Response) -> Response:
+        stats.record(f"response {response.mimetype or "unknown"}", time.perf_counter() - g.start)
+        stats.count("requests")
+        stats.count("bytes", response.content_length or 0)
+        if response.status_code >= 400:
+            stats.count("errors")
+        return response
+
+
+def create_app(man_path: str, name: str) -> Flask:
+    """Creates the app serving a series' folder
+
+        The app can also be run by any WSGI server, files are then sent with
+        sendfile if the server provides wsgi.file_wrapper.
+    """
+
+    app = Flask(__name__, static_folder=None)
+    images_json = ImagesJson(man_path, name)
 
     @app.route("/")
     def index():
@@ -33,15 +108,178 @@ def host(name: str, verbose: bool) -> None:
     @app.route("/<path:path>")
     def paths(path: str):
         if path.endswith(".json"):
-            images = json.loads(render_template(path))
-            for i, image in enumerate(images["images"]):
-                images["images"][i] = os.path.join(name, image)
-            return json.dumps(images)
-        return render_template(path)
+            return images_json.response(path)
+        # Images are listed under the series' name in images.json
+        path = path.removeprefix(f"{name}/")
+        return send_from_directory(man_path, path, max_age=None if path.endswith(".html") else IMAGE_MAX_AGE)
 
-    if not verbose:
-        click.echo("Serving http://localhost:8080 CTRL+C to quit")
-        log = logging.getLogger("werkzeug")
-        log.disabled = True
+    return app
+
+
+def create_cbz_app(cbz_path: str, name: str, cache_size: int) -> Flask:
+    """Creates the app serving a cbz file like a series' folder compiled as html
+
+        The index, chapters and images.json of each chapter are made from the
+        zip's index and ComicInfo.xml when the app is created, see
+        archive.CbzReader, and the pages are read from the cbz file when asked for.
+
+        cache_size: number of bytes of pages to keep in memory, see ZipPageCache
+    """
+
+    reader = archive.CbzReader(cbz_path)
+    # In order by chapter number like in the ui, not in the order of the zip's entries
+    chapters: dict[str, dict[str, dict[str, str]]] = {
+        chapter_pages[0]["key"].split("Image")[0]: {page["key"]: page for page in chapter_pages}
+        for chapter_pages in reader.chapters()
+    }
+    if not chapters:
+        raise Exception(f"{cbz_path} has no pages.")
+
+    chapter_names = list(chapters)
+    payloads = {}
+    for index, chapter in enumerate(chapter_names):
+        payloads[chapter] = json.dumps({
+            "images": [f"{chapter}/{key}" for key in chapters[chapter]],
+            "previous": chapter_names[index - 1] if index > 0 else None,
+            "next": chapter_names[index + 1] if index < len(chapter_names) - 1 else None,
+        }).encode()
+    pages = {
+        "index.html": index_html(name, chapter_names).encode(),
+        "chapter.html": chapter_html().encode(),
+    }
+    modified = os.path.getmtime(cbz_path)
+    version = f"{int(modified):x}"
+    cache = ZipPageCache(cache_size)
+
+    app = Flask(__name__, static_folder=None)
+
+    @app.route("/")
+    def index():
+        return paths("index.html")
+
+    @app.route("/<path:path>")
+    def paths(path: str):
+        if path in pages:
+            return generated(pages[path], mimetypes.guess_type(path)[0], f"{version}-{path}")
+
+        chapter, _, key = path.partition("/")
+        if chapter not in chapters:
+            abort(404)
+        if key == "images.json":
+            return generated(payloads[chapter], "application/json", f"{version}-{chapter}")
+        if key not in chapters[chapter]:
+            abort(404)
+
+        page = chapters[chapter][key]
+        data = cache.get(key)
+        if data is None:
+            stats.count("cache misses")
+            data = reader.read(page)
+            cache.put(key, data)
+        else:
+            stats.count("cache hits")
+        response = Response(data, mimetype=mimetypes.guess_type(key)[0] or "application/octet-stream")
+        # The crc of a page is in the zip's index so the page doesn't need to be hashed
+        response.set_etag(f"{reader.zf.getinfo(page["name"]).CRC:x}-{len(data):x}")
+        response.last_modified = modified
+        response.cache_control.public = True
+        response.cache_control.max_age = IMAGE_MAX_AGE
+        return response.make_conditional(request, accept_ranges=True, complete_length=len(data))
+
+    def generated(data: bytes, mimetype: str, etag: str) -> Response:
+        response = Response(data, mimetype=mimetype)
+        response.set_etag(etag)
+        response.last_modified = modified
+        response.cache_control.no_cache = True
+        return response.make_conditional(request)
+
+    return app
+
+
+class ZipPageCache:
+    """Byte Budgeted LRU Cache
+
+        Keeps the bytes of the pages most recently asked for until their total
+        size goes over the budget, then forgets the least recently used ones first.
+        Used from every request's thread.
+    """
+
+    def __init__(self, budget: int) -> None:
+        """Constructor
+
+            budget: number of bytes of pages to keep, 0 keeps none
+        """
+
+        self.budget = budget
+        self.size = 0
+        self.pages: OrderedDict[str, bytes] = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key: str) -> bytes | None:
+        """Gets a page and marks it as the most recently used, None if not kept"""
+
+        with self.lock:
+            if key not in self.pages:
+                return None
+            self.pages.move_to_end(key)
+            return self.pages[key]
+
+    def put(self, key: str, data: bytes) -> None:
+        """Keeps a page, forgetting the least recently used ones over the budget"""
+
+        if len(data) > self.budget:
+            return
+        with self.lock:
+            if key in self.pages:
+                self.size -= len(self.pages.pop(key))
+            self.pages[key] = data
+            self.size += len(data)
+            while self.size > self.budget:
+                self.size -= len(self.pages.popitem(last=False)[1])
+
+
+class ImagesJson:
+    """images.json Cache
+
+        The images of a chapter's images.json are listed under the series' name
+        when hosting. The rewritten json is kept in memory and only rebuilt when
+        the file's modified time or size changes.
+    """
+
+    def __init__(self, man_path: str, name: str) -> None:
+        """Constructor
+
+            man_path: path of the series' folder
+            name: the name of the series' folder
+        """
+
+        self.man_path = man_path
+        self.name = name
+        # Path: ((modified time, size), rewritten json)
+        self.payloads: dict[str, tuple[tuple[int, int], bytes]] = {}
+        self.lock = threading.Lock()
+
+    def response(self, path: str) -> Response:
+        """Gets the response of an images.json, 304 if the browser has it already"""
+
+        file_path = safe_join(self.man_path, path)
+        if file_path is None or not os.path.isfile(file_path):
+            abort(404)
+        stat = os.stat(file_path)
+        version = (stat.st_mtime_ns, stat.st_size)
+
+        with self.lock:
+            cached = self.payloads.get(path)
+        if cached is None or cached[0] != version:
+            with open(file_path, "r") as file:
+                images = json.load(file)
+            images["images"] = [f"{self.name}/{image}" for image in images["images"]]
+            cached = (version, json.dumps(images).encode())
+            with self.lock:
+                self.payloads[path] = cached
 
-    app.run(host="localhost", port=8080)
+        response = Response(cached[1], mimetype="application/json")
+        response.set_etag(f"{version[0]:x}-{version[1]:x}")
+        response.last_modified = stat.st_mtime
+        response.cache_control.no_cache = True
+        return response.make_conditional(request)
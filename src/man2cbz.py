@@ -1,16 +1,67 @@
 import os
 import pathlib
+import importlib
+import multiprocessing
+import shutil
 import click
 
 from src import constants
-from src.download import download
-from src.compile import compile_images
-from src.host import host
-from src.convert import convert
-from src.ui import ui
 
 
-@click.group()
+# Every subcommand but clear is imported only when it's invoked, so commands
+# that don't need Flask, tkinter, PIL or cbz don't pay for importing them.
+#   name: (module, name of the command in the module, short help shown by --help)
+# The short help must match the first line of the command's docstring,
+# benchmarks/startup.py checks it.
+COMMANDS: dict[str, tuple[str, str, str]] = {
+    "download": ("src.download", "download", "Downloads a manwha/manga from a url"),
+    "compile": ("src.compile", "compile_images", "Compile to cbz or html"),
+    "host": ("src.host", "host", "Host a series' folder or cbz file locally"),
+    "convert": ("src.convert", "convert", "Converts series to and from each format"),
+    "ui": ("src.ui", "ui", "Open a ui to read cbz files locally"),
+    "update": ("src.update", "update", "Appends new chapters to a cbz file"),
+}
+
+
+class LazyGroup(click.Group):
+    """A group that imports the module of a subcommand in COMMANDS when it's invoked"""
+
+    def list_commands(self, ctx: click.Context) -> list[str]:
+        return sorted([*super().list_commands(ctx), *COMMANDS])
+
+    def get_command(self, ctx: click.Context, cmd_name: str) -> click.Command | None:
+        if cmd_name not in COMMANDS or cmd_name in self.commands:
+            return super().get_command(ctx, cmd_name)
+
+        module, name, _ = COMMANDS[cmd_name]
+        command = getattr(importlib.import_module(module), name)
+        if not isinstance(command, click.Command):
+            raise constants.ProgError(f"{module}.{name} is not a click command.")
+        self.add_command(command, cmd_name)
+        return command
+
+    def format_commands(self, ctx: click.Context, formatter: click.HelpFormatter) -> None:
+        """Lists the subcommands with the short help in COMMANDS instead of importing them"""
+
+        names = self.list_commands(ctx)
+        if not names:
+            return
+
+        limit = formatter.width - 6 - max(len(name) for name in names)
+        rows = []
+        for name in names:
+            if name in COMMANDS and name not in self.commands:
+                rows.append((name, COMMANDS[name][2]))
+                continue
+            command = self.get_command(ctx, name)
+            if command is not None and not command.hidden:
+                rows.append((name, command.get_short_help_str(limit)))
+
+        with formatter.section("Commands"):
+            formatter.write_dl(rows)
+
+
+@click.group(cls=LazyGroup)
 @click.help_option("-h", "--help")
 @click.version_option("0.2.0", "-v", "--version", message="%(prog)s %(version)s", prog_name="man2cbz")
 def cli() -> None:
@@ -20,18 +71,23 @@ def cli() -> None:
 
 @cli.command()
 def clear() -> None:
-    """Clear temp_images"""
+    """Clear temp_images, workspaces, page_cache and transcode_cache"""
 
     for file in pathlib.Path(constants.get_temp_images_dir()).iterdir():
         click.echo(f"Deleting {file.absolute()}.")
         os.remove(file.absolute())
+    if os.path.exists(constants.get_workspaces_dir(create=False)):
+        click.echo(f"Deleting {constants.get_workspaces_dir(create=False)}.")
+        shutil.rmtree(constants.get_workspaces_dir(create=False))
+    if os.path.exists(constants.get_page_cache_dir(create=False)):
+        click.echo(f"Deleting {constants.get_page_cache_dir(create=False)}.")
+        shutil.rmtree(constants.get_page_cache_dir(create=False))
+    if os.path.exists(constants.get_transcode_cache_dir(create=False)):
+        click.echo(f"Deleting {constants.get_transcode_cache_dir(create=False)}.")
+        shutil.rmtree(constants.get_transcode_cache_dir(create=False))
 
 
-cli.add_command(download)
-cli.add_command(compile_images)
-cli.add_command(host)
-cli.add_command(convert)
-cli.add_command(ui)
-
 if __name__ == "__main__":
+    # Needed by the process pool of compile in a frozen executable
+    multiprocessing.freeze_support()
     cli()
@@ -1,4 +1,5 @@
 # -*- mode: python ; coding: utf-8 -*-
+from PyInstaller.utils.hooks import collect_submodules
 
 
 a = Analysis(
@@ -6,7 +7,9 @@ a = Analysis(
     pathex=[],
     binaries=[],
     datas=[],
-    hiddenimports=[],
+    # Providers and subcommands are imported by name when used, see
+    # src/providers/__init__.py and COMMANDS in man2cbz.py
+    hiddenimports=collect_submodules("src"),
     hookspath=[],
     hooksconfig={},
     runtime_hooks=[],
@@ -0,0 +1,194 @@
+import json
+import os
+import threading
+
+from src import files
+
+
+MANIFEST_NAME = "manifest.jsonl"
+
+
+class Manifest:
+    """Download Manifest
+
+        A journal kept with the images in temp_images. Every chapter found and
+        every image written is appended to it as a line of json, so a download that
+        stopped for any reason can be resumed from where it was instead of from
+        the start.
+
+        Images are also indexed by the sha256 of their bytes. An image with the
+        same bytes as one downloaded before, like a banner repeated in every
+        chapter, is stored once with its filename being a hardlink to the first.
+
+        A run that ended with pages or images it gave up on records them, see
+        retry.RetryQueue, the last such line is what download --retry-failed fetches.
+
+        Lines:
+            {"type": "start", "first_url": str | None, "urls": list[str] | None, "skip": int}
+            {"type": "chapter", "chapter": int, "url": str, "next_url": str | None, "images": [{url: str, filename: str}]}
+            {"type": "image", "filename": str, "size": int, "hash": str}
+            {"type": "failures", "items": [{type: str, url: str, attempts: int, error: str, ...}]}
+            {"type": "end"}
+    """
+
+    def __init__(self, path: str, first_url: str | None, urls: list[str] | None, skip: int = 0) -> None:
+        """Constructor
+
+            path: path of the manifest file
+            first_url: the Downloader's first_url
+            urls: the Downloader's urls
+            skip: number of chapters at the start that aren't downloaded
+        """
+
+        self.path = path
+        self.first_url = first_url
+        self.urls = urls
+        self.skip = skip
+        self.chapters: dict[int, dict] = {}
+        self.sizes: dict[str, int] = {}
+        # sha256: filename of the first image with those bytes
+        self.hashes: dict[str, str] = {}
+        self.duplicates = 0
+        self.duplicate_bytes = 0
+        self.failures: list[dict] | None = None
+        self.complete = False
+        self.lock = threading.Lock()
+        self.file = None
+
+    @classmethod
+    def create(cls, directory: str, first_url: str | None, urls: list[str] | None, skip: int = 0) -> "Manifest":
+        """Starts a new manifest in directory, replacing any previous one"""
+
+        manifest = cls(os.path.join(directory, MANIFEST_NAME), first_url, urls, skip)
+        manifest.file = open(manifest.path, "w")
+        manifest.write({"type": "start", "first_url": first_url, "urls": urls, "skip": skip})
+        return manifest
+
+    @classmethod
+    def load(cls, directory: str) -> "Manifest | None":
+        """Loads the manifest in directory, None if there isn't a valid one"""
+
+        path = os.path.join(directory, MANIFEST_NAME)
+        if not os.path.exists(path):
+            return None
+
+        manifest = None
+        with open(path, "r") as file:
+            for line in file:
+                try:
+                    entry = json.loads(line)
+                except json.JSONDecodeError:
+                    # The last line may have been cut off by a crash
+                    continue
+                match entry.get("type"):
+                    case "start":
+                        manifest = cls(path, entry["first_url"], entry["urls"], entry.get("skip", 0))
+                    case "chapter" if manifest is not None:
+                        manifest.chapters[entry["chapter"]] = entry
+                    case "image" if manifest is not None:
+                        manifest.sizes[entry["filename"]] = entry["size"]
+                        if "hash" in entry:
+                            manifest.hashes.setdefault(entry["hash"], entry["filename"])
+                    case "failures" if manifest is not None:
+                        manifest.failures = entry["items"]
+                    case "end" if manifest is not None:
+                        manifest.complete = True
+
+        if manifest is not None:
+            manifest.file = open(path, "a")
+        return manifest
+
+    def matches(self, first_url: str | None, urls: list[str] | None, skip: int = 0) -> bool:
+        """Checks if the manifest is of a download of first_url or urls skipping the same chapters"""
+
+        return self.first_url == first_url and self.urls == urls and self.skip == skip
+
+    def write(self, entry: dict) -> None:
+        """Appends an entry
+
+            Nothing is written once the manifest is closed, like by a download that
+            finished after Ctrl-C, its image is downloaded again when resuming.
+        """
+
+        with self.lock:
+            if self.file is None:
+                return
+            self.file.write(json.dumps(entry) + "\n")
+            self.file.flush()
+
+    def add_chapter(self, chapter: int, url: str, next_url: str | None, images: list[dict[str, str]]) -> None:
+        """Records a chapter that was found
+
+            chapter: the chapter's number, starting at 1
+            url: the chapter's url
+            next_url: the next chapter's url if following get_next_url
+            images: the images to download of the chapter
+        """
+
+        entry = {"type": "chapter", "chapter": chapter, "url": url, "next_url": next_url, "images": images}
+        self.chapters[chapter] = entry
+        self.write(entry)
+
+    def add_image(self, filename: str, size: int, digest: str | None = None) -> None:
+        """Records an image that was written
+
+            digest: the sha256 of the image, it's replaced by a hardlink to an earlier
+                image with the same sha256 if there is one
+        """
+
+        if digest is not None:
+            with self.lock:
+                original = self.hashes.setdefault(digest, filename)
+            directory = os.path.dirname(self.path)
+            if original != filename:
+                if files.share(os.path.join(directory, original), os.path.join(directory, filename)):
+                    with self.lock:
+                        self.duplicates += 1
+                        self.duplicate_bytes += size
+                else:
+                    # The earlier image is gone or can't be linked to, this one takes its place
+                    with self.lock:
+                        self.hashes[digest] = filename
+
+        self.sizes[filename] = size
+        self.write({"type": "image", "filename": filename, "size": size, "hash": digest})
+
+    def is_done(self, image: dict[str, str]) -> bool:
+        """Checks if an image was written and is still the size it was written as"""
+
+        if image["filename"] not in self.sizes:
+            return False
+        try:
+            return os.path.getsize(os.path.join(os.path.dirname(self.path), image["filename"])) == self.sizes[image["filename"]]
+        except OSError:
+            return False
+
+    def pending(self, chapter: int) -> list[dict[str, str]]:
+        """Gets the images of a recorded chapter that still need to be downloaded"""
+
+        return [image for image in self.chapters[chapter]["images"] if not self.is_done(image)]
+
+    def missing(self) -> int:
+        """Gets the number of images of recorded chapters that still need to be downloaded"""
+
+        return sum(len(self.pending(chapter)) for chapter in self.chapters)
+
+    def add_failures(self, failures: list[dict]) -> None:
+        """Records the pages and images a run gave up on, replacing those of earlier runs"""
+
+        self.failures = failures
+        self.write({"type": "failures", "items": failures})
+
+    def finish(self) -> None:
+        """Marks the download as complete so it won't be resumed"""
+
+        self.complete = True
+        self.write({"type": "end"})
+
+    def close(self) -> None:
+        """Closes the manifest file"""
+
+        with self.lock:
+            if self.file is not None:
+                self.file.close()
+                self.file = None
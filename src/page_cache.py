@@ -0,0 +1,211 @@
+import os
+import json
+import time
+import hashlib
+import threading
+from collections.abc import Mapping
+import requests
+import requests.structures
+
+from src import stats
+
+
+DEFAULT_MAX_SIZE = 256 * 1024 * 1024
+# Seconds a page is kept after it was last fetched or revalidated
+DEFAULT_TTL = 30 * 24 * 60 * 60.0
+# Media types of the responses that are cached, images are never fetched through the cache
+CACHED_TYPES = ("text/", "application/json", "application/xml", "application/xhtml+xml")
+# Headers of the body as it was sent, the cached body is stored decoded
+DROPPED_HEADERS = {"content-encoding", "content-length", "transfer-encoding"}
+SUFFIX = ".page"
+
+
+class PageCache:
+    """On-disk Page Cache
+
+        Keeps the pages, like series homepages and chapter pages, whose responses
+        have an ETag or Last-Modified header, keyed by their url. The next request
+        of a cached page is made conditional with If-None-Match/If-Modified-Since
+        and a 304 Not Modified response is answered with the cached page, so
+        walking a series' chapters again mostly costs 304s without bodies.
+
+        Each page is a file of its own, a line of json with the response's headers
+        followed by its body, written atomically. A file's mtime is when the page
+        was last fetched or revalidated: pages older than ttl are dropped and the
+        least recently used are evicted when the cache is over max_size bytes.
+    """
+
+    def __init__(self, directory: str, max_size: int = DEFAULT_MAX_SIZE, ttl: float = DEFAULT_TTL) -> None:
+        """Constructor
+
+            directory: where the pages are stored
+            max_size: most bytes the pages take up on disk
+            ttl: seconds a page is kept after it was last fetched or revalidated
+        """
+
+        self.directory = directory
+        self.max_size = max_size
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        # path: (size, mtime) of every page, read from the directory on first use
+        self.index: dict[str, tuple[int, float]] | None = None
+
+    def path(self, url: str) -> str:
+        return os.path.join(self.directory, hashlib.sha256(url.encode()).hexdigest() + SUFFIX)
+
+    def load_index(self) -> dict[str, tuple[int, float]]:
+        """Gets the index of the pages, must be called with the lock held"""
+
+        if self.index is None:
+            self.index = {}
+            with os.scandir(self.directory) as entries:
+                for entry in entries:
+                    if entry.name.endswith(SUFFIX):
+                        info = entry.stat()
+                        self.index[entry.path] = (info.st_size, info.st_mtime)
+        return self.index
+
+    def load(self, url: str) -> dict | None:
+        """Gets the cached page of url, None if there isn't one or it expired
+
+            Returns {url: str, final_url: str, status: int, headers: dict, encoding: str | None, content: bytes},
+            final_url being where url redirected to
+        """
+
+        path = self.path(url)
+        try:
+            if time.time() - os.path.getmtime(path) > self.ttl:
+                self.remove(path)
+                return None
+            with open(path, "rb") as file:
+                entry = json.loads(file.readline())
+                entry["content"] = file.read()
+        except (OSError, ValueError):
+            return None
+        # Two urls with the same sha256 would be a collision
+        return entry if entry.get("url") == url else None
+
+    @staticmethod
+    def validators(entry: dict | None) -> dict[str, str]:
+        """Gets the headers making a request conditional on the cached page having changed"""
+
+        if entry is None:
+            return {}
+        headers = requests.structures.CaseInsensitiveDict(entry["headers"])
+        validators = {}
+        if "ETag" in headers:
+            validators["If-None-Match"] = headers["ETag"]
+        if "Last-Modified" in headers:
+            validators["If-Modified-Since"] = headers["Last-Modified"]
+        return validators
+
+    def update(self, url: str, entry: dict | None, response: requests.Response) -> requests.Response:
+        """Gets the response to hand to the provider hooks after a conditional request
+
+            entry: the cached page the request was made conditional on, see load
+
+            A 304 is answered with the cached page, which is marked as revalidated. A
+            200 with a validator is cached. Any other response is returned as is.
+        """
+
+        if response.status_code == 304 and entry is not None:
+            stats.count("pages revalidated")
+            self.touch(self.path(url))
+            return self.to_response(entry)
+
+        if response.status_code == 200 and self.cacheable(response.headers):
+            stats.count("pages cached")
+            self.store(url, response)
+        return response
+
+    @staticmethod
+    def cacheable(headers: Mapping[str, str]) -> bool:
+        """Checks if a 200 response with these headers is a page that can be revalidated"""
+
+        if "ETag" not in headers and "Last-Modified" not in headers:
+            return False
+        if "no-store" in headers.get("Cache-Control", ""):
+            return False
+        return headers.get("Content-Type", "").startswith(CACHED_TYPES)
+
+    def store(self, url: str, response: requests.Response) -> None:
+        """Writes a page to the cache, then evicts pages if it's over max_size"""
+
+        path = self.path(url)
+        headers = {name: value for name, value in response.headers.items() if name.lower() not in DROPPED_HEADERS}
+        header = {"url": url, "final_url": response.url, "status": response.status_code, "headers": headers, "encoding": response.encoding}
+        temp_path = f"{path}.{threading.get_ident()}.tmp"
+        try:
+            with open(temp_path, "wb") as file:
+                file.write(json.dumps(header).encode() + b"\n")
+                file.write(response.content)
+            os.replace(temp_path, path)
+            info = os.stat(path)
+        except OSError:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            return
+
+        with self.lock:
+            self.load_index()[path] = (info.st_size, info.st_mtime)
+        self.evict()
+
+    def touch(self, path: str) -> None:
+        """Marks a page as just revalidated so it's kept for another ttl"""
+
+        try:
+            os.utime(path)
+            info = os.stat(path)
+        except OSError:
+            return
+        with self.lock:
+            self.load_index()[path] = (info.st_size, info.st_mtime)
+
+    def remove(self, path: str) -> None:
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+        with self.lock:
+            self.load_index().pop(path, None)
+
+    def evict(self) -> None:
+        """Removes the expired pages, then the least recently used until the cache fits in max_size"""
+
+        with self.lock:
+            index = self.load_index()
+            expired = time.time() - self.ttl
+            size = sum(size for size, _ in index.values())
+            evicted = []
+            for path, (page_size, mtime) in sorted(index.items(), key=lambda item: item[1][1]):
+                if mtime >= expired and size <= self.max_size:
+                    break
+                evicted.append(path)
+                size -= page_size
+            for path in evicted:
+                del index[path]
+
+        for path in evicted:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+        if evicted:
+            stats.count("pages evicted", len(evicted))
+
+    @staticmethod
+    def to_response(entry: dict) -> requests.Response:
+        """Makes a requests response of a cached page
+
+            Its url is the one the page was fetched from after redirects, like a live
+            response's, as providers resolve relative links against it.
+        """
+
+        response = requests.Response()
+        response.status_code = entry["status"]
+        response.reason = "OK"
+        response.url = entry.get("final_url", entry["url"])
+        response.headers = requests.structures.CaseInsensitiveDict(entry["headers"])
+        response.encoding = entry["encoding"]
+        response._content = entry["content"]
+        return response
@@ -0,0 +1,62 @@
+import re
+import importlib
+import functools
+
+
+DEFAULT_PROVIDER = "general"
+# Every provider is declared here so listing them and detecting one from a url
+# imports nothing, only the module of the provider used is imported.
+#   name: the provider's module in this package
+#   class: the name of the Downloader class in the module
+#   description: shown when listing providers
+#   patterns: regexes matching the start of the urls of its series
+#   rate: most requests started each second to the host of its series unless --rate is
+#       given, None for no limit besides the adaptive limit of each host
+PROVIDERS: dict[str, dict] = {
+    "asura": {
+        "class": "AsuraDownloader",
+        "description": "Asura Scans Downloader",
+        "patterns": [r"https://asuracomic\."],
+        "rate": None,
+    },
+    "mgeko": {
+        "class": "MangaGekkoDownloader",
+        "description": "Manga Gekko Downloader (mgeko.cc)",
+        "patterns": [r"https://www\.mgeko\.cc"],
+        "rate": None,
+    },
+    "general": {
+        "class": "GeneralDownloader",
+        "description": "General Downloader",
+        "patterns": [],
+        "rate": None,
+    },
+}
+
+
+@functools.cache
+def url_index() -> re.Pattern:
+    """Compiles the patterns of every provider into one, the named group that matched is the provider
+
+        A url is detected with one match no matter how many providers there are.
+    """
+
+    return re.compile("|".join(
+        f"(?P<{name}>{"|".join(f"(?:{pattern})" for pattern in provider["patterns"])})"
+        for name, provider in PROVIDERS.items() if provider["patterns"]
+    ))
+
+def detect(url: str) -> str:
+    """Gets the name of the provider of a url, DEFAULT_PROVIDER if none of the patterns match"""
+
+    match = url_index().match(url)
+    if match is None:
+        return DEFAULT_PROVIDER
+    return next(name for name, value in match.groupdict().items() if value is not None and name in PROVIDERS)
+
+def load(name: str) -> type:
+    """Imports the module of a provider and gets its Downloader class"""
+
+    if name not in PROVIDERS:
+        raise Exception(f"{name} is not a valid provider.")
+    return getattr(importlib.import_module(f"{__name__}.{name}"), PROVIDERS[name]["class"])
@@ -1,7 +1,6 @@
 import requests
-import re
-import urllib.parse
 
+from src import extract, session
 from src.downloader import Downloader
 
 
@@ -14,25 +13,24 @@ class AsuraDownloader(Downloader):
             base_url: url of homepage to get the first chapter's url
         """
 
-        response = requests.get(base_url)
-        try:
-            first_url = re.search(r'<a.+href=["\']([^"\']+)["\'][^>]*>(?=.*first chapter).*?</a>', response.text, re.IGNORECASE).group(1)
-        except AttributeError:
+        response = session.get(base_url)
+        first_urls = extract.find_links(response.text, "first chapter", base_url)
+        if not first_urls:
             raise Exception(f"AsuraDownloader cannot get the first chapter's url from: {base_url}.")
 
-        super().__init__(urllib.parse.urljoin(base_url, first_url), None)
+        super().__init__(first_urls[0], None)
 
     def get_image_urls(self, response: requests.Response) -> list[str]:
         """Gets images urls"""
 
-        urls = re.findall(r'{\\"order\\":[0-9]*,\\"url\\":\\["\']([^"\']*)\\["\']', response.text)
+        urls = [blob["url"] for blob in extract.json_blobs(response.text, "order") if isinstance(blob.get("url"), str)]
         self.remove_duplicates(urls)
         return urls
 
     def get_next_url(self, response: requests.Response) -> str | None:
         """Gets next url"""
 
-        url = re.findall(r'<a.+href=["\']([^"\']+)["\'][^>]*>(?!.*prev).*?</a>', response.text, re.IGNORECASE)
-        if not url:
+        urls = extract.find_links(response.text, "next", response.url)
+        if not urls:
             return None
-        return urllib.parse.urljoin(response.url, url[0])
+        return urls[0]
@@ -1,7 +1,6 @@
 import requests
-import re
 
-from src import constants
+from src import constants, extract, session
 from src.downloader import Downloader
 
 
@@ -14,10 +13,9 @@ class GeneralDownloader(Downloader):
             base_url: url of homepage to get the urls of all the chapters
         """
 
-        response = requests.get(base_url)
+        response = session.get(base_url)
 
-        urls = re.findall(f'<a href=["\']({base_url}[^"\']*)["\']>.*chapter.*<',
-                          response.text, re.IGNORECASE)
+        urls = [url for url in extract.find_links(response.text, "chapter", base_url) if url.startswith(base_url)]
 
         if not urls:
             raise Exception(f"GeneralDownloader cannot get urls from: {base_url}.")
@@ -30,7 +28,7 @@ class GeneralDownloader(Downloader):
     def get_image_urls(self, response: requests.Response) -> list[str]:
         """Gets images urls"""
 
-        return re.findall(r'<img.*src=["\']([^"\']*)["\']', response.text)
+        return extract.images(response.text)
 
     def get_next_url(self, response: requests.Response) -> str | None:
         """Gets next url"""
@@ -1,10 +1,14 @@
 import requests
 import re
-import urllib.parse
 
+from src import extract, session
 from src.downloader import Downloader
 
 
+# Not Chapter 10 or Chapter 1.5
+FIRST_CHAPTER = re.compile(r"\bchapter 1(?![\d.])", re.IGNORECASE)
+
+
 class MangaGekkoDownloader(Downloader):
     """Manga Gekko Downloader (mgeko.cc)"""
 
@@ -14,19 +18,17 @@ class MangaGekkoDownloader(Downloader):
             base_url: url of homepage to get the first chapter's url
         """
 
-        response = requests.get(base_url)
-        try:
-            first_url = re.search(r'<a.+href=["\']([^"\']+)["\'][^>]*>(?=.*chapter 1).*?</a>', response.text,
-                                  re.IGNORECASE | re.DOTALL).group(1)
-        except AttributeError:
+        response = session.get(base_url)
+        first_urls = extract.find_links(response.text, FIRST_CHAPTER, base_url)
+        if not first_urls:
             raise Exception(f"MangaGekkoDownloader cannot get the first chapter's url from: {base_url}.")
 
-        super().__init__(urllib.parse.urljoin(base_url, first_url), None)
+        super().__init__(first_urls[0], None)
 
     def get_image_urls(self, response: requests.Response) -> list[str]:
         """Gets images urls"""
 
-        urls = re.findall(r'<img.*src=["\']([^"\']*)["\']', response.text)
+        urls = extract.images(response.text)
 
         for index in range(len(urls)-1, -1, -1):
             if not urls[index].startswith("http"):
@@ -37,8 +39,8 @@ class MangaGekkoDownloader(Downloader):
     def get_next_url(self, response: requests.Response) -> str | None:
         """Gets next url"""
 
-        url = re.findall(r'<a(?!.*disabled).*?href=["\']([^"\']+)["\'][^>]*>(?=.*next).*?</a>', response.text, re.IGNORECASE)
+        urls = extract.find_links(response.text, "next", response.url, exclude="disabled")
 
-        if not url:
+        if not urls:
             return None
-        return urllib.parse.urljoin(response.url, url[0])
+        return urls[0]
@@ -0,0 +1,91 @@
+import time
+import heapq
+import random
+import itertools
+import threading
+
+from src import stats
+
+
+# Times a page or image is fetched before it's given up on and listed as failed
+ATTEMPTS = 4
+# Seconds the first retry waits at most, doubled for every retry after it
+BACKOFF = 1.0
+MAX_BACKOFF = 60.0
+
+
+def backoff(attempt: int) -> float:
+    """Gets the seconds to wait before fetching something again after it failed attempt times
+
+        Exponential backoff with full jitter, a random time up to the backoff, so
+        what failed together, like the images of a chapter, isn't retried together.
+    """
+
+    return random.uniform(0, min(MAX_BACKOFF, BACKOFF * 2 ** (attempt - 1)))
+
+
+class RetryQueue:
+    """Retry Queue
+
+        Holds the pages and images whose fetch failed until their backoff is over,
+        the engines fetch them again once the rest is done. What failed ATTEMPTS
+        times is given up on and kept in failures, which is recorded in the
+        manifest so download --retry-failed can fetch only them.
+
+        Entries:
+            {"type": "chapter", "chapter": int, "url": str}
+            {"type": "image", "url": str, "filename": str}
+        Once failed they also have "attempts": int and "error": str.
+    """
+
+    def __init__(self, attempts: int = ATTEMPTS) -> None:
+        self.attempts = attempts
+        self.failures: list[dict] = []
+        # (when it's due as a monotonic time, order added, entry)
+        self.entries: list[tuple[float, int, dict]] = []
+        self.order = itertools.count()
+        self.lock = threading.Lock()
+
+    def add(self, entry: dict, error: Exception) -> None:
+        """Queues an entry that failed to be fetched again, or gives up on it
+
+            The error is recorded with the entry's url unless it already has it.
+        """
+
+        message = str(error) if entry["url"] in str(error) else f"{entry['url']}: {error}"
+        entry = {**entry, "attempts": entry.get("attempts", 0) + 1, "error": message}
+        if entry["attempts"] >= self.attempts:
+            with self.lock:
+                self.failures.append(entry)
+            stats.count("failed")
+            stats.echo(f"{message} Giving up after {entry['attempts']} attempts.", err=True)
+            return
+
+        wait = backoff(entry["attempts"])
+        with self.lock:
+            heapq.heappush(self.entries, (time.monotonic() + wait, next(self.order), entry))
+        stats.count("retried")
+        stats.echo(f"{message} Retrying in {wait:.1f} seconds.", err=True)
+
+    def due(self) -> float | None:
+        """Gets the seconds until the next entry is due, None if there are none"""
+
+        with self.lock:
+            if not self.entries:
+                return None
+            return max(0.0, self.entries[0][0] - time.monotonic())
+
+    def pop_due(self) -> list[dict]:
+        """Takes every entry that is due"""
+
+        now = time.monotonic()
+        due = []
+        with self.lock:
+            while self.entries and self.entries[0][0] <= now:
+                due.append(heapq.heappop(self.entries)[2])
+        return due
+
+    def chapters_failed(self) -> bool:
+        """Checks if any chapter page was given up on, so not every chapter was found"""
+
+        return any(entry["type"] == "chapter" for entry in self.failures)
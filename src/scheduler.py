@@ -0,0 +1,132 @@
+import itertools
+import threading
+from collections import deque
+from collections.abc import Callable, Iterable, Iterator
+from concurrent.futures import Future, ThreadPoolExecutor, wait
+
+
+DEFAULT_LOOKAHEAD = 4
+
+
+class Scheduler:
+    """Long-lived download scheduler
+
+        One pool of workers is shared by the images of every chapter so the pool
+        never drains at a chapter boundary. At most max_pending downloads can be
+        queued or running at once, submit blocks past that which keeps chapter pages
+        from being fetched too far ahead of their images.
+    """
+
+    def __init__(self, workers: int, max_pending: int | None = None, lookahead: int = DEFAULT_LOOKAHEAD) -> None:
+        """Constructor
+
+            workers: number of downloads running at once
+            max_pending: number of downloads queued or running before submit blocks, defaults to 4 * workers
+            lookahead: number of chapter pages fetched ahead of the chapter being queued
+        """
+
+        self.executor = ThreadPoolExecutor(max_workers=workers)
+        self.slots = threading.BoundedSemaphore(max_pending or workers * 4)
+        self.lookahead = lookahead
+        self.futures: set[Future] = set()
+
+    def __enter__(self) -> "Scheduler":
+        return self
+
+    def __exit__(self, exc_type, *args) -> None:
+        # Leaving because of an error, like Ctrl-C, drops the downloads that haven't started
+        self.shutdown(cancel=exc_type is not None)
+
+    def submit(self, fn: Callable, *args) -> Future:
+        """Queues fn(*args), blocks while the queue is full"""
+
+        self.slots.acquire()
+        try:
+            future = self.executor.submit(fn, *args)
+        except BaseException:
+            self.slots.release()
+            raise
+        self.futures.add(future)
+        future.add_done_callback(self.futures.discard)
+        future.add_done_callback(lambda _: self.slots.release())
+        return future
+
+    def prefetch(self, fn: Callable, items: Iterable) -> Iterator[Future]:
+        """Calls fn on each item up to lookahead items ahead of the consumer
+
+            Yields the futures in the same order as items.
+        """
+
+        items = iter(items)
+        with ThreadPoolExecutor(max_workers=self.lookahead) as pages:
+            pending = deque(pages.submit(fn, item) for item in itertools.islice(items, self.lookahead))
+            while pending:
+                future = pending.popleft()
+                for item in itertools.islice(items, 1):
+                    pending.append(pages.submit(fn, item))
+                yield future
+
+    def join(self) -> None:
+        """Waits for every queued download to finish, more can be queued after unlike shutdown"""
+
+        while self.futures:
+            wait(list(self.futures))
+
+    def group(self) -> "Group":
+        """Gets a group of downloads queued on this scheduler that can be waited for on their own"""
+
+        return Group(self)
+
+    def shutdown(self, cancel: bool = False) -> None:
+        """Waits for every queued download to finish
+
+            cancel: drop the queued downloads that haven't started and only wait for the running ones
+        """
+
+        self.executor.shutdown(wait=True, cancel_futures=cancel)
+
+
+class Group:
+    """Download Group
+
+        The downloads of one series on a Scheduler shared by several series, like
+        in a batch download. It's used like a Scheduler of its own, but joining or
+        leaving it only waits for its own downloads.
+    """
+
+    def __init__(self, scheduler: Scheduler) -> None:
+        self.scheduler = scheduler
+        self.futures: set[Future] = set()
+
+    def __enter__(self) -> "Group":
+        return self
+
+    def __exit__(self, exc_type, *args) -> None:
+        if exc_type is not None:
+            self.cancel()
+        self.join()
+
+    def submit(self, fn: Callable, *args) -> Future:
+        """Queues fn(*args) on the scheduler, blocks while its queue is full"""
+
+        future = self.scheduler.submit(fn, *args)
+        self.futures.add(future)
+        future.add_done_callback(self.futures.discard)
+        return future
+
+    def prefetch(self, fn: Callable, items: Iterable) -> Iterator[Future]:
+        """See Scheduler.prefetch"""
+
+        return self.scheduler.prefetch(fn, items)
+
+    def cancel(self) -> None:
+        """Drops the downloads of the group that haven't started, like Scheduler.shutdown"""
+
+        for future in list(self.futures):
+            future.cancel()
+
+    def join(self) -> None:
+        """Waits for every download of the group to finish"""
+
+        while self.futures:
+            wait(list(self.futures))
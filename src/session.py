@@ -0,0 +1,183 @@
+import os
+import time
+import threading
+import urllib.parse
+import requests
+import requests.adapters
+
+from src import constants, stats, throttle
+from src.page_cache import PageCache
+
+
+DEFAULT_WORKERS = min(32, (os.cpu_count() or 1) + 4)
+DEFAULT_TIMEOUT = 30.0
+
+_lock = threading.Lock()
+_session: requests.Session | None = None
+_workers = DEFAULT_WORKERS
+_timeout = DEFAULT_TIMEOUT
+_rate: float | None = None
+_limits: dict[str, throttle.HostLimit] = {}
+_cache: PageCache | None = None
+
+
+def configure(workers: int | None = None, timeout: float | None = None, rate: float | None = None, cache_size: int | None = None) -> None:
+    """Configures the shared session
+
+        workers: number of download workers, also the size of each host's connection pool
+            and the most requests in flight to each host
+        timeout: seconds to wait for a connection and between bytes of a response
+        rate: most requests started each second to each host, 0 for no limit, overrides
+            the rate of each host set with limit_host
+        cache_size: most bytes of pages kept in page_cache, 0 to not cache pages, see PageCache
+
+        The current session is closed and the limits of each host are forgotten so
+        the next request uses the new settings.
+    """
+
+    global _session, _workers, _timeout, _rate, _cache
+
+    with _lock:
+        if workers is not None:
+            if workers < 1:
+                raise Exception(f"workers must be at least 1, got {workers}.")
+            _workers = workers
+        if timeout is not None:
+            if timeout <= 0:
+                raise Exception(f"timeout must be greater than 0, got {timeout}.")
+            _timeout = timeout
+        if rate is not None:
+            if rate < 0:
+                raise Exception(f"rate must be at least 0, got {rate}.")
+            _rate = rate
+        if cache_size is not None:
+            if cache_size < 0:
+                raise Exception(f"cache_size must be at least 0, got {cache_size}.")
+            _cache = PageCache(constants.get_page_cache_dir(), cache_size) if cache_size > 0 else None
+        _limits.clear()
+        if _session is not None:
+            _session.close()
+            _session = None
+
+def get_workers() -> int:
+    """Gets the number of download workers"""
+
+    return _workers
+
+def get_timeout() -> float:
+    """Gets the request timeout in seconds"""
+
+    return _timeout
+
+def get_cache() -> PageCache | None:
+    """Gets the page cache, None if pages aren't cached"""
+
+    return _cache
+
+def host_limit(url: str) -> throttle.HostLimit:
+    """Gets the limit of the requests to url's host, shared by both engines"""
+
+    host = urllib.parse.urlsplit(url).netloc
+    with _lock:
+        if host not in _limits:
+            _limits[host] = throttle.HostLimit(_workers, _rate or None)
+        return _limits[host]
+
+def limit_host(url: str, rate: float) -> None:
+    """Caps the requests started each second to url's host, like the site of a provider, unless configure was given a rate"""
+
+    if _rate is None:
+        host_limit(url).rate = rate
+
+def get_session() -> requests.Session:
+    """Gets the shared session, creating it on first use
+
+        Connections are kept alive and pooled per host so every request to the same
+        host after the first one skips the TCP and TLS handshakes.
+    """
+
+    global _session
+
+    with _lock:
+        if _session is None:
+            session = requests.Session()
+            adapter = requests.adapters.HTTPAdapter(pool_connections=8, pool_maxsize=_workers, pool_block=True)
+            session.mount("https://", adapter)
+            session.mount("http://", adapter)
+            _session = session
+        return _session
+
+def get(url: str, **kwargs) -> requests.Response:
+    """Sends a GET request through the shared session
+
+        Accepts the same keyword arguments as requests.get, timeout defaults to the
+        configured timeout. How long the response took, until its headers when
+        streaming, and its status code are recorded in stats.
+
+        The request waits for a slot of its host's limit, see throttle.HostLimit. A
+        streamed response keeps its slot until it's closed, so it must be. Throttled
+        responses (429/503) are sent again once the host's Retry-After is over, up to
+        throttle.RETRIES times.
+
+        Responses that aren't streamed, which are pages and never images, go through
+        the page cache if there is one: the request is made conditional on the cached
+        page and a 304 is answered with it, see PageCache.update.
+    """
+
+    kwargs.setdefault("timeout", _timeout)
+    cache = _cache if not kwargs.get("stream") else None
+    entry = None
+    if cache is not None:
+        entry = cache.load(url)
+        kwargs["headers"] = {**cache.validators(entry), **(kwargs.get("headers") or {})}
+
+    limit = host_limit(url)
+    for attempt in range(throttle.RETRIES + 1):
+        started = limit.acquire()
+        try:
+            response = get_session().get(url, **kwargs)
+        except requests.RequestException as e:
+            stats.request(url, time.monotonic() - started, type(e).__name__)
+            limit.release(started, None, None)
+            raise
+        latency = time.monotonic() - started
+        stats.request(url, latency, response.status_code)
+
+        if response.status_code in throttle.THROTTLED and attempt < throttle.RETRIES:
+            response.close()
+            paused = limit.release(started, latency, response.status_code, response.headers.get("Retry-After"))
+            stats.count("throttled")
+            if paused > 0:
+                stats.echo(f"{urllib.parse.urlsplit(url).netloc} answered with status code {response.status_code}, waiting {paused:.1f} seconds and sending fewer requests at once.", err=True)
+            continue
+
+        if not kwargs.get("stream"):
+            limit.release(started, latency, response.status_code, response.headers.get("Retry-After"))
+            return response if cache is None else cache.update(url, entry, response)
+
+        return hold(response, limit, started, latency)
+
+def hold(response: requests.Response, limit: throttle.HostLimit, started: float, latency: float) -> requests.Response:
+    """Makes a streamed response keep its slot of limit until it's closed"""
+
+    close = response.close
+    released = threading.Event()
+
+    def release() -> None:
+        close()
+        if not released.is_set():
+            released.set()
+            limit.release(started, latency, response.status_code, response.headers.get("Retry-After"))
+
+    response.close = release
+    return response
+
+def close() -> None:
+    """Closes the shared session and all its pooled connections"""
+
+    global _session
+
+    with _lock:
+        if _session is not None:
+            _session.close()
+            _session = None
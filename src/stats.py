@@ -0,0 +1,382 @@
+import sys
+import json
+import time
+import functools
+import threading
+import contextlib
+import urllib.parse
+from collections.abc import Callable, Iterator
+import click
+
+
+# Upper bounds in seconds of the buckets of every histogram, the last bucket is everything slower
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+PROGRESS_INTERVAL = 0.5
+
+# The --stats option of every command that records stats
+option = click.option("--stats", "stats_path", default=None, type=click.Path(dir_okay=False), help="Write the performance stats, like the latency of each host and the time each stage took, to this file as json and print a summary of them.", metavar="FILE")
+
+
+class Histogram:
+    """Latency Histogram
+
+        Counts durations in the fixed BUCKETS so recording one is cheap and
+        histograms from other processes can be added together. Quantiles are
+        estimated from the buckets.
+    """
+
+    def __init__(self) -> None:
+        self.counts = [0] * (len(BUCKETS) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.min: float | None = None
+        self.max: float | None = None
+
+    def add(self, seconds: float) -> None:
+        """Records a duration"""
+
+        index = next((i for i, bound in enumerate(BUCKETS) if seconds <= bound), len(BUCKETS))
+        self.counts[index] += 1
+        self.count += 1
+        self.total += seconds
+        self.min = seconds if self.min is None else min(self.min, seconds)
+        self.max = seconds if self.max is None else max(self.max, seconds)
+
+    def merge(self, other: "Histogram") -> None:
+        """Adds the durations of another histogram"""
+
+        self.counts = [a + b for a, b in zip(self.counts, other.counts)]
+        self.count += other.count
+        self.total += other.total
+        if other.count:
+            self.min = other.min if self.min is None else min(self.min, other.min)
+            self.max = other.max if self.max is None else max(self.max, other.max)
+
+    def quantile(self, q: float) -> float | None:
+        """Estimates the duration q of the durations are at most, None if there are none
+
+            Interpolated within the bucket it falls in, which is narrowed to the
+            smallest and largest duration recorded.
+        """
+
+        if self.count == 0:
+            return None
+        target = q * self.count
+        seen = 0
+        for i, count in enumerate(self.counts):
+            if count and seen + count >= target:
+                lower = max(BUCKETS[i - 1] if i > 0 else 0.0, self.min)
+                upper = min(BUCKETS[i], self.max) if i < len(BUCKETS) else self.max
+                return lower + (upper - lower) * (target - seen) / count
+            seen += count
+        return self.max
+
+    def to_dict(self) -> dict:
+        """Gets the histogram as json, the buckets are keyed by their upper bound"""
+
+        return {
+            "count": self.count,
+            "total": self.total,
+            "mean": self.total / self.count if self.count else None,
+            "min": self.min,
+            "max": self.max,
+            "p50": self.quantile(0.5),
+            "p90": self.quantile(0.9),
+            "p99": self.quantile(0.99),
+            "buckets": {**{f"{bound:g}": count for bound, count in zip(BUCKETS, self.counts)}, "inf": self.counts[-1]},
+        }
+
+    def describe(self) -> str:
+        """Formats the histogram in a line"""
+
+        return (
+            f"{self.count} in {self.total:.2f} s, mean {format_seconds(self.total / self.count)}, "
+            f"p50 {format_seconds(self.quantile(0.5))}, p90 {format_seconds(self.quantile(0.9))}, "
+            f"p99 {format_seconds(self.quantile(0.99))}, max {format_seconds(self.max)}"
+        )
+
+
+class Stats:
+    """Performance Stats
+
+        Counters, like images and bytes, and histograms of how long each stage
+        took, like parsing a page or writing an image, with a histogram of the
+        latency and the status codes of the requests to each host. Recorded from
+        every thread, and from other processes by merging what they recorded.
+    """
+
+    def __init__(self) -> None:
+        self.lock = threading.Lock()
+        self.started = time.perf_counter()
+        self.counters: dict[str, int | float] = {}
+        self.timings: dict[str, Histogram] = {}
+        self.hosts: dict[str, Histogram] = {}
+        self.statuses: dict[str, dict[str, int]] = {}
+
+    def __getstate__(self) -> dict:
+        state = self.__dict__.copy()
+        del state["lock"]
+        return state
+
+    def __setstate__(self, state: dict) -> None:
+        self.__dict__.update(state)
+        self.lock = threading.Lock()
+
+    def count(self, name: str, amount: int | float = 1) -> None:
+        """Adds to a counter"""
+
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + amount
+
+    def time(self, name: str, seconds: float) -> None:
+        """Records how long a stage took"""
+
+        with self.lock:
+            self.timings.setdefault(name, Histogram()).add(seconds)
+
+    def request(self, url: str, seconds: float, status: int | str) -> None:
+        """Records a request to url's host, how long until its response and its status code or error"""
+
+        host = urllib.parse.urlsplit(url).netloc
+        with self.lock:
+            self.hosts.setdefault(host, Histogram()).add(seconds)
+            statuses = self.statuses.setdefault(host, {})
+            statuses[str(status)] = statuses.get(str(status), 0) + 1
+
+    def merge(self, other: "Stats") -> None:
+        """Adds what another Stats recorded, like one returned by a process of a pool"""
+
+        with self.lock:
+            for name, amount in other.counters.items():
+                self.counters[name] = self.counters.get(name, 0) + amount
+            for ours, theirs in ((self.timings, other.timings), (self.hosts, other.hosts)):
+                for name, histogram in theirs.items():
+                    ours.setdefault(name, Histogram()).merge(histogram)
+            for host, statuses in other.statuses.items():
+                ours = self.statuses.setdefault(host, {})
+                for status, count in statuses.items():
+                    ours[status] = ours.get(status, 0) + count
+
+    def elapsed(self) -> float:
+        """Gets the seconds since the stats started"""
+
+        return time.perf_counter() - self.started
+
+    def to_dict(self) -> dict:
+        """Gets the stats as json, counters also get their rate per second"""
+
+        with self.lock:
+            elapsed = self.elapsed()
+            return {
+                "elapsed": elapsed,
+                "counters": dict(self.counters),
+                "rates": {name: amount / elapsed for name, amount in self.counters.items()},
+                "timings": {name: histogram.to_dict() for name, histogram in self.timings.items()},
+                "hosts": {
+                    host: {"latency": histogram.to_dict(), "statuses": dict(self.statuses.get(host, {}))}
+                    for host, histogram in self.hosts.items()
+                },
+            }
+
+    def summary(self) -> list[str]:
+        """Gets the lines of the report printed with --stats"""
+
+        with self.lock:
+            elapsed = self.elapsed()
+            lines = [f"Stats over {elapsed:.1f} seconds:"]
+            for name, amount in self.counters.items():
+                if name == "bytes":
+                    lines.append(f"    bytes: {amount / 1024 / 1024:.1f} MB, {amount / 1024 / 1024 / elapsed:.1f} MB/s")
+                else:
+                    lines.append(f"    {name}: {amount:g}, {amount / elapsed:.1f}/s")
+            for host, histogram in self.hosts.items():
+                statuses = ", ".join(f"{status}: {count}" for status, count in sorted(self.statuses.get(host, {}).items()))
+                lines.append(f"    requests to {host}: {histogram.describe()} ({statuses})")
+            for name, histogram in self.timings.items():
+                lines.append(f"    {name}: {histogram.describe()}")
+            return lines
+
+
+class Progress:
+    """Live Progress Line
+
+        Redraws a line on stderr with how many items are done out of the total,
+        their rate and bytes per second, and the time left at that rate. Only
+        drawn when stderr is a terminal, so logs of scripts don't fill up with it.
+    """
+
+    def __init__(self, stats: Stats, unit: str, total: int | str | None, interval: float = PROGRESS_INTERVAL) -> None:
+        """Constructor
+
+            unit: the counter of the items done, like "images"
+            total: the number of items, or the counter of the items known so far when
+                more are found as it goes, like the images of the chapters parsed
+        """
+
+        self.stats = stats
+        self.unit = unit
+        self.total = total
+        self.interval = interval
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+
+    def start(self) -> None:
+        self.thread.start()
+
+    def run(self) -> None:
+        while not self.stopped.wait(self.interval):
+            self.draw()
+
+    def line(self) -> str:
+        """Gets the progress line"""
+
+        elapsed = self.stats.elapsed()
+        done = self.stats.counters.get(self.unit, 0)
+        total = self.stats.counters.get(self.total, 0) if isinstance(self.total, str) else self.total
+        rate = done / elapsed if elapsed > 0 else 0
+
+        line = f"{done}/{"?" if total is None else total} {self.unit}, {rate:.1f}/s, {self.stats.counters.get("bytes", 0) / 1024 / 1024 / elapsed:.1f} MB/s"
+        if total is not None and rate > 0:
+            line += f", ETA {format_duration((total - done) / rate)}"
+        return line + f", {format_duration(elapsed)} elapsed"
+
+    def draw(self) -> None:
+        with _draw_lock:
+            if not self.stopped.is_set():
+                sys.stderr.write(f"\r\x1b[K{self.line()}")
+                sys.stderr.flush()
+
+    def clear(self) -> None:
+        sys.stderr.write("\r\x1b[K")
+        sys.stderr.flush()
+
+    def stop(self) -> None:
+        with _draw_lock:
+            self.stopped.set()
+            self.clear()
+        if self.thread.is_alive():
+            self.thread.join()
+
+
+_stats = Stats()
+_progress: Progress | None = None
+_draw_lock = threading.RLock()
+
+
+def get() -> Stats:
+    """Gets the stats being recorded"""
+
+    return _stats
+
+def reset() -> Stats:
+    """Stops the progress line and starts recording new stats, like at the start of a command"""
+
+    stop_progress()
+    return start_recording()
+
+def start_recording() -> Stats:
+    """Starts recording new stats without touching the progress line, like in a process of a pool"""
+
+    global _stats
+
+    _stats = Stats()
+    return _stats
+
+def count(name: str, amount: int | float = 1) -> None:
+    """Adds to a counter of the stats being recorded"""
+
+    _stats.count(name, amount)
+
+def record(name: str, seconds: float) -> None:
+    """Records how long a stage took in the stats being recorded"""
+
+    _stats.time(name, seconds)
+
+def request(url: str, seconds: float, status: int | str) -> None:
+    """Records a request in the stats being recorded"""
+
+    _stats.request(url, seconds, status)
+
+@contextlib.contextmanager
+def timer(name: str) -> Iterator[None]:
+    """Records how long the with block took as the stage name"""
+
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        _stats.time(name, time.perf_counter() - start)
+
+def timed(name: str, fn: Callable) -> Callable:
+    """Wraps fn to record how long each call takes as the stage name, like the hooks of providers"""
+
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+        with timer(name):
+            return fn(*args, **kwargs)
+    return wrapper
+
+def start_progress(unit: str, total: int | str | None) -> None:
+    """Starts drawing the progress line if stderr is a terminal, see Progress"""
+
+    global _progress
+
+    stop_progress()
+    if sys.stderr.isatty():
+        _progress = Progress(_stats, unit, total)
+        _progress.start()
+
+def stop_progress() -> None:
+    """Stops drawing the progress line and clears it"""
+
+    global _progress
+
+    if _progress is not None:
+        _progress.stop()
+        _progress = None
+
+def echo(message: str, err: bool = False) -> None:
+    """click.echo that keeps the progress line under the message instead of in it"""
+
+    with _draw_lock:
+        if _progress is None:
+            click.echo(message, err=err)
+            return
+        _progress.clear()
+        click.echo(message, err=err)
+        _progress.draw()
+
+def report(path: str | None) -> None:
+    """Stops the progress line, then writes the stats to path as json and prints their summary
+
+        Nothing is written or printed if path is None.
+    """
+
+    stop_progress()
+    if path is None:
+        return
+
+    for line in _stats.summary():
+        click.echo(line, err=True)
+    try:
+        with open(path, "w") as file:
+            json.dump(_stats.to_dict(), file, indent=4)
+    except OSError as e:
+        click.echo(f"Error occurred while writing the stats:\n\t{e}", err=True)
+        return
+    click.echo(f"Wrote the stats to {path}.", err=True)
+
+def format_seconds(seconds: float | None) -> str:
+    """Formats a short duration in milliseconds or seconds"""
+
+    if seconds is None:
+        return "-"
+    if seconds < 1:
+        return f"{seconds * 1000:.1f} ms"
+    return f"{seconds:.2f} s"
+
+def format_duration(seconds: float) -> str:
+    """Formats a long duration as h:mm:ss"""
+
+    seconds = int(seconds)
+    return f"{seconds // 3600}:{seconds // 60 % 60:02}:{seconds % 60:02}"
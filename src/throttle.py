@@ -0,0 +1,145 @@
+import time
+import datetime
+import threading
+import email.utils
+
+
+# Status codes of responses from a host asking for fewer requests
+THROTTLED = {429, 503}
+# Times a throttled request is sent again after waiting before its response is returned
+RETRIES = 5
+INITIAL_WINDOW = 4
+# Seconds every request to a throttled host waits when its response has no Retry-After
+DEFAULT_RETRY_AFTER = 5.0
+MAX_RETRY_AFTER = 600.0
+# The window narrows when the average latency of a host goes over this many times its lowest
+LATENCY_TOLERANCE = 3.0
+# Weight of the newest latency in the average latency
+LATENCY_SMOOTHING = 0.2
+# How much the lowest latency rises with every response, so a host that got slower for good
+# isn't compared to how fast it was forever
+FASTEST_DRIFT = 1.01
+
+
+class HostLimit:
+    """Adaptive Host Limit
+
+        Limits the requests in flight to one host to a window which adapts like
+        TCP's congestion window: it widens by one request once a window's worth of
+        requests succeeded, and halves when the host throttles (429/503), fails or
+        gets slow, which is when its average latency goes over LATENCY_TOLERANCE
+        times the lowest latency seen. Only requests started after the last cut can
+        cut the window again, so a burst of failures halves it once.
+
+        A throttled response's Retry-After pauses every request to the host until
+        then, and rate caps the requests started each second.
+
+        Used from every download thread, the async engine only uses try_acquire
+        and release as it waits on its event loop instead.
+    """
+
+    def __init__(self, max_window: int, rate: float | None = None) -> None:
+        """Constructor
+
+            max_window: most requests in flight at once, the window never goes over it
+            rate: most requests started each second, None for no limit
+        """
+
+        self.max_window = max_window
+        self.window = float(min(INITIAL_WINDOW, max_window))
+        self.rate = rate
+        self.in_flight = 0
+        # Monotonic times no request may start before, one for the rate and one for Retry-After
+        self.next_start = 0.0
+        self.paused_until = 0.0
+        self.cut_at = 0.0
+        self.fastest: float | None = None
+        self.latency: float | None = None
+        self.released = threading.Condition()
+
+    def try_acquire(self) -> float | None:
+        """Takes a slot of the window if one is free
+
+            Returns 0 if it took one, else the seconds to wait before trying again
+            or None to wait until a request is released.
+        """
+
+        with self.released:
+            now = time.monotonic()
+            wait = max(self.paused_until, self.next_start) - now
+            if wait > 0:
+                return wait
+            if self.in_flight >= int(self.window):
+                return None
+
+            self.in_flight += 1
+            if self.rate is not None:
+                self.next_start = now + 1 / self.rate
+            return 0
+
+    def acquire(self) -> float:
+        """Waits for a slot of the window and takes it, returns when as a monotonic time for release"""
+
+        with self.released:
+            while (wait := self.try_acquire()) != 0:
+                self.released.wait(wait)
+        return time.monotonic()
+
+    def release(self, started: float, latency: float | None, status: int | None, retry_after: str | None = None) -> float:
+        """Gives back the slot of a request and adapts the window to how it went
+
+            started: when the slot was taken, see acquire
+            latency: seconds until the response, None if the request failed without one
+            status: the response's status code, None if the request failed without one
+            retry_after: the response's Retry-After header
+
+            Returns the seconds requests to the host are paused for if this response
+            paused them, else 0.
+        """
+
+        with self.released:
+            self.in_flight -= 1
+            now = time.monotonic()
+            paused = 0.0
+
+            if status in THROTTLED:
+                pause = parse_retry_after(retry_after)
+                if now + pause > self.paused_until:
+                    self.paused_until = now + pause
+                    paused = pause
+                self.cut(started, now)
+            elif status is None or status >= 500:
+                self.cut(started, now)
+            else:
+                self.fastest = latency if self.fastest is None else min(self.fastest * FASTEST_DRIFT, latency)
+                self.latency = latency if self.latency is None else self.latency + LATENCY_SMOOTHING * (latency - self.latency)
+                if self.latency > LATENCY_TOLERANCE * self.fastest and self.fastest > 0:
+                    self.cut(started, now)
+                else:
+                    self.window = min(self.max_window, self.window + 1 / self.window)
+
+            self.released.notify_all()
+            return paused
+
+    def cut(self, started: float, now: float) -> None:
+        """Halves the window unless it was already cut after the request started"""
+
+        if started >= self.cut_at:
+            self.window = max(1.0, self.window / 2)
+            self.cut_at = now
+
+
+def parse_retry_after(value: str | None) -> float:
+    """Gets the seconds to wait of a Retry-After header, a number of seconds or a date"""
+
+    if value is None:
+        return DEFAULT_RETRY_AFTER
+    try:
+        seconds = float(value)
+    except ValueError:
+        try:
+            date = email.utils.parsedate_to_datetime(value)
+        except (TypeError, ValueError):
+            return DEFAULT_RETRY_AFTER
+        seconds = (date - datetime.datetime.now(datetime.timezone.utc)).total_seconds()
+    return min(MAX_RETRY_AFTER, max(0.0, seconds))
@@ -0,0 +1,96 @@
+import os
+import pathlib
+from concurrent.futures import ProcessPoolExecutor
+import click
+import PIL.Image
+from cbz.constants import IMAGE_FORMAT
+
+from src import constants, files
+
+
+# Target format: (PIL format, suffix)
+TARGET_FORMATS = {
+    "jpeg": ("JPEG", ".jpg"),
+    "png": ("PNG", ".png"),
+    "webp": ("WEBP", ".webp"),
+}
+DEFAULT_TARGET = "jpeg"
+DEFAULT_QUALITY = 90
+
+
+def needs_transcode(path: pathlib.Path, target: str, convert_webp: bool) -> bool:
+    """Checks if a page has to be transcoded to be packed
+
+        Formats the cbz packer doesn't allow like AVIF always are, WebP only if
+        convert_webp is set.
+    """
+
+    suffix = path.suffix.lower()
+    if suffix == ".webp":
+        return convert_webp and target != "webp"
+    return suffix not in IMAGE_FORMAT
+
+def transcode_pages(
+        paths: list[pathlib.Path],
+        target: str = DEFAULT_TARGET,
+        quality: int = DEFAULT_QUALITY,
+        convert_webp: bool = False,
+        jobs: int | None = None,
+        verbose: bool = False,
+) -> list[tuple[pathlib.Path, str]]:
+    """Transcodes the pages that need it in parallel processes
+
+        paths: the pages in order
+        target: "jpeg", "png" or "webp"
+        quality: quality of lossy targets from 1 to 100
+        convert_webp: whether WebP pages are transcoded too
+        jobs: number of processes transcoding at once, defaults to the number of cpus
+
+        Returns the path and key of each page in order. Transcoded pages point to the
+        transcode cache and have their key's suffix changed to the target's.
+    """
+
+    pages = [(path, path.name) for path in paths]
+    todo = [i for i, path in enumerate(paths) if needs_transcode(path, target, convert_webp)]
+    if not todo:
+        return pages
+
+    click.echo(f"Transcoding {len(todo)} pages to {target}.")
+    cache_dir = constants.get_transcode_cache_dir()
+    with ProcessPoolExecutor(max_workers=jobs, mp_context=constants.get_process_context()) as executor:
+        futures = [(i, executor.submit(transcode, str(paths[i]), cache_dir, target, quality)) for i in todo]
+        for i, future in futures:
+            cached, hit = future.result()
+            pages[i] = (pathlib.Path(cached), paths[i].stem + TARGET_FORMATS[target][1])
+            if verbose:
+                click.echo(f"{"Reused" if hit else "Transcoded"} {paths[i].name} as {cached}.")
+    return pages
+
+def transcode(source: str, cache_dir: str, target: str, quality: int) -> tuple[str, bool]:
+    """Transcodes an image into the cache, runs in its own process
+
+        The cached file is named by the hash of the source's bytes and the settings,
+        so the same image is only ever encoded once.
+
+        Returns the cached file's path and whether it was already cached.
+    """
+
+    image_format, suffix = TARGET_FORMATS[target]
+    cached = os.path.join(cache_dir, f"{files.file_hash(source)}-{quality}{suffix}")
+    if os.path.exists(cached):
+        return cached, True
+
+    # Pages with the same bytes can be transcoded by two processes at once, so each
+    # writes its own partial file and the last one to finish replaces the other's.
+    partial = f"{cached}.{os.getpid()}{files.PARTIAL_SUFFIX}"
+    try:
+        with PIL.Image.open(source) as image:
+            if image_format == "JPEG" and image.mode not in ("RGB", "L"):
+                image = image.convert("RGB")
+            image.save(partial, format=image_format, quality=quality)
+        os.replace(partial, cached)
+    except BaseException:
+        if os.path.exists(partial):
+            os.remove(partial)
+        raise
+    return cached, False
@@ -1,21 +1,40 @@
 import os
 import io
+import bisect
+import zipfile
+import xml.etree.ElementTree as ET
 import tkinter as tk
 import tkinter.filedialog
 import tkinter.messagebox
 import click
 import PIL.Image
 import PIL.ImageTk
-import cbz
-import cbz.page
+from collections import OrderedDict
+from collections.abc import Hashable
+from concurrent.futures import Future, ThreadPoolExecutor
 
-from src import constants
+from src import archive, constants
+
+
+DECODE_WORKERS = min(4, os.cpu_count() or 1)
+DEFAULT_CACHE_SIZE = 256
+# Screens above and below the visible one whose pages are rendered ahead
+VIEWPORT_MARGIN = 1.0
+# Milliseconds between checks for decoded pages
+POLL_INTERVAL = 15
+# Width and height of a page laid out before its size is known, when no page of its chapter has one
+DEFAULT_PAGE_SIZE = (800, 1200)
 
 
 @click.command()
 @click.help_option("-h", "--help")
-def ui() -> None:
-    """Open a ui to read cbz files locally"""
+@click.option("-c", "--cache-size", "cache_size", default=DEFAULT_CACHE_SIZE, type=click.IntRange(min=1), show_default=True, help="Megabytes of decoded pages kept in memory.", metavar="MEGABYTES")
+def ui(cache_size: int) -> None:
+    """Open a ui to read cbz files locally
+
+        Only the pages around the visible ones are decoded, in the background, and
+        the most recently shown pages are kept decoded up to --cache-size.
+    """
 
     root = tk.Tk()
 
@@ -33,14 +52,15 @@ def ui() -> None:
         )
         if not filename:
             return
-        chaps = get_images(filename)
-        if chaps is None:
+        reader = get_reader(filename)
+        if reader is None:
             tk.messagebox.showwarning(title="Open Failed", message=f"{filename} is empty or failed to open.")
             return
         images.clear()
-        for chap in chaps:
+        for chap in reader.chapters():
             images.append(chap)
-        init(images, canvas, listbox)
+        view.open(reader)
+        init(images, view, listbox)
 
     open_file_button = tk.Button(chapter_frame, text="Open File", anchor="n", command=open_file)
     open_file_button.pack(side="top", fill="x")
@@ -66,32 +86,37 @@ def ui() -> None:
     image_scroll.pack(side="right", fill="y")
 
     canvas = tk.Canvas(image_frame)
-    canvas.config(scrollregion=canvas.bbox("all"), yscrollcommand=image_scroll.set)
     canvas.pack(side="top", fill="both", expand=True)
 
+    view = PageView(canvas, cache_size * 1024 * 1024)
+    canvas.config(yscrollcommand=lambda *args: (image_scroll.set(*args), view.update()))
     image_scroll.config(command=canvas.yview)
 
+    canvas.bind("<Configure>", view.update)
     canvas.bind("<MouseWheel>", lambda e: canvas.yview_scroll(int(-1 * e.delta / (120 if os.name == "nt" else 1)), "units"))
-    listbox.bind("<<ListboxSelect>>", lambda e: add_images(canvas, images[listbox.curselection()[0]]))
-    previous_button.bind("<Button-1>", lambda e : change_chapter(-1, canvas, images, listbox))
-    next_button.bind("<Button-1>", lambda e : change_chapter(1, canvas, images, listbox))
+    listbox.bind("<<ListboxSelect>>", lambda e: listbox.curselection() and view.show(listbox.curselection()[0], images[listbox.curselection()[0]]))
+    previous_button.bind("<Button-1>", lambda e : change_chapter(-1, view, images, listbox))
+    next_button.bind("<Button-1>", lambda e : change_chapter(1, view, images, listbox))
 
     root.geometry("1000x800")
-    tk.mainloop()
+    try:
+        tk.mainloop()
+    finally:
+        view.close()
 
 
-def init(images: list[list[PIL.ImageTk.PhotoImage] | list[cbz.page.PageInfo]], canvas: tk.Canvas, listbox: tk.Listbox) -> None:
-    """Initialize canvas and listbox with images"""
+def init(images: list[list[dict[str, str]]], view: "PageView", listbox: tk.Listbox) -> None:
+    """Initialize view and listbox with images"""
 
     listbox.delete(0, tk.END)
     for i in range(len(images)):
         listbox.insert(tk.END, f"Chapter {i + 1}")
     listbox.selection_set(0)
 
-    add_images(canvas, images[0])
+    view.show(0, images[0])
 
 
-def change_chapter(change: int, canvas: tk.Canvas, images: list[list[PIL.ImageTk.PhotoImage] | list[cbz.page.PageInfo]], listbox: tk.Listbox) -> None:
+def change_chapter(change: int, view: "PageView", images: list[list[dict[str, str]]], listbox: tk.Listbox) -> None:
     """Changes the chapter by the value change"""
 
     if not images:
@@ -99,40 +124,245 @@ def change_chapter(change: int, canvas: tk.Canvas, images: list[list[PIL.ImageTk
     if listbox.curselection()[0] + change < 0 or listbox.curselection()[0] + change >= len(images):
         return
     changed = listbox.curselection()[0] + change
-    add_images(canvas, images[changed])
+    view.show(changed, images[changed])
     listbox.selection_clear(0, tk.END)
     listbox.selection_set(changed, changed)
 
 
-def add_images(canvas: tk.Canvas, images: list[PIL.ImageTk.PhotoImage] | list[cbz.page.PageInfo]) -> None:
-    """Adds images to the canvas"""
+def decode(reader: archive.CbzReader, page: dict[str, str]) -> PIL.Image.Image:
+    """Reads and decodes a page, runs in the decode workers"""
 
-    canvas.yview_moveto(0)
-    canvas.delete("all")
-    next_height = 0
-    for i, image in enumerate(images):
-        if isinstance(image, cbz.page.PageInfo):
-            image = PIL.ImageTk.PhotoImage(PIL.Image.open(io.BytesIO(image.content)))
-            images[i] = image
-        canvas.create_image(0, next_height, image=image, anchor="n")
-        next_height += image.height()
-    canvas.config(scrollregion=canvas.bbox("all"))
-    canvas.pack(side="top", fill="both", expand=True)
+    image = PIL.Image.open(io.BytesIO(reader.read(page)))
+    image.load()
+    return image
 
 
-def get_images(cbz_path: str) -> list[list[cbz.page.PageInfo]] | None:
-    """Gets a list of each chapter's images from the cbz file"""
+def get_reader(cbz_path: str) -> archive.CbzReader | None:
+    """Opens a cbz file to read its pages lazily, None if it's empty or invalid"""
 
-    images = [[]]
     try:
-        comic = cbz.ComicInfo.from_cbz(cbz_path)
-    except AttributeError:
+        reader = archive.CbzReader(cbz_path)
+    except (OSError, zipfile.BadZipFile, ET.ParseError):
         return None
-    for page in comic.pages:
-        chapter = int(page.key.lstrip("Chapter").split("Image")[0])
-        try:
-            images[chapter - 1].append(page)
-        except IndexError:
-            images.append([])
-            images[chapter - 1].append(page)
-    return images
+    try:
+        if reader.chapters():
+            return reader
+    except ValueError:
+        # A key that isn't like Chapter001Image001.jpg
+        pass
+    reader.close()
+    return None
+
+
+class ImageCache:
+    """Byte Budgeted LRU Cache
+
+        Keeps decoded pages until their total size goes over the budget, then
+        forgets the least recently used ones first. A page costs 4 bytes a pixel,
+        what Tk keeps of it. Forgotten pages still on the canvas stay alive until
+        the PageView removes them.
+    """
+
+    def __init__(self, budget: int) -> None:
+        """Constructor
+
+            budget: number of bytes of decoded pages to keep
+        """
+
+        self.budget = budget
+        self.size = 0
+        self.images: OrderedDict[Hashable, tuple[PIL.ImageTk.PhotoImage, int]] = OrderedDict()
+
+    def get(self, key: Hashable) -> PIL.ImageTk.PhotoImage | None:
+        """Gets a page and marks it as the most recently used, None if not kept"""
+
+        if key not in self.images:
+            return None
+        self.images.move_to_end(key)
+        return self.images[key][0]
+
+    def put(self, key: Hashable, image: PIL.ImageTk.PhotoImage) -> None:
+        """Keeps a page, forgetting the least recently used ones over the budget"""
+
+        if key in self.images:
+            self.size -= self.images.pop(key)[1]
+        size = image.width() * image.height() * 4
+        self.images[key] = (image, size)
+        self.size += size
+        while self.size > self.budget and len(self.images) > 1:
+            self.size -= self.images.popitem(last=False)[1][1]
+
+    def clear(self) -> None:
+        """Forgets every page"""
+
+        self.images.clear()
+        self.size = 0
+
+
+class PageView:
+    """Virtualized Page View
+
+        Lays out a chapter by the page sizes in ComicInfo.xml without reading or
+        decoding any page, and only puts the pages within VIEWPORT_MARGIN screens of the
+        visible area on the canvas. Pages scrolled away are taken off it again. A
+        page without a size is laid out like the first page of its chapter with one
+        until it's decoded.
+
+        Pages are decoded in a thread pool. Tk can only be used from the thread
+        running mainloop, so the finished ones are picked up by a poll scheduled
+        with after while any are decoding and turned into PhotoImages there.
+    """
+
+    def __init__(self, canvas: tk.Canvas, cache_size: int) -> None:
+        """Constructor
+
+            canvas: the canvas to draw pages on
+            cache_size: number of bytes of decoded pages to keep, see ImageCache
+        """
+
+        self.canvas = canvas
+        self.cache = ImageCache(cache_size)
+        self.executor = ThreadPoolExecutor(DECODE_WORKERS)
+        self.reader: archive.CbzReader | None = None
+        self.chapter = 0
+        self.pages: list[dict[str, str]] = []
+        # Width and height each page is laid out with
+        self.sizes: list[tuple[int, int]] = []
+        # Top of each page and the bottom of the last one
+        self.offsets = [0]
+        # Page index: (canvas item, image), the image has to be referenced while on the canvas
+        self.realized: dict[int, tuple[int, PIL.ImageTk.PhotoImage]] = {}
+        self.pending: dict[int, Future] = {}
+        self.poll_id: str | None = None
+
+    def open(self, reader: archive.CbzReader) -> None:
+        """Reads pages from another cbz file, closing the previous one"""
+
+        self.show(0, [])
+        self.cache.clear()
+        if self.reader is not None:
+            self.reader.close()
+        self.reader = reader
+
+    def show(self, chapter: int, pages: list[dict[str, str]]) -> None:
+        """Shows a chapter from the top"""
+
+        for future in self.pending.values():
+            future.cancel()
+        self.pending.clear()
+        self.realized.clear()
+        self.canvas.delete("all")
+
+        self.chapter = chapter
+        self.pages = pages
+        # Reading the header of every page without a size here would hold up the first draw
+        known = [(page["width"], page["height"]) for page in pages if "width" in page]
+        estimate = known[0] if known else DEFAULT_PAGE_SIZE
+        self.sizes = [(page["width"], page["height"]) if "width" in page else estimate for page in pages]
+        self.offsets = [0]
+        for _, height in self.sizes:
+            self.offsets.append(self.offsets[-1] + height)
+        self.set_scrollregion()
+        self.canvas.yview_moveto(0)
+        self.update()
+
+    def set_scrollregion(self) -> None:
+        """Fits the canvas's scrollregion to the pages, which are centered on x = 0"""
+
+        width = max((width for width, _ in self.sizes), default=0)
+        self.canvas.config(scrollregion=(-(width // 2), 0, width - width // 2, self.offsets[-1]))
+
+    def visible(self) -> range:
+        """Gets the indexes of the pages within VIEWPORT_MARGIN screens of the visible area"""
+
+        height = self.canvas.winfo_height()
+        top = self.canvas.canvasy(0) - height * VIEWPORT_MARGIN
+        bottom = self.canvas.canvasy(height) + height * VIEWPORT_MARGIN
+        start = max(bisect.bisect_right(self.offsets, top) - 1, 0)
+        end = min(bisect.bisect_left(self.offsets, bottom), len(self.pages))
+        return range(start, end)
+
+    def update(self, *args) -> None:
+        """Puts the pages near the visible area on the canvas and takes the others off"""
+
+        visible = self.visible()
+        for i in [i for i in self.realized if i not in visible]:
+            self.canvas.delete(self.realized.pop(i)[0])
+        for i in [i for i in self.pending if i not in visible]:
+            # Pages already decoding are left to finish and be cached
+            if self.pending[i].cancel():
+                del self.pending[i]
+
+        for i in visible:
+            if i in self.realized or i in self.pending:
+                continue
+            image = self.cache.get((self.chapter, i))
+            if image is None:
+                self.pending[i] = self.executor.submit(decode, self.reader, self.pages[i])
+            else:
+                self.realize(i, image)
+        self.schedule_poll()
+
+    def realize(self, i: int, image: PIL.ImageTk.PhotoImage) -> None:
+        """Puts a decoded page on the canvas"""
+
+        self.realized[i] = (self.canvas.create_image(0, self.offsets[i], image=image, anchor="n"), image)
+
+    def resize(self, i: int, size: tuple[int, int]) -> None:
+        """Lays the pages out again once a page laid out with an estimated size is decoded
+
+            The pages after it are moved, and so is the view when the page is above
+            it so what's visible stays in place.
+        """
+
+        top = self.canvas.canvasy(0)
+        delta = size[1] - self.sizes[i][1]
+        self.sizes[i] = size
+        for j in range(i + 1, len(self.offsets)):
+            self.offsets[j] += delta
+        for j, (item, _) in self.realized.items():
+            if j > i:
+                self.canvas.move(item, 0, delta)
+        self.set_scrollregion()
+        if self.offsets[i] < top and self.offsets[-1] > 0:
+            self.canvas.yview_moveto((top + delta) / self.offsets[-1])
+
+    def schedule_poll(self) -> None:
+        """Polls for decoded pages after POLL_INTERVAL while any are decoding, unless a poll is already scheduled"""
+
+        if self.pending and self.poll_id is None:
+            self.poll_id = self.canvas.after(POLL_INTERVAL, self.poll)
+
+    def poll(self) -> None:
+        """Caches the pages that finished decoding and shows them if still near the visible area"""
+
+        self.poll_id = None
+        resized = False
+        for i in [i for i, future in self.pending.items() if future.done()]:
+            future = self.pending.pop(i)
+            if future.exception() is not None:
+                click.echo(f"Failed to decode page {i + 1} of chapter {self.chapter + 1}:\n\t{future.exception()}", err=True)
+                continue
+            image = PIL.ImageTk.PhotoImage(future.result())
+            size = (image.width(), image.height())
+            # Kept in the page like CbzReader.size so it's laid out right the next time
+            self.pages[i]["width"], self.pages[i]["height"] = size
+            if size != self.sizes[i]:
+                self.resize(i, size)
+                resized = True
+            self.cache.put((self.chapter, i), image)
+            if i in self.visible():
+                self.realize(i, image)
+        if resized:
+            # Pages may have moved into or out of the visible area
+            self.update()
+        self.schedule_poll()
+
+    def close(self) -> None:
+        """Stops decoding and closes the cbz file"""
+
+        if self.poll_id is not None:
+            self.canvas.after_cancel(self.poll_id)
+        self.executor.shutdown(wait=True, cancel_futures=True)
+        if self.reader is not None:
+            self.reader.close()
@@ -0,0 +1,62 @@
+import os
+import zipfile
+import click
+
+from src import archive, constants, session, stats
+from src.compile import get_images
+from src.download import download_options, get_downloader
+from src.manifest import MANIFEST_NAME
+
+
+@click.command()
+@click.help_option("-h", "--help")
+@click.argument("name")
+@click.argument("url")
+@download_options
+@click.option("-v", "--verbose", "verbose", default=False, is_flag=True, help="Show more information.")
+def update(name: str, url: str, provider: str | None, workers: int, timeout: float, rate: float | None, engine: str, cache_size: int, retry_failed: bool, stats_path: str | None, verbose: bool) -> None:
+    """Appends new chapters to a cbz file
+
+        NAME: the name of the cbz file to update
+
+        URL: the url to the homepage of the series
+
+        Only the chapters after the last chapter in the cbz file are downloaded and
+        they are appended to it in place, the pages already in it are not repacked.
+        The downloaded images are deleted from temp_images once appended.
+    """
+
+    cbz_path = os.path.join(constants.get_root_dir(), name if name.endswith(".cbz") else name + ".cbz")
+    if not os.path.exists(cbz_path):
+        click.echo(f"{name} does not exist at {cbz_path}.", err=True)
+        return
+
+    stats.reset()
+    try:
+        with zipfile.ZipFile(cbz_path, "r") as zf:
+            pages = archive.read_pages(zf)
+        chapters = max((archive.chapter_number(page["key"]) for page in pages), default=0)
+        click.echo(f"{cbz_path} has {chapters} chapters.")
+
+        session.configure(workers, timeout, rate, cache_size * 1024 * 1024)
+        if not get_downloader(url, provider).download(engine, skip=chapters, retry_failed=retry_failed):
+            return
+
+        images = get_images()
+        if not images:
+            click.echo(f"No new chapters to add to {cbz_path}.")
+        else:
+            with stats.timer("pack"):
+                archive.append_pages(cbz_path, images, verbose)
+            click.echo(f"Appended {len(images)} images to {cbz_path}.")
+
+        for image in images:
+            os.remove(image)
+        os.remove(os.path.join(constants.get_temp_images_dir(), MANIFEST_NAME))
+    except constants.ProgError as e:
+        raise Exception(e)
+    except Exception as e:
+        click.echo(f"Error occurred while updating:\n\t{e}", err=True)
+    finally:
+        session.close()
+        stats.report(stats_path)